@@ -0,0 +1,899 @@
+#!/usr/bin/env python3
+"""Ingest/search benchmarks over a synthetic docs/MaraudersMap corpus; prints JSON for run-to-run comparison."""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import shards_db
+import shards_search
+
+AI_HINT_KINDS = ("AI RULE", "AI DECISION", "AI TODO", "AI CONTEXT")
+
+
+def _vocabulary(size, rng):
+    consonants, vowels = "bcdfghklmnprstvz", "aeiou"
+    words = set()
+    while len(words) < size:
+        n = rng.randint(2, 4)
+        words.add("".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(n)))
+    return sorted(words)
+
+
+class Corpus:
+    """Seeded generator for `<root>/<docId>/<docId>.rewritten_v1.md` trees with Zipf-distributed words."""
+
+    def __init__(
+        self,
+        docs=100,
+        sections=8,
+        heading_depth=3,
+        section_tokens=200,
+        keywords=4,
+        hint_density=0.1,
+        vocab=5000,
+        seed=1,
+        shared=0.0,
+    ):
+        self.docs = docs
+        self.sections = sections
+        self.heading_depth = heading_depth
+        self.section_tokens = section_tokens
+        self.keywords = keywords
+        self.hint_density = hint_density
+        self.seed = seed
+        self.shared = shared
+        rng = random.Random(seed)
+        self.words = _vocabulary(vocab, rng)
+        self._weights = [1.0 / (rank + 1) for rank in range(len(self.words))]
+        self.keyword_pool = [f"kw-{w}" for w in self.words[:200]]
+        # Boilerplate sections (licenses, shared preambles) repeated verbatim across docs.
+        self._boilerplate = [
+            (f"Shared {self._sentence(rng, 2).title()}", self._sentence(rng, section_tokens))
+            for _ in range(8)
+        ]
+
+    def config(self):
+        return {
+            "docs": self.docs,
+            "sections": self.sections,
+            "heading_depth": self.heading_depth,
+            "section_tokens": self.section_tokens,
+            "keywords": self.keywords,
+            "hint_density": self.hint_density,
+            "vocab": len(self.words),
+            "seed": self.seed,
+            "shared": self.shared,
+        }
+
+    def doc_id(self, i):
+        return f"doc-{i:05d}"
+
+    def _sentence(self, rng, n):
+        return " ".join(rng.choices(self.words, weights=self._weights, k=n))
+
+    def render(self, i, revision=1):
+        rng = random.Random(f"{self.seed}:{i}:{revision}")
+        doc_id = self.doc_id(i)
+        keywords = rng.sample(self.keyword_pool, min(self.keywords, len(self.keyword_pool)))
+        lines = [
+            "---",
+            f"title: {doc_id}",
+            f"tags: [{', '.join(keywords)}]",
+            f"summary: {self._sentence(rng, 8)}",
+            "---",
+            f"# {doc_id}",
+            "",
+            self._sentence(rng, 30),
+            "",
+        ]
+        for s in range(self.sections):
+            depth = 2 + (s % max(1, self.heading_depth - 1))
+            if self.shared and rng.random() < self.shared:
+                title, body = rng.choice(self._boilerplate)
+                lines += [f"{'#' * min(depth, 6)} {title}", "", body, ""]
+                continue
+            lines.append(f"{'#' * min(depth, 6)} {self._sentence(rng, 3).title()}")
+            lines.append("")
+            written = 0
+            while written < self.section_tokens:
+                if rng.random() < self.hint_density:
+                    lines.append(f"> [{rng.choice(AI_HINT_KINDS)}] {self._sentence(rng, 12)}")
+                    lines.append("")
+                    written += 14
+                n = min(60, self.section_tokens - written) or 1
+                lines.append(self._sentence(rng, n))
+                lines.append("")
+                written += n
+        return "\n".join(lines)
+
+    def write(self, root):
+        for i in range(self.docs):
+            self.write_doc(root, i)
+
+    def write_doc(self, root, i, revision=1):
+        doc_root = os.path.join(root, self.doc_id(i))
+        os.makedirs(doc_root, exist_ok=True)
+        path = os.path.join(doc_root, f"{self.doc_id(i)}.rewritten_v1.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.render(i, revision))
+        return doc_root
+
+
+def _ms(seconds):
+    return round(seconds * 1000.0, 3)
+
+
+def _time(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def _time_queries(fn, args_list, repeat):
+    samples = []
+    hits = 0
+    for args in args_list:
+        for _ in range(repeat):
+            elapsed, results = _time(lambda: fn(*args))
+            samples.append(elapsed)
+        hits += len(results)
+    return {
+        "queries": len(args_list),
+        "repeat": repeat,
+        "p50_ms": _ms(statistics.median(samples)),
+        "min_ms": _ms(min(samples)),
+        "max_ms": _ms(max(samples)),
+        "avg_hits": round(hits / max(1, len(args_list)), 2),
+    }
+
+
+def _db_bytes(db_file):
+    return sum(
+        os.path.getsize(db_file + suffix)
+        for suffix in ("", "-wal", "-shm")
+        if os.path.exists(db_file + suffix)
+    )
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KiB elsewhere.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _ingest_all(db_file, map_root, jobs):
+    conn = shards_db.connect(db_file)
+    try:
+        with conn:
+            shards_db.init_schema(conn)
+        return shards_db.ingest_all(conn, map_root, jobs=jobs)
+    finally:
+        conn.close()
+
+
+def _query_sets(corpus, db_file, n):
+    rng = random.Random(corpus.seed + 7)
+    common = corpus.words[:50]
+    rare = corpus.words[len(corpus.words) // 2 :]
+    conn = shards_search._connect_ro(db_file)
+    try:
+        sample = [
+            r[0]
+            for r in conn.execute(
+                "SELECT content FROM sections_full ORDER BY random() LIMIT ?", (n,)
+            )
+        ]
+    finally:
+        conn.close()
+    phrases = []
+    for content in sample:
+        words = re.findall(r"[a-z]{4,}", content)
+        if len(words) >= 2:
+            i = rng.randrange(len(words) - 1)
+            phrases.append((words[i], words[i + 1]))
+    return {
+        "bm25_common": [rng.choice(common) for _ in range(n)],
+        "bm25_rare": [rng.choice(rare) for _ in range(n)],
+        "bm25_two_terms": [f"{rng.choice(common)} {rng.choice(rare)}" for _ in range(n)],
+        "keyword": [rng.choice(corpus.keyword_pool) for _ in range(n)],
+        "regex_literal": [rf"{a}\s+{b}" for a, b in phrases] or [corpus.words[0]],
+        "regex_no_literal": [r"\b[a-z]{4}\s+[a-z]{4}\b"],
+    }
+
+
+def bench_core(corpus, jobs, repeat, queries):
+    """Timings for schema init, full/no-op/edit ingests and keyword/bm25/regex lookups."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        db_file = shards_db.db_path(map_root)
+        timings = {}
+        elapsed, _ = _time(lambda: corpus.write(map_root))
+        timings["generate_s"] = round(elapsed, 4)
+
+        def init():
+            conn = shards_db.connect(db_file)
+            with conn:
+                shards_db.init_schema(conn)
+            conn.close()
+
+        elapsed, _ = _time(init)
+        timings["init_schema_ms"] = _ms(elapsed)
+        elapsed, (counts, stages) = _time(lambda: _ingest_all(db_file, map_root, jobs))
+        timings["ingest_all_cold_s"] = round(elapsed, 4)
+        timings["ingest_all_cold_stages_s"] = {k: round(v, 4) for k, v in stages.items()}
+        elapsed, (noop_counts, _) = _time(lambda: _ingest_all(db_file, map_root, jobs))
+        timings["ingest_all_noop_s"] = round(elapsed, 4)
+
+        doc_root = corpus.write_doc(map_root, corpus.docs // 2, revision=2)
+        conn = shards_db.connect(db_file)
+        try:
+            def edit():
+                with conn:
+                    return shards_db.ingest_doc(conn, doc_root)
+
+            elapsed, edit_result = _time(edit)
+        finally:
+            conn.close()
+        timings["ingest_single_edit_ms"] = _ms(elapsed)
+
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        elapsed, _ = _time(lambda: _ingest_all(db_file, map_root, jobs))
+        timings["ingest_all_warm_s"] = round(elapsed, 4)
+
+        conn = shards_db.connect(db_file)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        db_bytes = _db_bytes(db_file)
+
+        sets = _query_sets(corpus, db_file, queries)
+        conn = shards_search._connect_ro(db_file)
+        columns = shards_search._projection(False)
+        try:
+            search = {
+                "bm25_common": _time_queries(
+                    lambda q: shards_search.search_db_bm25(conn, q, limit=5, columns=columns),
+                    [(q,) for q in sets["bm25_common"]],
+                    repeat,
+                ),
+                "bm25_rare": _time_queries(
+                    lambda q: shards_search.search_db_bm25(conn, q, limit=5, columns=columns),
+                    [(q,) for q in sets["bm25_rare"]],
+                    repeat,
+                ),
+                "bm25_two_terms": _time_queries(
+                    lambda q: shards_search.search_db_bm25(conn, q, limit=5, columns=columns),
+                    [(q,) for q in sets["bm25_two_terms"]],
+                    repeat,
+                ),
+                "keyword": _time_queries(
+                    lambda q: shards_search.search_db_keyword(conn, q, limit=5, columns=columns),
+                    [(q,) for q in sets["keyword"]],
+                    repeat,
+                ),
+                "regex_literal": _time_queries(
+                    lambda q: shards_search.search_db_regex(
+                        conn, q, limit=5, flags=re.IGNORECASE, columns=columns
+                    ),
+                    [(q,) for q in sets["regex_literal"]],
+                    repeat,
+                ),
+                "regex_no_literal": _time_queries(
+                    lambda q: shards_search.search_db_regex(
+                        conn, q, limit=5, flags=re.IGNORECASE, columns=columns
+                    ),
+                    [(q,) for q in sets["regex_no_literal"]],
+                    repeat,
+                ),
+            }
+        finally:
+            conn.close()
+        return {
+            "sections": counts["sections"],
+            "noop_files_skipped": noop_counts["files_skipped"],
+            "edit_upserted": edit_result[2],
+            "timings": timings,
+            "search": search,
+            "db_bytes": db_bytes,
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _legacy_write_sections(conn, doc_id, sections, now):
+    """The pre-bulk writer: one INSERT OR REPLACE per changed section, kept as a baseline."""
+    stored = [i for i, c in enumerate(shards_db.SECTION_COLUMNS) if c != "content"]
+    by_id = {s["id"]: s for s in sections if s.get("id")}
+    existing = dict(
+        conn.execute("SELECT id, content_hash FROM sections WHERE doc_id=?", (doc_id,)).fetchall()
+    )
+    inserted = skipped = 0
+    for sid, s in by_id.items():
+        if existing.get(sid) == s.get("content_hash"):
+            skipped += 1
+            continue
+        row = shards_db._section_row(doc_id, s, now)
+        conn.execute(
+            "INSERT OR IGNORE INTO blobs(hash, content) VALUES(?, ?)", (row[5], row[4])
+        )
+        conn.execute(
+            f"INSERT OR REPLACE INTO sections({', '.join(shards_db.STORED_COLUMNS)}, blob_id) "
+            f"VALUES({', '.join('?' * len(stored))}, (SELECT id FROM blobs WHERE hash = ?))",
+            [row[i] for i in stored] + [row[5]],
+        )
+        inserted += 1
+    ph = ",".join(["?"] * len(by_id))
+    deleted = conn.execute(
+        f"DELETE FROM sections WHERE doc_id=? AND id NOT IN ({ph})", [doc_id, *by_id]
+    ).rowcount
+    shards_db._collect_blobs(conn)
+    if inserted or deleted:
+        shards_db.bump_generation(conn)
+    return len(by_id), inserted, skipped
+
+
+def _edit_sections(sections, variant, rng):
+    out = []
+    for i, s in enumerate(sections):
+        s = dict(s)
+        if variant == "metadata":
+            start, end = s["line_range"]
+            s["line_range"] = [start + 1, end + 1]
+        elif variant == "all_sections" or (variant == "one_section" and i == 1):
+            s["content"] = s["content"] + f"\nedited {rng.random():.6f}"
+            s["content_hash"] = shards_db._sha(s["content"])
+        out.append(s)
+    if variant == "add_remove" and out:
+        out = out[1:] + [dict(out[0], id=out[0]["id"] + "-moved")]
+    return out
+
+
+UPSERT_VARIANTS = ("unchanged", "metadata", "one_section", "all_sections", "add_remove")
+
+
+def bench_upsert(corpus, jobs, repeat, queries):
+    """Row-wise INSERT OR REPLACE vs the staged set-based upsert, per kind of doc edit."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        corpus.write(map_root)
+        db_file = shards_db.db_path(map_root)
+        _ingest_all(db_file, map_root, jobs)
+        conn = shards_db.connect(db_file)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        docs = [(os.path.basename(d), shards_db.load_sections(d)) for d in shards_db.discover_docs(map_root)]
+        writers = {"rowwise": _legacy_write_sections, "bulk": shards_db._write_sections}
+        results = {}
+        for variant in UPSERT_VARIANTS:
+            rng = random.Random(corpus.seed)
+            edited = [(doc_id, _edit_sections(secs, variant, rng)) for doc_id, secs in docs]
+            results[variant] = {}
+            for name, write in writers.items():
+                best = None
+                for _ in range(repeat):
+                    work = os.path.join(tmp, f"work-{name}.db")
+                    shutil.copyfile(db_file, work)
+                    conn = shards_db.connect(work)
+                    try:
+                        now = shards_db._utc()
+                        with shards_db.trace_statements(conn) as trace:
+                            started = time.perf_counter()
+                            for doc_id, secs in edited:
+                                with conn:
+                                    write(conn, doc_id, secs, now)
+                            elapsed = time.perf_counter() - started
+                        for fts in shards_db.FTS_TABLES:
+                            conn.execute(
+                                f"INSERT INTO {fts}({fts}, rank) VALUES('integrity-check', 1)"
+                            )
+                    finally:
+                        conn.close()
+                        for suffix in ("", "-wal", "-shm"):
+                            if os.path.exists(work + suffix):
+                                os.remove(work + suffix)
+                    if best is None or elapsed < best["seconds"]:
+                        best = {
+                            "seconds": round(elapsed, 4),
+                            "statements": sum(trace["statements"].values()),
+                            "fts_statements": sum(trace["nested_statements"].values()),
+                            "rows_changed": trace["rows_changed"],
+                        }
+                results[variant][name] = best
+            results[variant]["speedup"] = round(
+                results[variant]["rowwise"]["seconds"] / max(results[variant]["bulk"]["seconds"], 1e-9), 2
+            )
+        return {"docs_written": len(docs), "variants": results}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _typo(word, rng):
+    i = rng.randrange(len(word))
+    op = rng.choice("dris")
+    if op == "d":
+        return word[:i] + word[i + 1 :]
+    if op == "r":
+        return word[:i] + rng.choice("bcdfghklmnprstvz") + word[i + 1 :]
+    if op == "i":
+        return word[:i] + rng.choice("aeiou") + word[i:]
+    return word[:i] + word[i + 1 : i + 2] + word[i] + word[i + 2 :] if i + 1 < len(word) else word[:-1]
+
+
+def bench_fuzzy(corpus, jobs, repeat, queries):
+    """Prefix queries with vs without FTS5 prefix indexes, and --fuzzy expansion cost/recall."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        corpus.write(map_root)
+        db_file = shards_db.db_path(map_root)
+        _ingest_all(db_file, map_root, jobs)
+        conn = shards_db.connect(db_file)
+        with conn:
+            # Same index without prefix=, for comparison.
+            conn.execute(
+                "CREATE VIRTUAL TABLE bench_noprefix USING fts5(title, content, keywords, tokenize='porter unicode61', content='sections_full', content_rowid='rowid')"
+            )
+            conn.execute("INSERT INTO bench_noprefix(bench_noprefix) VALUES('rebuild')")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        vocab_terms = conn.execute("SELECT COUNT(*) FROM sections_fts_vocab").fetchone()[0]
+        conn.close()
+
+        rng = random.Random(corpus.seed + 11)
+        words = corpus.words
+        prefixes = {n: [rng.choice(words)[:n] for _ in range(queries)] for n in (2, 3, 4)}
+        common, rare = words[:200], words[len(words) // 2 :]
+        typos = [(w, _typo(w, rng)) for w in rng.sample(common, min(queries, len(common)))]
+        typos += [(w, _typo(w, rng)) for w in rng.sample(rare, min(queries, len(rare)))]
+
+        conn = shards_search._connect_ro(db_file)
+        try:
+            prefix = {}
+            for n, terms in prefixes.items():
+                for table in ("sections_fts", "bench_noprefix"):
+                    sql = f"SELECT COUNT(*) FROM {table} WHERE {table} MATCH ?"
+                    prefix[f"{table}_len{n}"] = _time_queries(
+                        lambda q: conn.execute(sql, (q,)).fetchall(),
+                        [(f'"{t}"*',) for t in terms],
+                        repeat,
+                    )
+            samples, recovered, expanded = [], 0, 0
+            for word, typo in typos:
+                for _ in range(repeat):
+                    elapsed, (query, alternatives) = _time(
+                        lambda: shards_search._expand_query(conn, typo)
+                    )
+                    samples.append(elapsed)
+                if alternatives:
+                    expanded += 1
+                    want = {r[0] for r in conn.execute(
+                        "SELECT rowid FROM sections_fts WHERE sections_fts MATCH ?",
+                        (shards_search._fts_phrase(word),),
+                    )}
+                    got = {r[0] for r in conn.execute(
+                        "SELECT rowid FROM sections_fts WHERE sections_fts MATCH ?", (query,)
+                    )}
+                    recovered += bool(want) and want <= got
+            fuzzy = {
+                "typos": len(typos),
+                "expanded": expanded,
+                "recovered": recovered,
+                "p50_ms": _ms(statistics.median(samples)),
+                "max_ms": _ms(max(samples)),
+                "scan_limit": shards_search.FUZZY_SCAN_LIMIT,
+                "max_expansions": shards_search.FUZZY_MAX_EXPANSIONS,
+            }
+        finally:
+            conn.close()
+        return {"vocab_terms": vocab_terms, "prefix": prefix, "fuzzy": fuzzy}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_hybrid(corpus, jobs, repeat, queries, dim=256):
+    """Recall@5 and latency of plain BM25 vs --hybrid on paraphrase-like queries."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        corpus.write(map_root)
+        db_file = shards_db.db_path(map_root)
+        _ingest_all(db_file, map_root, jobs)
+        conn = shards_db.connect(db_file)
+        with conn:
+            shards_db._meta_set(conn, "vector_dim", dim)
+            elapsed, _ = _time(lambda: shards_db.fill_vectors(conn, dim))
+        rng = random.Random(corpus.seed + 13)
+        targets = conn.execute(
+            "SELECT id, content FROM sections_full WHERE parent_id IS NULL ORDER BY random() LIMIT ?",
+            (queries,),
+        ).fetchall()
+        conn.close()
+        rank_of = {w: i for i, w in enumerate(corpus.words)}
+        cases = []
+        for target in targets:
+            words = set(re.findall(r"[a-z]+", target["content"])) & rank_of.keys()
+            if len(words) < 4:
+                continue
+            picked = rng.sample(sorted(words, key=lambda w: -rank_of[w])[:6], 3)
+            picked[0] = _typo(picked[0], rng)
+            picked[1] = _typo(picked[1], rng)
+            noise = [w for w in rng.sample(corpus.words[100:], 10) if w not in words][:2]
+            cases.append((target["id"], " ".join(picked + noise)))
+        modes = {
+            "bm25": lambda c, q: shards_search.search_db_bm25(c, q, limit=5, columns=("id",)),
+            "bm25_any": lambda c, q: shards_search.search_db_bm25(
+                c, shards_search._any_terms_query(q), limit=5, columns=("id",)
+            ),
+            "hybrid_linear": lambda c, q: shards_search.search_db_hybrid(c, q, limit=5, columns=("id",)),
+            "hybrid_rrf": lambda c, q: shards_search.search_db_hybrid(
+                c, q, limit=5, columns=("id",), fusion="rrf"
+            ),
+            "hybrid_brute_force": lambda c, q: shards_search.search_db_hybrid(
+                c, q, limit=5, columns=("id",), brute_force=True
+            ),
+        }
+        conn = shards_search._connect_ro(db_file)
+        try:
+            report = {}
+            for name, fn in modes.items():
+                samples, found = [], 0
+                for target_id, query in cases:
+                    for _ in range(repeat):
+                        t, results = _time(lambda: fn(conn, query))
+                        samples.append(t)
+                    found += any(r["id"] == target_id for r in results)
+                report[name] = {
+                    "recall_at_5": round(found / max(1, len(cases)), 3),
+                    "p50_ms": _ms(statistics.median(samples)),
+                    "max_ms": _ms(max(samples)),
+                }
+        finally:
+            conn.close()
+        return {
+            "queries": len(cases),
+            "vector_dim": dim,
+            "numpy": shards_search.np is not None,
+            "vectorize_s": round(elapsed, 4),
+            "modes": report,
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _fts_bytes(conn, table):
+    return conn.execute(f"SELECT COALESCE(SUM(length(block)), 0) FROM {table}_data").fetchone()[0]
+
+
+def bench_dedup(corpus, jobs, repeat, queries):
+    """Content-addressed storage: blob/section counts, content and trigram bytes with vs without dedup."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        corpus.write(map_root)
+        db_file = shards_db.db_path(map_root)
+        elapsed, _ = _time(lambda: _ingest_all(db_file, map_root, jobs))
+        conn = shards_db.connect(db_file)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            db_bytes = _db_bytes(db_file)
+            stats = shards_db.blob_stats(conn)
+            fts = {"blobs_trigram": _fts_bytes(conn, "blobs_trigram")}
+            # The same trigram index per section, as before blobs, for comparison.
+            conn.execute("CREATE VIRTUAL TABLE bench_flat_trigram USING fts5(content, tokenize='trigram')")
+            conn.execute("INSERT INTO bench_flat_trigram(rowid, content) SELECT rowid, content FROM sections_full")
+            per_section = {"blobs_trigram": _fts_bytes(conn, "bench_flat_trigram")}
+        finally:
+            conn.close()
+        saved = stats["content_bytes_saved"] + sum(per_section[t] - fts[t] for t in fts)
+        return {
+            "ingest_all_s": round(elapsed, 4),
+            "db_bytes": db_bytes,
+            **stats,
+            "fts_bytes": fts,
+            "fts_bytes_per_section": per_section,
+            "bytes_saved": saved,
+            "saved_pct_of_db": round(100.0 * saved / (db_bytes + saved), 2),
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _resplit_section(conn, section_id):
+    """The old fallback: re-read and re-split the rewritten file to reach one section."""
+    doc_id = section_id.split(":", 1)[0]
+    path = conn.execute(
+        "SELECT rewritten_path FROM doc_manifest WHERE doc_id=?", (doc_id,)
+    ).fetchone()[0]
+    return [s for s in shards_db.load_sections(os.path.dirname(path)) if s["id"] == section_id]
+
+
+def bench_read(corpus, jobs, repeat, queries):
+    """Reading one section: by byte offset from the mmapped file vs the index vs re-splitting the file."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        corpus.write(map_root)
+        db_file = shards_db.db_path(map_root)
+        _ingest_all(db_file, map_root, jobs)
+        conn = shards_search._connect_ro(db_file)
+        try:
+            ids = [
+                (r[0],)
+                for r in conn.execute(
+                    "SELECT id FROM sections ORDER BY rowid % 7919, rowid LIMIT ?", (queries,)
+                )
+            ]
+            served = Counter(
+                s["served_from"] for s in shards_search.read_sections(conn, [i for (i,) in ids])
+            )
+            timings = {
+                "mmap": _time_queries(lambda i: shards_search.read_sections(conn, [i]), ids, repeat),
+                "index": _time_queries(
+                    lambda i: conn.execute(
+                        "SELECT content FROM sections_full WHERE id=?", (i,)
+                    ).fetchall(),
+                    ids,
+                    repeat,
+                ),
+                "resplit": _time_queries(lambda i: _resplit_section(conn, i), ids, repeat),
+            }
+        finally:
+            conn.close()
+        return {"sections_read": len(ids), "served_from": dict(served), "read": timings}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# bench_compress storage modes -> --dict-bytes (None = plain text blobs).
+COMPRESS_MODES = {"plain": None, "zlib": shards_db.DEFAULT_DICT_BYTES, "zlib_no_dict": 0}
+
+
+def bench_compress(corpus, jobs, repeat, queries):
+    """Compressed content storage (--compress zlib) vs plain text: DB size, ingest and query latency."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        source = os.path.join(tmp, "corpus")
+        corpus.write(source)
+        sets = None
+        modes = {}
+        for mode, dict_bytes in COMPRESS_MODES.items():
+            map_root = os.path.join(tmp, mode, "MaraudersMap")
+            shutil.copytree(source, map_root)
+            db_file = shards_db.db_path(map_root)
+            timings = {}
+            elapsed, _ = _time(lambda: _ingest_all(db_file, map_root, jobs))
+            timings["ingest_all_cold_s"] = round(elapsed, 4)
+            conn = shards_db.connect(db_file)
+            try:
+                if dict_bytes is not None:
+                    def compress():
+                        with conn:
+                            return shards_db.set_content_codec(conn, "zlib", dict_bytes)
+
+                    elapsed, _ = _time(compress)
+                    timings["compress_s"] = round(elapsed, 4)
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                sizes = {
+                    "db_bytes": _db_bytes(db_file),
+                    **shards_db.blob_stats(conn),
+                    "fts_bytes": {t: _fts_bytes(conn, t) for t in ("sections_fts", "blobs_trigram")},
+                }
+            finally:
+                conn.close()
+            for i in range(corpus.docs):
+                corpus.write_doc(map_root, i, revision=2)
+            elapsed, _ = _time(lambda: _ingest_all(db_file, map_root, jobs))
+            timings["ingest_all_edit_s"] = round(elapsed, 4)
+            if sets is None:
+                sets = _query_sets(corpus, db_file, queries)
+            conn = shards_search._connect_ro(db_file)
+            ids = shards_search._projection(False)
+            full = shards_search._projection(True)
+            try:
+                search = {
+                    "bm25_common": _time_queries(
+                        lambda q: shards_search.search_db_bm25(conn, q, limit=5, columns=ids),
+                        [(q,) for q in sets["bm25_common"]],
+                        repeat,
+                    ),
+                    "bm25_snippet": _time_queries(
+                        lambda q: shards_search.search_db_bm25(
+                            conn, q, limit=5, columns=ids, snippet=160
+                        ),
+                        [(q,) for q in sets["bm25_common"]],
+                        repeat,
+                    ),
+                    "bm25_full": _time_queries(
+                        lambda q: shards_search.search_db_bm25(conn, q, limit=5, columns=full),
+                        [(q,) for q in sets["bm25_common"]],
+                        repeat,
+                    ),
+                    "keyword_full": _time_queries(
+                        lambda q: shards_search.search_db_keyword(conn, q, limit=5, columns=full),
+                        [(q,) for q in sets["keyword"]],
+                        repeat,
+                    ),
+                    "regex_literal": _time_queries(
+                        lambda q: shards_search.search_db_regex(
+                            conn, q, limit=5, flags=re.IGNORECASE, columns=ids
+                        ),
+                        [(q,) for q in sets["regex_literal"]],
+                        repeat,
+                    ),
+                }
+            finally:
+                conn.close()
+            modes[mode] = {"dict_bytes": dict_bytes, "timings": timings, **sizes, "search": search}
+        return {"modes": modes}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _group_flat(conn, query, per_doc):
+    """The old way to rank docs: fetch every hit, then group in Python."""
+    docs = {}
+    for r in shards_search.search_db_bm25(conn, query, limit=None, columns=("id", "doc_id")):
+        docs.setdefault(r["doc_id"], []).append(r)
+    return sorted(
+        ([d, hits[:per_doc]] for d, hits in docs.items()),
+        key=lambda x: (x[1][0]["rank"], x[0]),
+    )[:5]
+
+
+def bench_docs(corpus, jobs, repeat, queries):
+    """Doc-level BM25 (--by-doc) and --facets in one SQL pass vs fetching every hit and grouping in Python."""
+    tmp = tempfile.mkdtemp(prefix="mm-bench-")
+    try:
+        map_root = os.path.join(tmp, "MaraudersMap")
+        os.makedirs(map_root)
+        corpus.write(map_root)
+        db_file = shards_db.db_path(map_root)
+        _ingest_all(db_file, map_root, jobs)
+        sets = _query_sets(corpus, db_file, queries)
+        conn = shards_search._connect_ro(db_file)
+        columns = shards_search._projection(False)
+        try:
+            search = {}
+            for name in ("bm25_common", "bm25_rare"):
+                args = [(q,) for q in sets[name]]
+                search[name] = {
+                    "flat_top5": _time_queries(
+                        lambda q: shards_search.search_db_bm25(conn, q, limit=5, columns=columns),
+                        args,
+                        repeat,
+                    ),
+                    "by_doc": _time_queries(
+                        lambda q: shards_search.search_db_docs(
+                            conn, q, limit=5, per_doc=3, columns=columns
+                        ),
+                        args,
+                        repeat,
+                    ),
+                    "flat_all_grouped": _time_queries(lambda q: _group_flat(conn, q, 3), args, repeat),
+                    "facets": _time_queries(
+                        lambda q: [shards_search.search_facets(conn, q)], args, repeat
+                    ),
+                }
+        finally:
+            conn.close()
+        return {"search": search}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+SCENARIOS = {
+    "core": bench_core,
+    "upsert": bench_upsert,
+    "fuzzy": bench_fuzzy,
+    "hybrid": bench_hybrid,
+    "dedup": bench_dedup,
+    "read": bench_read,
+    "compress": bench_compress,
+    "docs": bench_docs,
+}
+
+
+def _run_one(scenario, corpus_kwargs, jobs, repeat, queries):
+    corpus = Corpus(**corpus_kwargs)
+    result = SCENARIOS[scenario](corpus, jobs, repeat, queries)
+    result["corpus"] = corpus.config()
+    result["peak_rss_kb"] = _peak_rss_kb()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="core")
+    parser.add_argument(
+        "--sizes", default="100,1000", help="Comma-separated doc counts to benchmark."
+    )
+    parser.add_argument("--sections", type=int, default=8, help="Sections per doc.")
+    parser.add_argument("--heading-depth", type=int, default=3)
+    parser.add_argument("--section-tokens", type=int, default=200)
+    parser.add_argument("--keywords", type=int, default=4, help="Frontmatter keywords per doc.")
+    parser.add_argument(
+        "--hint-density", type=float, default=0.1, help="Chance of an [AI ...] hint per paragraph."
+    )
+    parser.add_argument("--vocab", type=int, default=5000, help="Distinct words in the corpus.")
+    parser.add_argument(
+        "--shared", type=float, default=0.0, help="Fraction of sections that are shared boilerplate."
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--jobs", type=int, default=1, help="Parse workers for ingest_all.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query.")
+    parser.add_argument("--queries", type=int, default=20, help="Queries per query set.")
+    parser.add_argument("--output", help="Write JSON here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    runs = []
+    # A fresh process per size keeps peak RSS and page-cache effects per run.
+    ctx = get_context("spawn")
+    for docs in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        corpus_kwargs = {
+            "docs": docs,
+            "sections": args.sections,
+            "heading_depth": args.heading_depth,
+            "section_tokens": args.section_tokens,
+            "keywords": args.keywords,
+            "hint_density": args.hint_density,
+            "vocab": args.vocab,
+            "seed": args.seed,
+            "shared": args.shared,
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            runs.append(
+                pool.submit(
+                    _run_one, args.scenario, corpus_kwargs, args.jobs, args.repeat, args.queries
+                ).result()
+            )
+        print(f"{args.scenario}: {docs} docs done", file=sys.stderr)
+
+    report = {
+        "scenario": args.scenario,
+        "created_at": shards_db._utc(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "jobs": args.jobs,
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,36 @@
 #!/usr/bin/env python3
-import argparse, hashlib, json, os, re, sqlite3
+import argparse, bisect, contextlib, functools, hashlib, itertools, json, math, os, random, re, sqlite3, sys, time, zlib
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from urllib.parse import unquote
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to SQLite's own locking only.
+    fcntl = None
 
 AI_HINT_PATTERN = re.compile(r"^\s*>\s*\[(AI RULE|AI DECISION|AI TODO|AI CONTEXT)\]")
 TOKEN_COUNT_RE = re.compile(r"\S+")
 HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*$")
 REWRITTEN_FILE_RE = re.compile(r"^(?P<base>.+)\.rewritten_v(?P<version>\d+)\.md$")
 SLUG_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+LIST_ITEM_RE = re.compile(r"^(?:[-*+]|\d+[.)])\s+")
+# Inline `[text](target "title")` links (not images) and `[ref]: target` definitions.
+LINK_RE = re.compile(r"(?<!!)\[[^\]]*\]\(\s*<?([^)\s>]+)>?(?:\s+[^)]*)?\)")
+LINK_DEF_RE = re.compile(r"^\s{0,3}\[[^\]]+\]:\s*<?([^\s>]+)>?")
+INGEST_BATCH_DOCS = 200
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_LOCK_TIMEOUT_S = 300.0
+BUSY_RETRIES = 6
+VECTOR_WORD_RE = re.compile(r"\w+")
+# --compress zlib: deflate level, and dictionary training size and sample.
+CODEC_LEVEL = 6
+DEFAULT_DICT_BYTES = 16384
+DICT_SAMPLE_BLOBS = 4000
+DICT_WORD_RE = re.compile(r" ?\w+[^\w\n]?")
 
 
 def _utc():
@@ -59,7 +83,74 @@ def _find_latest_rewritten(doc_root, doc_id):
     return best
 
 
-def _build_section_record(doc_id, legacy_id, title, content, file_path, line_range, keywords=None, summary=""):
+def _doc_state(doc_root):
+    doc_root = os.path.abspath(doc_root)
+    doc_id = os.path.basename(doc_root)
+    path = _find_latest_rewritten(doc_root, doc_id)
+    st = os.stat(path)
+    return {
+        "doc_id": doc_id,
+        "rewritten_path": path,
+        "version": int(REWRITTEN_FILE_RE.match(os.path.basename(path)).group("version")),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def _stat_unchanged(state, row):
+    return bool(row) and (
+        row["rewritten_path"] == state["rewritten_path"]
+        and row["version"] == state["version"]
+        and row["size"] == state["size"]
+        and row["mtime_ns"] == state["mtime_ns"]
+    )
+
+
+def _link_target(doc_id, target):
+    # Section id ("<docId>:<slug>") or doc id a markdown link points at, or
+    # None for external and non-markdown targets. Other docs are named by
+    # their rewritten (or original) file name.
+    if "://" in target or target.startswith(("mailto:", "tel:")):
+        return None
+    path, _, anchor = target.partition("#")
+    if path:
+        name = unquote(path).replace("\\", "/").rstrip("/").rsplit("/", 1)[-1]
+        match = REWRITTEN_FILE_RE.match(name)
+        if match:
+            target_doc = match.group("base")
+        elif name.lower().endswith(".md"):
+            target_doc = name[:-3]
+        else:
+            return None
+    else:
+        target_doc = doc_id
+    if not anchor:
+        return target_doc if target_doc != doc_id else None
+    return f"{target_doc}:{_slugify(unquote(anchor))}"
+
+
+def _links(doc_id, content):
+    if "](" not in content and "]:" not in content:
+        return []
+    targets = []
+    fence = None
+    for line in content.splitlines():
+        m = FENCE_RE.match(line)
+        if fence:
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+        if m:
+            fence = m.group(1)
+            continue
+        for raw in LINK_RE.findall(line) + LINK_DEF_RE.findall(line):
+            target = _link_target(doc_id, raw)
+            if target and target not in targets:
+                targets.append(target)
+    return targets
+
+
+def _build_section_record(doc_id, legacy_id, title, content, file_path, line_range, keywords=None, summary="", parent_id=None, chunk_no=None, byte_range=None, heading_parent=None):
     return {
         "id": f"{doc_id}:{legacy_id}",
         "legacy_id": legacy_id,
@@ -68,7 +159,7 @@ def _build_section_record(doc_id, legacy_id, title, content, file_path, line_ran
         "content_hash": _sha(content),
         "token_count": _tok_count(content),
         "keywords": keywords or [],
-        "links": [],
+        "links": _links(doc_id, content),
         "ai_hints": [
             m.group(1)
             for m in (AI_HINT_PATTERN.match(l) for l in content.splitlines())
@@ -77,11 +168,133 @@ def _build_section_record(doc_id, legacy_id, title, content, file_path, line_ran
         "summary": summary,
         "line_range": line_range,
         "file_path": file_path,
+        "parent_id": parent_id,
+        "chunk_no": chunk_no,
+        "byte_range": byte_range,
+        # Enclosing heading's section id; only feeds section_edges.
+        "heading_parent": heading_parent,
     }
 
 
-def _sections_from_markdown(doc_id, md_path, text):
+def _line_offsets(text, lines):
+    # UTF-8 byte offset of each line start (plus one past the end), or None
+    # when splitlines() broke on something other than "\n" and the lines no
+    # longer map onto the file.
+    if lines and len(lines) != text.count("\n") + (not text.endswith("\n")):
+        return None
+    if text.isascii():
+        sizes = (len(l) + 1 for l in lines)
+    else:
+        sizes = (len(l.encode("utf-8")) + 1 for l in lines)
+    return list(itertools.accumulate(sizes, initial=0))
+
+
+def _byte_range(offsets, start, joined, content):
+    # [start, end) bytes of content == joined.strip(), where joined is
+    # "\n".join(lines[start:...]).
+    if offsets is None:
+        return None
+    lead = len(joined) - len(joined.lstrip())
+    if joined.isascii():
+        return [offsets[start] + lead, offsets[start] + lead + len(content)]
+    first = offsets[start] + len(joined[:lead].encode("utf-8"))
+    return [first, first + len(content.encode("utf-8"))]
+
+
+def _blocks(lines):
+    # (start, end, is_fence) spans split on blank lines and top-level list items;
+    # fenced code blocks are kept whole.
+    blocks = []
+    start = None
+    fence = None
+    for i, line in enumerate(lines):
+        if fence:
+            if line.strip().startswith(fence):
+                blocks.append((start, i + 1, True))
+                start = fence = None
+            continue
+        m = FENCE_RE.match(line)
+        if m:
+            if start is not None:
+                blocks.append((start, i, False))
+            start, fence = i, m.group(1)
+            continue
+        if not line.strip():
+            if start is not None:
+                blocks.append((start, i, False))
+                start = None
+            continue
+        if start is not None and LIST_ITEM_RE.match(line):
+            blocks.append((start, i, False))
+            start = None
+        if start is None:
+            start = i
+    if start is not None:
+        blocks.append((start, len(lines), bool(fence)))
+    return blocks
+
+
+def _chunk_ranges(lines, max_tokens):
+    ranges = []
+    cur_start = cur_end = None
+    cur_tokens = 0
+    for b_start, b_end, is_fence in _blocks(lines):
+        tokens = _tok_count("\n".join(lines[b_start:b_end]))
+        if tokens > max_tokens and not is_fence:
+            parts = [(i, i + 1) for i in range(b_start, b_end)]
+        else:
+            parts = [(b_start, b_end)]
+        for p_start, p_end in parts:
+            tokens = _tok_count("\n".join(lines[p_start:p_end]))
+            if cur_start is not None and cur_tokens + tokens > max_tokens:
+                ranges.append((cur_start, cur_end))
+                cur_start, cur_tokens = None, 0
+            if cur_start is None:
+                cur_start = p_start
+            cur_end = p_end
+            cur_tokens += tokens
+    if cur_start is not None:
+        ranges.append((cur_start, cur_end))
+    return ranges
+
+
+def _chunked(record, lines, start, end, max_tokens, offsets=None):
+    # Sections over max_tokens are stored only as child chunks; "<legacy_id>#<n>"
+    # ids keep per-chunk hashes stable for skip-by-hash re-ingest.
+    if not max_tokens or record["token_count"] <= max_tokens:
+        return [record]
+    doc_id = record["id"][: -len(record["legacy_id"]) - 1]
+    body = lines[start:end]
+    chunks = []
+    for n, (c_start, c_end) in enumerate(_chunk_ranges(body, max_tokens), 1):
+        joined = "\n".join(body[c_start:c_end])
+        content = joined.strip()
+        if not content:
+            continue
+        chunks.append(
+            _build_section_record(
+                doc_id=doc_id,
+                legacy_id=f"{record['legacy_id']}#{len(chunks) + 1}",
+                title=record["title"],
+                content=content,
+                file_path=record["file_path"],
+                line_range=[start + c_start + 1, start + c_end],
+                keywords=record["keywords"],
+                summary=record["summary"],
+                parent_id=record["id"],
+                chunk_no=len(chunks) + 1,
+                byte_range=_byte_range(offsets, start + c_start, joined, content),
+                heading_parent=record["heading_parent"],
+            )
+        )
+    return chunks
+
+
+def _sections_from_markdown(doc_id, md_path, text, chunk_tokens=0):
+    # byte_range offsets index the UTF-8 encoding of `text`, which is the
+    # file itself unless it had CR line endings (see _parse_doc).
     lines = text.splitlines()
+    offsets = _line_offsets(text, lines)
 
     fm_keywords = []
     fm_summary = ""
@@ -113,6 +326,7 @@ def _sections_from_markdown(doc_id, md_path, text):
 
     heading_positions = []
     heading_titles = []
+    heading_levels = []
     for idx, line in enumerate(lines):
         if idx <= fm_end_idx:
             continue
@@ -120,6 +334,7 @@ def _sections_from_markdown(doc_id, md_path, text):
         if match:
             heading_positions.append(idx)
             heading_titles.append(match.group(2).strip())
+            heading_levels.append(len(match.group(1)))
 
     sections = []
     slug_counts = {}
@@ -133,159 +348,1040 @@ def _sections_from_markdown(doc_id, md_path, text):
         return f"{base_slug}-{count}"
 
     if not heading_positions:
-        content_lines = lines[fm_end_idx + 1:] if fm_end_idx >= 0 else lines
-        content = "\n".join(content_lines).strip()
-        return [
-            _build_section_record(
-                doc_id=doc_id,
-                legacy_id="document",
-                title="Document",
-                content=content,
-                file_path=md_path,
-                line_range=[1, len(lines) if lines else 1],
-                keywords=fm_keywords,
-                summary=fm_summary,
-            )
-        ]
+        body_start = fm_end_idx + 1 if fm_end_idx >= 0 else 0
+        joined = "\n".join(lines[body_start:])
+        content = joined.strip()
+        record = _build_section_record(
+            doc_id=doc_id,
+            legacy_id="document",
+            title="Document",
+            content=content,
+            file_path=md_path,
+            line_range=[1, len(lines) if lines else 1],
+            keywords=fm_keywords,
+            summary=fm_summary,
+            byte_range=_byte_range(offsets, body_start, joined, content),
+        )
+        return _chunked(record, lines, fm_end_idx + 1, len(lines), chunk_tokens, offsets)
 
     first_heading = heading_positions[0]
     if first_heading > 0:
         start_idx = fm_end_idx + 1 if fm_end_idx >= 0 else 0
-        preamble = "\n".join(lines[start_idx:first_heading]).strip()
+        joined = "\n".join(lines[start_idx:first_heading])
+        preamble = joined.strip()
         if preamble:
-            sections.append(
-                _build_section_record(
-                    doc_id=doc_id,
-                    legacy_id=next_slug("document-overview"),
-                    title="Document Overview",
-                    content=preamble,
-                    file_path=md_path,
-                    line_range=[1, first_heading],
-                    keywords=fm_keywords,
-                    summary=fm_summary,
-                )
+            record = _build_section_record(
+                doc_id=doc_id,
+                legacy_id=next_slug("document-overview"),
+                title="Document Overview",
+                content=preamble,
+                file_path=md_path,
+                line_range=[1, first_heading],
+                keywords=fm_keywords,
+                summary=fm_summary,
+                byte_range=_byte_range(offsets, start_idx, joined, preamble),
             )
+            sections.extend(_chunked(record, lines, start_idx, first_heading, chunk_tokens, offsets))
 
+    enclosing = []  # (level, section id) of the open headings above this one
     for idx, start in enumerate(heading_positions):
+        level = heading_levels[idx]
+        while enclosing and enclosing[-1][0] >= level:
+            enclosing.pop()
         end_exclusive = (
             heading_positions[idx + 1]
             if idx + 1 < len(heading_positions)
             else len(lines)
         )
-        chunk_lines = lines[start:end_exclusive]
-        chunk = "\n".join(chunk_lines).strip()
+        joined = "\n".join(lines[start:end_exclusive])
+        chunk = joined.strip()
         title = heading_titles[idx]
-        sections.append(
-            _build_section_record(
-                doc_id=doc_id,
-                legacy_id=next_slug(title),
-                title=title,
-                content=chunk,
-                file_path=md_path,
-                line_range=[start + 1, end_exclusive],
-                keywords=fm_keywords,
-            )
+        record = _build_section_record(
+            doc_id=doc_id,
+            legacy_id=next_slug(title),
+            title=title,
+            content=chunk,
+            file_path=md_path,
+            line_range=[start + 1, end_exclusive],
+            keywords=fm_keywords,
+            byte_range=_byte_range(offsets, start, joined, chunk),
+            heading_parent=enclosing[-1][1] if enclosing else None,
         )
+        enclosing.append((level, record["id"]))
+        sections.extend(_chunked(record, lines, start, end_exclusive, chunk_tokens, offsets))
 
     return sections
 
 
-def load_sections(doc_root):
+def load_sections(doc_root, chunk_tokens=0):
     doc_root = os.path.abspath(doc_root)
     doc_id = os.path.basename(doc_root)
     rewritten_path = _find_latest_rewritten(doc_root, doc_id)
     rewritten_content = _read(rewritten_path)
-    return _sections_from_markdown(doc_id, rewritten_path, rewritten_content)
+    return _sections_from_markdown(doc_id, rewritten_path, rewritten_content, chunk_tokens)
 
 
 def db_path(map_root):
     return os.path.join(os.path.abspath(map_root), "shards.db")
 
 
-def connect(db_file):
-    conn = sqlite3.connect(db_file)
+def _is_busy(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def _retry_busy(fn, conn=None, attempts=BUSY_RETRIES, base_delay=0.05):
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except sqlite3.OperationalError as exc:
+            if not _is_busy(exc) or attempt == attempts - 1:
+                raise
+            if conn is not None:
+                conn.rollback()
+            time.sleep(base_delay * (2 ** attempt) * (1 + random.random()))
+
+
+def connect(db_file, busy_timeout_ms=DEFAULT_BUSY_TIMEOUT_MS):
+    # WAL lets shards_search.py readers run while an ingest commits; the busy
+    # timeout covers the short checkpoint windows where WAL still blocks.
+    conn = sqlite3.connect(db_file, timeout=busy_timeout_ms / 1000.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    _retry_busy(lambda: conn.execute("PRAGMA journal_mode=WAL").fetchone())
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # INSERT OR REPLACE only fires the sections_*_ad triggers (and so clears
+    # the old FTS and keyword rows) when recursive triggers are on.
+    conn.execute("PRAGMA recursive_triggers=ON")
+    # _write_sections stages every doc in a temp table; keep it off disk.
+    conn.execute("PRAGMA temp_store=MEMORY")
+    register_codec(conn)
+    return conn
+
+
+def connect_ro(db_file, busy_timeout_ms=DEFAULT_BUSY_TIMEOUT_MS):
+    # For read-only commands: never creates the file or switches it to WAL.
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, timeout=busy_timeout_ms / 1000.0)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+@contextlib.contextmanager
+def writer_lock(db_file, timeout=DEFAULT_LOCK_TIMEOUT_S):
+    # Advisory lock next to the DB so parallel --ingest processes queue up
+    # instead of racing for SQLite's write lock and failing with SQLITE_BUSY.
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(db_file + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out after {timeout}s waiting for {db_file}.lock")
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, 0.5)
+        yield
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def trace_statements(conn, selects=False):
+    # Counts statements by leading verb via SQLite's trace hook. Trigger
+    # programs are reported as another run of the statement that fired them;
+    # FTS5 shadow-table upkeep arrives as "-- ..." lines, counted separately.
+    # With selects, also keeps the distinct top-level SELECTs (minus FTS5's
+    # own 'main'.'*_config' reads) for query plans.
+    stats = {"statements": {}, "nested_statements": {}, "rows_changed": 0}
+    if selects:
+        stats["selects"] = []
+
+    def on_sql(sql):
+        counts = stats["statements"]
+        nested = sql.startswith("--")
+        if nested:
+            counts = stats["nested_statements"]
+            sql = sql[2:]
+        verb = (sql.split(None, 1) or ["?"])[0].upper()
+        counts[verb] = counts.get(verb, 0) + 1
+        if selects and not nested and verb == "SELECT" and "'main'." not in sql and sql not in stats["selects"]:
+            stats["selects"].append(sql)
+
+    changes = conn.total_changes
+    conn.set_trace_callback(on_sql)
+    try:
+        yield stats
+    finally:
+        conn.set_trace_callback(None)
+        stats["rows_changed"] = conn.total_changes - changes
+
+
+@contextlib.contextmanager
+def profiled(path):
+    if not path:
+        yield
+        return
+    import cProfile
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
+
+
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL);
-CREATE TABLE IF NOT EXISTS sections(id TEXT PRIMARY KEY, doc_id TEXT NOT NULL, legacy_id TEXT NOT NULL, title TEXT, content TEXT, content_hash TEXT, token_count INTEGER, keywords TEXT, links TEXT, ai_hints TEXT, summary TEXT, line_range TEXT, file_path TEXT, updated_at TEXT);
+CREATE TABLE IF NOT EXISTS sections(id TEXT PRIMARY KEY, doc_id TEXT NOT NULL, legacy_id TEXT NOT NULL, title TEXT, content_hash TEXT, token_count INTEGER, keywords TEXT, links TEXT, ai_hints TEXT, summary TEXT, line_range TEXT, file_path TEXT, updated_at TEXT, parent_id TEXT, chunk_no INTEGER, blob_id INTEGER, byte_range TEXT);
 CREATE INDEX IF NOT EXISTS idx_sections_doc_id ON sections(doc_id);
+CREATE INDEX IF NOT EXISTS idx_sections_parent_id ON sections(parent_id);
 CREATE INDEX IF NOT EXISTS idx_sections_content_hash ON sections(content_hash);
-CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts USING fts5(title, content, keywords, tokenize='porter unicode61', content='sections', content_rowid='rowid');
-CREATE TRIGGER IF NOT EXISTS sections_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
-CREATE TRIGGER IF NOT EXISTS sections_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); END;
-CREATE TRIGGER IF NOT EXISTS sections_au AFTER UPDATE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
+CREATE INDEX IF NOT EXISTS idx_sections_blob_id ON sections(blob_id);
+CREATE TABLE IF NOT EXISTS doc_manifest(doc_id TEXT PRIMARY KEY, rewritten_path TEXT NOT NULL, version INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, file_hash TEXT NOT NULL, ingested_at TEXT);
+CREATE TABLE IF NOT EXISTS blobs(id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, content TEXT NOT NULL, refs INTEGER NOT NULL DEFAULT 0, raw_len INTEGER);
+CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(refs) WHERE refs <= 0;
+CREATE VIEW IF NOT EXISTS sections_full AS SELECT s.rowid AS rowid, s.id, s.doc_id, s.legacy_id, s.title, b.content, s.content_hash, s.token_count, s.keywords, s.links, s.ai_hints, s.summary, s.line_range, s.file_path, s.updated_at, s.parent_id, s.chunk_no, s.byte_range, s.blob_id FROM sections s LEFT JOIN blobs b ON b.id = s.blob_id;
+CREATE TRIGGER IF NOT EXISTS sections_blob_ai AFTER INSERT ON sections BEGIN UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id; END;
+CREATE TRIGGER IF NOT EXISTS sections_blob_ad AFTER DELETE ON sections BEGIN UPDATE blobs SET refs = refs - 1 WHERE id = old.blob_id; END;
+CREATE TRIGGER IF NOT EXISTS sections_blob_au AFTER UPDATE OF blob_id ON sections BEGIN UPDATE blobs SET refs = refs - 1 WHERE id = old.blob_id; UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id; END;
+CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts USING fts5(title, content, keywords, tokenize='porter unicode61', content='sections_full', content_rowid='rowid', prefix='2 3 4');
+CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts_vocab USING fts5vocab(sections_fts, row);
+CREATE TRIGGER IF NOT EXISTS sections_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, (SELECT content FROM blobs WHERE id = new.blob_id), new.keywords); END;
+CREATE TRIGGER IF NOT EXISTS sections_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, (SELECT content FROM blobs WHERE id = old.blob_id), old.keywords); END;
+CREATE TRIGGER IF NOT EXISTS sections_au AFTER UPDATE OF title, keywords, blob_id ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, (SELECT content FROM blobs WHERE id = old.blob_id), old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, (SELECT content FROM blobs WHERE id = new.blob_id), new.keywords); END;
+CREATE VIRTUAL TABLE IF NOT EXISTS blobs_trigram USING fts5(content, tokenize='trigram', content='blobs', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS blobs_trigram_ai AFTER INSERT ON blobs BEGIN INSERT INTO blobs_trigram(rowid, content) VALUES (new.id, new.content); END;
+CREATE TRIGGER IF NOT EXISTS blobs_trigram_ad AFTER DELETE ON blobs BEGIN INSERT INTO blobs_trigram(blobs_trigram, rowid, content) VALUES('delete', old.id, old.content); END;
+CREATE TABLE IF NOT EXISTS section_keywords(keyword TEXT NOT NULL, section_rowid INTEGER NOT NULL, PRIMARY KEY(keyword, section_rowid)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_section_keywords_rowid ON section_keywords(section_rowid);
+CREATE TRIGGER IF NOT EXISTS sections_kw_ai AFTER INSERT ON sections BEGIN INSERT OR IGNORE INTO section_keywords(keyword, section_rowid) SELECT value, new.rowid FROM json_each(new.keywords); END;
+CREATE TRIGGER IF NOT EXISTS sections_kw_ad AFTER DELETE ON sections BEGIN DELETE FROM section_keywords WHERE section_rowid = old.rowid; END;
+CREATE TRIGGER IF NOT EXISTS sections_kw_au AFTER UPDATE OF keywords ON sections BEGIN DELETE FROM section_keywords WHERE section_rowid = old.rowid; INSERT OR IGNORE INTO section_keywords(keyword, section_rowid) SELECT value, new.rowid FROM json_each(new.keywords); END;
+CREATE TABLE IF NOT EXISTS section_vectors(section_rowid INTEGER PRIMARY KEY, vec BLOB NOT NULL);
+CREATE TRIGGER IF NOT EXISTS sections_vec_ad AFTER DELETE ON sections BEGIN DELETE FROM section_vectors WHERE section_rowid = old.rowid; END;
+CREATE TRIGGER IF NOT EXISTS sections_vec_au AFTER UPDATE OF title, blob_id ON sections BEGIN DELETE FROM section_vectors WHERE section_rowid = old.rowid; END;
+CREATE TABLE IF NOT EXISTS section_edges(src TEXT NOT NULL, kind TEXT NOT NULL, dst TEXT NOT NULL, doc_id TEXT NOT NULL, PRIMARY KEY(src, kind, dst)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_section_edges_doc_id ON section_edges(doc_id);
+"""
+
+# Compressed content mode (set_content_codec): the view inflates blob text on
+# read (sections_fts reads its external content through it), the sections
+# triggers feed sections_fts through inflate(), and blobs_trigram is
+# contentless.
+COMPRESSED_CONTENT_SQL = """
+CREATE VIEW sections_full AS SELECT s.rowid AS rowid, s.id, s.doc_id, s.legacy_id, s.title, inflate(b.content) AS content, s.content_hash, s.token_count, s.keywords, s.links, s.ai_hints, s.summary, s.line_range, s.file_path, s.updated_at, s.parent_id, s.chunk_no, s.byte_range, s.blob_id FROM sections s LEFT JOIN blobs b ON b.id = s.blob_id;
+CREATE TRIGGER sections_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, (SELECT inflate(content) FROM blobs WHERE id = new.blob_id), new.keywords); END;
+CREATE TRIGGER sections_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, (SELECT inflate(content) FROM blobs WHERE id = old.blob_id), old.keywords); END;
+CREATE TRIGGER sections_au AFTER UPDATE OF title, keywords, blob_id ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, (SELECT inflate(content) FROM blobs WHERE id = old.blob_id), old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, (SELECT inflate(content) FROM blobs WHERE id = new.blob_id), new.keywords); END;
+CREATE VIRTUAL TABLE blobs_trigram USING fts5(content, tokenize='trigram', content='');
+CREATE TRIGGER blobs_trigram_ai AFTER INSERT ON blobs BEGIN INSERT INTO blobs_trigram(rowid, content) VALUES (new.id, inflate(new.content)); END;
+CREATE TRIGGER blobs_trigram_ad AFTER DELETE ON blobs BEGIN INSERT INTO blobs_trigram(blobs_trigram, rowid, content) VALUES('delete', old.id, inflate(old.content)); END;
 """
+DROP_CONTENT_FTS_SQL = """
+DROP VIEW IF EXISTS sections_full;
+DROP TRIGGER IF EXISTS sections_ai;
+DROP TRIGGER IF EXISTS sections_ad;
+DROP TRIGGER IF EXISTS sections_au;
+DROP TRIGGER IF EXISTS blobs_trigram_ai;
+DROP TRIGGER IF EXISTS blobs_trigram_ad;
+DROP TABLE IF EXISTS blobs_trigram;
+"""
+
+SCHEMA_VERSION = 12
+
+
+def _run_ddl(conn, script):
+    # executescript() would commit the caller's transaction first.
+    for stmt in script.strip().split(";\n"):
+        conn.execute(stmt)
+
+
+def _migrate_v2(conn):
+    # v3: trigram index over section content for literal-narrowed --regex search.
+    _run_ddl(conn, """
+CREATE VIRTUAL TABLE IF NOT EXISTS sections_trigram USING fts5(content, tokenize='trigram', content='sections', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS sections_trigram_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_trigram(rowid, content) VALUES (new.rowid, new.content); END;
+CREATE TRIGGER IF NOT EXISTS sections_trigram_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_trigram(sections_trigram, rowid, content) VALUES('delete', old.rowid, old.content); END;
+CREATE TRIGGER IF NOT EXISTS sections_trigram_au AFTER UPDATE ON sections BEGIN INSERT INTO sections_trigram(sections_trigram, rowid, content) VALUES('delete', old.rowid, old.content); INSERT INTO sections_trigram(rowid, content) VALUES (new.rowid, new.content); END;
+""")
+    conn.execute("INSERT INTO sections_trigram(sections_trigram) VALUES('rebuild')")
+
+
+def _migrate_v3(conn):
+    # v4: normalized keyword index so keyword lookups are index seeks, not json_each scans.
+    _run_ddl(conn, """
+CREATE TABLE IF NOT EXISTS section_keywords(keyword TEXT NOT NULL, section_rowid INTEGER NOT NULL, PRIMARY KEY(keyword, section_rowid)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_section_keywords_rowid ON section_keywords(section_rowid);
+CREATE TRIGGER IF NOT EXISTS sections_kw_ai AFTER INSERT ON sections BEGIN INSERT OR IGNORE INTO section_keywords(keyword, section_rowid) SELECT value, new.rowid FROM json_each(new.keywords); END;
+CREATE TRIGGER IF NOT EXISTS sections_kw_ad AFTER DELETE ON sections BEGIN DELETE FROM section_keywords WHERE section_rowid = old.rowid; END;
+CREATE TRIGGER IF NOT EXISTS sections_kw_au AFTER UPDATE OF keywords ON sections BEGIN DELETE FROM section_keywords WHERE section_rowid = old.rowid; INSERT OR IGNORE INTO section_keywords(keyword, section_rowid) SELECT value, new.rowid FROM json_each(new.keywords); END;
+""")
+    conn.execute("DELETE FROM section_keywords")
+    conn.execute(
+        "INSERT OR IGNORE INTO section_keywords(keyword, section_rowid) SELECT j.value, s.rowid FROM sections s, json_each(s.keywords) j"
+    )
+    # Earlier versions replaced rows without firing the delete triggers, which
+    # left stale postings behind in both FTS indexes.
+    conn.execute("INSERT INTO sections_fts(sections_fts) VALUES('rebuild')")
+    conn.execute("INSERT INTO sections_trigram(sections_trigram) VALUES('rebuild')")
+
+
+def _migrate_v4(conn):
+    # v5: child chunks of oversized sections point at their parent section id.
+    conn.execute("ALTER TABLE sections ADD COLUMN parent_id TEXT")
+    conn.execute("ALTER TABLE sections ADD COLUMN chunk_no INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sections_parent_id ON sections(parent_id)")
+
+
+def _migrate_v5(conn):
+    # v6: update triggers only re-index when an indexed column is written, so
+    # metadata-only updates (line_range, summary, ...) leave FTS alone.
+    _run_ddl(conn, """
+DROP TRIGGER IF EXISTS sections_au;
+DROP TRIGGER IF EXISTS sections_trigram_au;
+CREATE TRIGGER sections_au AFTER UPDATE OF title, content, keywords ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
+CREATE TRIGGER sections_trigram_au AFTER UPDATE OF content ON sections BEGIN INSERT INTO sections_trigram(sections_trigram, rowid, content) VALUES('delete', old.rowid, old.content); INSERT INTO sections_trigram(rowid, content) VALUES (new.rowid, new.content); END;
+""")
+
+
+def _migrate_v6(conn):
+    # v7: prefix indexes make `term*` queries (and --fuzzy prefix expansion)
+    # index seeks; the vocab table lets search see which terms exist. FTS5
+    # options are fixed at creation, so the index is recreated and rebuilt.
+    _run_ddl(conn, """
+DROP TRIGGER IF EXISTS sections_ai;
+DROP TRIGGER IF EXISTS sections_ad;
+DROP TRIGGER IF EXISTS sections_au;
+DROP TABLE IF EXISTS sections_fts;
+CREATE VIRTUAL TABLE sections_fts USING fts5(title, content, keywords, tokenize='porter unicode61', content='sections', content_rowid='rowid', prefix='2 3 4');
+CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts_vocab USING fts5vocab(sections_fts, row);
+CREATE TRIGGER sections_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
+CREATE TRIGGER sections_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); END;
+CREATE TRIGGER sections_au AFTER UPDATE OF title, content, keywords ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
+""")
+    conn.execute("INSERT INTO sections_fts(sections_fts) VALUES('rebuild')")
+
+
+def _migrate_v7(conn):
+    # v8: optional hashed n-gram vectors for --hybrid search. Triggers only
+    # invalidate; _write_sections recomputes missing vectors when enabled.
+    _run_ddl(conn, """
+CREATE TABLE IF NOT EXISTS section_vectors(section_rowid INTEGER PRIMARY KEY, vec BLOB NOT NULL);
+CREATE TRIGGER IF NOT EXISTS sections_vec_ad AFTER DELETE ON sections BEGIN DELETE FROM section_vectors WHERE section_rowid = old.rowid; END;
+CREATE TRIGGER IF NOT EXISTS sections_vec_au AFTER UPDATE OF title, content ON sections BEGIN DELETE FROM section_vectors WHERE section_rowid = old.rowid; END;
+""")
+
+
+def _migrate_v8(conn):
+    # v9: content-addressed storage. Section text moves into `blobs`, one row
+    # per distinct content_hash with a reference count; sections point at it
+    # by blob_id and sections_full joins content back in. sections_fts still
+    # indexes every section (its content read from the blob), so one MATCH
+    # spans title, content and keywords; only blobs_trigram is per blob.
+    for r in conn.execute("SELECT rowid, content FROM sections WHERE content_hash IS NULL").fetchall():
+        conn.execute("UPDATE sections SET content_hash=? WHERE rowid=?", (_sha(r["content"] or ""), r["rowid"]))
+    _run_ddl(conn, """
+DROP TRIGGER IF EXISTS sections_ai;
+DROP TRIGGER IF EXISTS sections_ad;
+DROP TRIGGER IF EXISTS sections_au;
+DROP TRIGGER IF EXISTS sections_trigram_ai;
+DROP TRIGGER IF EXISTS sections_trigram_ad;
+DROP TRIGGER IF EXISTS sections_trigram_au;
+DROP TRIGGER IF EXISTS sections_vec_au;
+DROP TABLE IF EXISTS sections_fts_vocab;
+DROP TABLE IF EXISTS sections_fts;
+DROP TABLE IF EXISTS sections_trigram;
+CREATE TABLE blobs(id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, content TEXT NOT NULL, refs INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX idx_blobs_unreferenced ON blobs(refs) WHERE refs <= 0;
+INSERT INTO blobs(hash, content, refs) SELECT content_hash, MIN(COALESCE(content, '')), COUNT(*) FROM sections GROUP BY content_hash;
+ALTER TABLE sections ADD COLUMN blob_id INTEGER;
+UPDATE sections SET blob_id = (SELECT id FROM blobs WHERE hash = sections.content_hash);
+CREATE INDEX idx_sections_blob_id ON sections(blob_id);
+ALTER TABLE sections DROP COLUMN content;
+CREATE VIEW sections_full AS SELECT s.rowid AS rowid, s.id, s.doc_id, s.legacy_id, s.title, b.content, s.content_hash, s.token_count, s.keywords, s.links, s.ai_hints, s.summary, s.line_range, s.file_path, s.updated_at, s.parent_id, s.chunk_no, s.blob_id FROM sections s LEFT JOIN blobs b ON b.id = s.blob_id;
+CREATE TRIGGER sections_blob_ai AFTER INSERT ON sections BEGIN UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id; END;
+CREATE TRIGGER sections_blob_ad AFTER DELETE ON sections BEGIN UPDATE blobs SET refs = refs - 1 WHERE id = old.blob_id; END;
+CREATE TRIGGER sections_blob_au AFTER UPDATE OF blob_id ON sections BEGIN UPDATE blobs SET refs = refs - 1 WHERE id = old.blob_id; UPDATE blobs SET refs = refs + 1 WHERE id = new.blob_id; END;
+CREATE VIRTUAL TABLE sections_fts USING fts5(title, content, keywords, tokenize='porter unicode61', content='sections_full', content_rowid='rowid', prefix='2 3 4');
+CREATE VIRTUAL TABLE sections_fts_vocab USING fts5vocab(sections_fts, row);
+CREATE TRIGGER sections_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, (SELECT content FROM blobs WHERE id = new.blob_id), new.keywords); END;
+CREATE TRIGGER sections_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, (SELECT content FROM blobs WHERE id = old.blob_id), old.keywords); END;
+CREATE TRIGGER sections_au AFTER UPDATE OF title, keywords, blob_id ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, (SELECT content FROM blobs WHERE id = old.blob_id), old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, (SELECT content FROM blobs WHERE id = new.blob_id), new.keywords); END;
+CREATE VIRTUAL TABLE blobs_trigram USING fts5(content, tokenize='trigram', content='blobs', content_rowid='id');
+CREATE TRIGGER blobs_trigram_ai AFTER INSERT ON blobs BEGIN INSERT INTO blobs_trigram(rowid, content) VALUES (new.id, new.content); END;
+CREATE TRIGGER blobs_trigram_ad AFTER DELETE ON blobs BEGIN INSERT INTO blobs_trigram(blobs_trigram, rowid, content) VALUES('delete', old.id, old.content); END;
+CREATE TRIGGER sections_vec_au AFTER UPDATE OF title, blob_id ON sections BEGIN DELETE FROM section_vectors WHERE section_rowid = old.rowid; END;
+""")
+    for t in ("sections_fts", "blobs_trigram"):
+        conn.execute(f"INSERT INTO {t}({t}) VALUES('rebuild')")
+
+
+def _migrate_v9(conn):
+    # v10: byte_range addresses each section in its rewritten file. Existing
+    # rows get offsets on the next ingest, which the reset manifest forces
+    # (unchanged text only takes the metadata UPDATE, not a re-index).
+    # doc_manifest came in without a version bump, so a DB upgraded from v2
+    # does not have it yet.
+    _run_ddl(conn, """
+CREATE TABLE IF NOT EXISTS doc_manifest(doc_id TEXT PRIMARY KEY, rewritten_path TEXT NOT NULL, version INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, file_hash TEXT NOT NULL, ingested_at TEXT);
+ALTER TABLE sections ADD COLUMN byte_range TEXT;
+DROP VIEW IF EXISTS sections_full;
+CREATE VIEW sections_full AS SELECT s.rowid AS rowid, s.id, s.doc_id, s.legacy_id, s.title, b.content, s.content_hash, s.token_count, s.keywords, s.links, s.ai_hints, s.summary, s.line_range, s.file_path, s.updated_at, s.parent_id, s.chunk_no, s.byte_range, s.blob_id FROM sections s LEFT JOIN blobs b ON b.id = s.blob_id;
+UPDATE doc_manifest SET mtime_ns = -1, file_hash = '';
+""")
+
+
+def _migrate_v10(conn):
+    # v11: heading hierarchy and markdown links as a section graph for
+    # shards_search.py --expand. The reset manifest makes the next ingest
+    # parse every doc again to fill it.
+    _run_ddl(conn, """
+CREATE TABLE IF NOT EXISTS section_edges(src TEXT NOT NULL, kind TEXT NOT NULL, dst TEXT NOT NULL, doc_id TEXT NOT NULL, PRIMARY KEY(src, kind, dst)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_section_edges_doc_id ON section_edges(doc_id);
+UPDATE doc_manifest SET mtime_ns = -1, file_hash = '';
+""")
+
+
+def _migrate_v11(conn):
+    # v12: blobs.raw_len, the UTF-8 size of a blob's text, so blob_stats
+    # need not inflate every compressed blob to report it.
+    _run_ddl(conn, """
+ALTER TABLE blobs ADD COLUMN raw_len INTEGER;
+UPDATE blobs SET raw_len = length(CAST(inflate(content) AS BLOB));
+""")
+
+
+# Each step upgrades a DB from the keyed schema_version to the next one. Steps
+# carry their own DDL so they stay valid as SCHEMA_SQL moves on.
+MIGRATIONS = {2: _migrate_v2, 3: _migrate_v3, 4: _migrate_v4, 5: _migrate_v5, 6: _migrate_v6, 7: _migrate_v7, 8: _migrate_v8, 9: _migrate_v9, 10: _migrate_v10, 11: _migrate_v11}
 
 
 def init_schema(conn):
-    conn.executescript(SCHEMA_SQL)
+    # One savepoint around the whole upgrade (it nests in the caller's
+    # transaction, if any): a failing step rolls every step and the version
+    # bump back instead of leaving a half-migrated DB committed.
+    conn.execute("SAVEPOINT init_schema")
+    try:
+        _init_schema(conn)
+    except BaseException:
+        conn.execute("ROLLBACK TO init_schema")
+        conn.execute("RELEASE init_schema")
+        raise
+    conn.execute("RELEASE init_schema")
+
+
+def _init_schema(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    row = conn.execute("SELECT value FROM meta WHERE key='schema_version'").fetchone()
+    if row:
+        version = int(row["value"]) if row["value"].isdigit() else None
+        if version != SCHEMA_VERSION and version not in MIGRATIONS:
+            raise RuntimeError(
+                f"Unsupported schema_version={row['value']}; expected {SCHEMA_VERSION}"
+            )
+        while version < SCHEMA_VERSION:
+            MIGRATIONS[version](conn)
+            version += 1
+            conn.execute(
+                "UPDATE meta SET value=? WHERE key='schema_version'", (str(version),)
+            )
+            bump_generation(conn)
+    _run_ddl(conn, SCHEMA_SQL)
     conn.execute(
-        "INSERT OR IGNORE INTO meta(key, value) VALUES(?, ?)", ("schema_version", "2")
+        "INSERT OR IGNORE INTO meta(key, value) VALUES(?, ?)",
+        ("schema_version", str(SCHEMA_VERSION)),
     )
     conn.execute(
         "INSERT OR IGNORE INTO meta(key, value) VALUES(?, ?)", ("created_at", _utc())
     )
-    row = conn.execute("SELECT value FROM meta WHERE key='schema_version'").fetchone()
-    if not row or row["value"] != "2":
-        raise RuntimeError(
-            f"Unsupported schema_version={row['value'] if row else None}; expected 2"
+
+
+def _parse_doc(doc_root, state, known_hash=None, chunk_tokens=0):
+    # Returns sections=None when the file bytes still hash to known_hash, so a
+    # touched-but-identical file costs one read and no markdown splitting.
+    t0 = time.perf_counter()
+    with open(state["rewritten_path"], "rb") as f:
+        raw = f.read()
+    t1 = time.perf_counter()
+    state = dict(state, file_hash=hashlib.sha256(raw).hexdigest())
+    t2 = time.perf_counter()
+    sections = None
+    if state["file_hash"] != known_hash:
+        text = raw.decode("utf-8")
+        crlf = "\r" in text
+        if crlf:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        sections = _sections_from_markdown(
+            state["doc_id"], state["rewritten_path"], text, chunk_tokens
         )
+        if crlf:
+            # Offsets index the normalized text; shift each one past the CRs
+            # dropped before it so it addresses the raw file.
+            dropped = [m.start() - i for i, m in enumerate(re.finditer(b"\r\n", raw))]
+            for s in sections:
+                if s["byte_range"]:
+                    s["byte_range"] = [o + bisect.bisect_left(dropped, o) for o in s["byte_range"]]
+    phases = {"read": t1 - t0, "hash": t2 - t1, "split": time.perf_counter() - t2}
+    return state, sections, phases
 
 
-def ingest_doc(conn, doc_root):
-    doc_root = os.path.abspath(doc_root)
-    doc_id = os.path.basename(doc_root)
-    now = _utc()
+def _manifest_rows(conn, doc_id=None):
+    q = "SELECT * FROM doc_manifest"
+    params = ()
+    if doc_id is not None:
+        q += " WHERE doc_id=?"
+        params = (doc_id,)
+    return {r["doc_id"]: r for r in conn.execute(q, params).fetchall()}
+
+
+def _write_manifest(conn, state, now):
+    conn.execute(
+        "INSERT OR REPLACE INTO doc_manifest(doc_id, rewritten_path, version, size, mtime_ns, file_hash, ingested_at) VALUES(?, ?, ?, ?, ?, ?, ?)",
+        (
+            state["doc_id"],
+            state["rewritten_path"],
+            state["version"],
+            state["size"],
+            state["mtime_ns"],
+            state["file_hash"],
+            now,
+        ),
+    )
+
+
+def _known_hash(state, row, force):
+    if force or not row or row["rewritten_path"] != state["rewritten_path"]:
+        return None
+    return row["file_hash"]
+
+
+SECTION_COLUMNS = (
+    "id",
+    "doc_id",
+    "legacy_id",
+    "title",
+    "content",
+    "content_hash",
+    "token_count",
+    "keywords",
+    "links",
+    "ai_hints",
+    "summary",
+    "line_range",
+    "file_path",
+    "updated_at",
+    "parent_id",
+    "chunk_no",
+    "byte_range",
+)
+# `content` lives in blobs; sections keep its content_hash and blob_id.
+STORED_COLUMNS = tuple(c for c in SECTION_COLUMNS if c != "content")
+# Columns the FTS/keyword/blob triggers index; an update that leaves these
+# alone must not touch the FTS tables.
+TEXT_COLUMNS = ("title", "content_hash", "keywords")
+META_COLUMNS = tuple(
+    c for c in STORED_COLUMNS if c not in TEXT_COLUMNS and c not in ("id", "updated_at")
+)
+
+
+def _section_row(doc_id, s, now):
+    return (
+        s["id"],
+        doc_id,
+        s.get("legacy_id") or "",
+        s.get("title"),
+        s.get("content") or "",
+        s.get("content_hash") or _sha(s.get("content") or ""),
+        int(s.get("token_count") or 0),
+        _jarr(s.get("keywords")),
+        _jarr(s.get("links")),
+        _jarr(s.get("ai_hints")),
+        s.get("summary") or "",
+        _jarr(s.get("line_range")),
+        s.get("file_path"),
+        now,
+        s.get("parent_id"),
+        s.get("chunk_no"),
+        _jarr(s.get("byte_range")),
+    )
+
+
+def _differs(columns, left, right):
+    return f"({', '.join(f'{left}.{c}' for c in columns)}) IS NOT ({', '.join(f'{right}.{c}' for c in columns)})"
+
+
+def _write_sections(conn, doc_id, sections, now):
+    # Stage the doc in a temp table and diff it in SQL. New content goes into
+    # blobs first (a hash already stored is not trigram-indexed again); the
+    # upsert keeps rowids stable and only rewrites rows whose indexed text
+    # changed; rows whose line_range/summary/... moved get a plain UPDATE that
+    # the `AFTER UPDATE OF title, keywords, blob_id` triggers ignore.
     by_id = {}
-    for s in load_sections(doc_root):
-        sid = s.get("id")
-        if sid:
-            by_id[sid] = s
-    existing = {
-        r["id"]: r["content_hash"]
-        for r in conn.execute(
-            "SELECT id, content_hash FROM sections WHERE doc_id=?", (doc_id,)
-        ).fetchall()
+    for s in sections:
+        if s.get("id"):
+            by_id[s["id"]] = s
+    cols = ", ".join(SECTION_COLUMNS)
+    conn.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS ingest_stage({cols}, PRIMARY KEY(id))"
+    )
+    conn.execute("DELETE FROM temp.ingest_stage")
+    conn.executemany(
+        f"INSERT INTO temp.ingest_stage({cols}) VALUES({', '.join('?' * len(SECTION_COLUMNS))})",
+        [_section_row(doc_id, s, now) for s in by_id.values()],
+    )
+    # Only content not stored yet is (de)flated; ON CONFLICT covers a doc
+    # that repeats a section's content.
+    codec = content_codec_setting(conn)
+    content = f"deflate(content, {int(codec.partition(':')[2])})" if codec else "content"
+    conn.execute(
+        f"INSERT INTO blobs(hash, content, raw_len) "
+        f"SELECT content_hash, {content}, length(CAST(content AS BLOB)) FROM temp.ingest_stage g "
+        "WHERE NOT EXISTS (SELECT 1 FROM blobs b WHERE b.hash = g.content_hash) "
+        "ON CONFLICT(hash) DO NOTHING"
+    )
+    deleted = conn.execute(
+        "DELETE FROM sections WHERE doc_id=? AND id NOT IN (SELECT id FROM temp.ingest_stage)",
+        (doc_id,),
+    ).rowcount
+    stored = STORED_COLUMNS + ("blob_id",)
+    assign = ", ".join(f"{c}=excluded.{c}" for c in stored if c != "id")
+    written = conn.execute(
+        f"INSERT INTO sections({', '.join(stored)}) "
+        f"SELECT {', '.join('g.' + c for c in STORED_COLUMNS)}, b.id "
+        f"FROM temp.ingest_stage g JOIN blobs b ON b.hash = g.content_hash WHERE true "
+        f"ON CONFLICT(id) DO UPDATE SET {assign} "
+        f"WHERE {_differs(TEXT_COLUMNS, 'sections', 'excluded')}"
+    ).rowcount
+    meta = ", ".join(META_COLUMNS + ("updated_at",))
+    written += conn.execute(
+        f"UPDATE sections SET ({meta}) = (SELECT {meta} FROM temp.ingest_stage g WHERE g.id = sections.id) "
+        f"WHERE doc_id=? AND id IN (SELECT g.id FROM temp.ingest_stage g JOIN sections s ON s.id = g.id "
+        f"WHERE {_differs(META_COLUMNS, 's', 'g')})",
+        (doc_id,),
+    ).rowcount
+    _collect_blobs(conn)
+    _write_edges(conn, doc_id, by_id.values())
+    dim = vector_dim_setting(conn)
+    if dim:
+        fill_vectors(conn, dim, doc_id)
+    if written or deleted:
+        bump_generation(conn)
+    return len(by_id), written, len(by_id) - written
+
+
+def _section_edges(doc_id, sections):
+    # Graph over logical sections (a chunk stands for its parent section):
+    # "parent" to the enclosing heading, "sibling" both ways between
+    # neighbours under the same heading, "link" to markdown link targets
+    # (a section id, or a doc id), and one "head" edge from the doc id to its
+    # first section so doc-level links resolve to it.
+    order = {}
+    links = {}
+    for s in sections:
+        node = s.get("parent_id") or s["id"]
+        order.setdefault(node, s.get("heading_parent"))
+        links.setdefault(node, []).extend(s.get("links") or [])
+    edges = set()
+    last_child = {}
+    for node, parent in order.items():
+        if parent:
+            edges.add((node, "parent", parent))
+        if parent in last_child:
+            edges.add((node, "sibling", last_child[parent]))
+            edges.add((last_child[parent], "sibling", node))
+        last_child[parent] = node
+        edges.update((node, "link", dst) for dst in links[node] if dst != node)
+    if order:
+        edges.add((doc_id, "head", next(iter(order))))
+    return edges
+
+
+def _write_edges(conn, doc_id, sections):
+    # Diffed like the sections themselves: an unchanged doc costs one read.
+    edges = _section_edges(doc_id, sections)
+    stored = {
+        tuple(r)
+        for r in conn.execute("SELECT src, kind, dst FROM section_edges WHERE doc_id=?", (doc_id,))
+    }
+    conn.executemany(
+        "DELETE FROM section_edges WHERE src=? AND kind=? AND dst=?", stored - edges
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO section_edges(src, kind, dst, doc_id) VALUES(?, ?, ?, ?)",
+        [(*e, doc_id) for e in edges - stored],
+    )
+
+
+def _collect_blobs(conn):
+    # Drop blobs no section references any more (refcounts are kept by the
+    # sections_blob_* triggers); their trigram rows go with them.
+    return conn.execute("DELETE FROM blobs WHERE refs <= 0").rowcount
+
+
+def blob_stats(conn):
+    # Sizes are UTF-8 bytes of the text (raw_len, recorded when the blob is
+    # written); "stored" is what the (possibly compressed) blobs take, so
+    # "saved" counts dedup and compression. Nothing is inflated.
+    r = conn.execute(
+        "SELECT COUNT(*) AS blobs, COALESCE(SUM(refs), 0) AS refs, "
+        "COALESCE(SUM(length(CAST(content AS BLOB))), 0) AS stored, "
+        "COALESCE(SUM(raw_len), 0) AS unique_bytes, "
+        "COALESCE(SUM(raw_len * refs), 0) AS referenced FROM blobs"
+    ).fetchone()
+    return {
+        "blobs": r["blobs"],
+        "section_refs": r["refs"],
+        "content_bytes_referenced": r["referenced"],
+        "content_bytes_unique": r["unique_bytes"],
+        "content_bytes_stored": r["stored"],
+        "content_bytes_saved": r["referenced"] - r["stored"],
     }
-    inserted = skipped = 0
-    for sid, s in by_id.items():
-        ch = s.get("content_hash")
-        if existing.get(sid) == ch:
-            skipped += 1
+
+
+def bump_generation(conn):
+    # Search-side result caches key on (created_at, generation); bump on every
+    # change to indexed rows.
+    conn.execute(
+        "INSERT INTO meta(key, value) VALUES('generation', '1') ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+
+
+def drop_doc(conn, doc_id):
+    deleted = conn.execute("DELETE FROM sections WHERE doc_id=?", (doc_id,)).rowcount
+    conn.execute("DELETE FROM doc_manifest WHERE doc_id=?", (doc_id,))
+    conn.execute("DELETE FROM section_edges WHERE doc_id=?", (doc_id,))
+    _collect_blobs(conn)
+    if deleted:
+        bump_generation(conn)
+    return deleted
+
+
+def _meta_get(conn, key, default=None):
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def _meta_set(conn, key, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)", (key, str(value))
+    )
+
+
+def chunk_tokens_setting(conn):
+    return int(_meta_get(conn, "chunk_tokens", "0"))
+
+
+def vector_dim_setting(conn):
+    return int(_meta_get(conn, "vector_dim", "0"))
+
+
+def content_codec_setting(conn):
+    # "" (plain text blobs) or "zlib:<dict id>"; see set_content_codec.
+    return _meta_get(conn, "content_codec", "")
+
+
+def _deflate(text, zdict, dict_id):
+    # Compressed blobs are a 4-byte dictionary id (0 = none) and a raw deflate
+    # stream. Text that deflate cannot shrink stays text.
+    raw = text.encode("utf-8")
+    c = zlib.compressobj(CODEC_LEVEL, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    packed = dict_id.to_bytes(4, "big") + c.compress(raw) + c.flush()
+    return packed if len(packed) < len(raw) else text
+
+
+def register_codec(conn):
+    # SQL inflate(content) returns a blob's text whatever its storage (the
+    # sections_full view and the compressed-mode FTS triggers use it);
+    # deflate(text, dict_id) packs new blobs. Dictionaries never change once
+    # stored, so each connection caches the ones it has seen.
+    dicts = {0: b""}
+
+    def zdict(dict_id):
+        if dict_id not in dicts:
+            row = conn.execute("SELECT dict FROM content_dicts WHERE id=?", (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown content dictionary {dict_id}")
+            dicts[dict_id] = row[0]
+        return dicts[dict_id]
+
+    def inflate(value):
+        if not isinstance(value, bytes):
+            return value
+        d = zlib.decompressobj(-15, zdict=zdict(int.from_bytes(value[:4], "big")))
+        return (d.decompress(value[4:]) + d.flush()).decode("utf-8")
+
+    def deflate(text, dict_id):
+        return _deflate(text, zdict(dict_id), dict_id)
+
+    conn.create_function("inflate", 1, inflate, deterministic=True)
+    conn.create_function("deflate", 2, deflate, deterministic=True)
+
+
+def _train_dict(texts, size):
+    # Lines and words that recur across blobs, scored by the bytes a match
+    # against the dictionary saves. deflate reaches the end of the dictionary
+    # most cheaply, so the best entries go last.
+    df = Counter()
+    step = max(1, len(texts) // DICT_SAMPLE_BLOBS)
+    for text in texts[::step]:
+        pieces = {line.strip() for line in text.splitlines()}
+        pieces.update(DICT_WORD_RE.findall(text))
+        df.update(p for p in pieces if len(p) >= 4)
+    picked, used = [], 0
+    for piece, n in sorted(df.items(), key=lambda x: (-(x[1] - 1) * len(x[0]), x[0])):
+        cost = len(piece.encode("utf-8")) + 1
+        if n < 2 or used + cost > size:
             continue
-        conn.execute(
-            "INSERT OR REPLACE INTO sections(id, doc_id, legacy_id, title, content, content_hash, token_count, keywords, links, ai_hints, summary, line_range, file_path, updated_at) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                sid,
-                doc_id,
-                s.get("legacy_id") or "",
-                s.get("title"),
-                s.get("content") or "",
-                ch,
-                int(s.get("token_count") or 0),
-                _jarr(s.get("keywords")),
-                _jarr(s.get("links")),
-                _jarr(s.get("ai_hints")),
-                s.get("summary") or "",
-                _jarr(s.get("line_range")),
-                s.get("file_path"),
-                now,
-            ),
-        )
-        inserted += 1
-    incoming = sorted(by_id.keys())
-    if incoming:
-        ph = ",".join(["?"] * len(incoming))
-        conn.execute(
-            f"DELETE FROM sections WHERE doc_id=? AND id NOT IN ({ph})",
-            [doc_id, *incoming],
+        picked.append(piece)
+        used += cost
+    return "\n".join(reversed(picked)).encode("utf-8")
+
+
+def set_content_codec(conn, codec, dict_bytes=DEFAULT_DICT_BYTES):
+    # Switches blob storage between plain text ("none") and "zlib", retraining
+    # the dictionary (dict_bytes 0 = none) on the current blobs. Compressed
+    # mode feeds sections_fts and the contentless blobs_trigram through
+    # inflate() in the triggers, and sections_full inflates only the rows a
+    # query (or snippet()) actually reads. The indexed text is the same in
+    # both modes, so sections_fts itself is left alone.
+    if codec not in ("none", "zlib"):
+        raise ValueError(f"codec must be 'none' or 'zlib', got {codec!r}")
+    rows = conn.execute("SELECT id, inflate(content) FROM blobs").fetchall()
+    _run_ddl(conn, DROP_CONTENT_FTS_SQL)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS content_dicts(id INTEGER PRIMARY KEY AUTOINCREMENT, dict BLOB NOT NULL, trained_at TEXT NOT NULL)"
+    )
+    conn.execute("DELETE FROM content_dicts")
+    if codec == "none":
+        conn.executemany("UPDATE blobs SET content=? WHERE id=?", [(t, i) for i, t in rows])
+        _run_ddl(conn, SCHEMA_SQL)
+        conn.execute("INSERT INTO blobs_trigram(blobs_trigram) VALUES('rebuild')")
+        _meta_set(conn, "content_codec", "")
+    else:
+        zdict = _train_dict([t for _, t in rows], dict_bytes) if dict_bytes > 0 else b""
+        dict_id = 0
+        if zdict:
+            dict_id = conn.execute(
+                "INSERT INTO content_dicts(dict, trained_at) VALUES(?, ?)", (zdict, _utc())
+            ).lastrowid
+        conn.executemany(
+            "UPDATE blobs SET content=? WHERE id=?", [(_deflate(t, zdict, dict_id), i) for i, t in rows]
         )
+        _run_ddl(conn, COMPRESSED_CONTENT_SQL)
+        conn.executemany("INSERT INTO blobs_trigram(rowid, content) VALUES(?, ?)", rows)
+        _meta_set(conn, "content_codec", f"zlib:{dict_id}")
+    bump_generation(conn)
+    return len(rows)
+
+
+@functools.lru_cache(maxsize=65536)
+def _word_features(word, dim):
+    # (index, signed weight) pairs for a word and its boundary-marked char
+    # trigrams, so "indexing" still overlaps "indexes".
+    padded = f"#{word}#"
+    feats = [(word, 1.0)] + [(padded[i : i + 3], 0.5) for i in range(len(padded) - 2)]
+    return tuple(_hashed(feat, weight, dim) for feat, weight in feats)
+
+
+def _hashed(feat, weight, dim):
+    h = zlib.crc32(feat.encode("utf-8"))
+    return h % dim, (weight if h & 0x80000000 else -weight)
+
+
+def section_vector(text, dim):
+    # Hashed bag of words, word bigrams and char trigrams, signed to cancel
+    # collisions, sublinear tf, L2-normalized float32. crc32 keeps it stable
+    # across processes.
+    words = VECTOR_WORD_RE.findall((text or "").lower())
+    acc = {}
+    for word, n in Counter(words).items():
+        for i, w in _word_features(word, dim):
+            acc[i] = acc.get(i, 0.0) + n * w
+    for pair, n in Counter(zip(words, words[1:])).items():
+        i, w = _hashed(" ".join(pair), 1.0, dim)
+        acc[i] = acc.get(i, 0.0) + n * w
+    vec = array("f", bytes(4 * dim))
+    for i, v in acc.items():
+        if v:
+            vec[i] = math.copysign(1.0 + math.log(abs(v)), v)
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    for i in acc:
+        vec[i] /= norm
+    return vec
+
+
+def fill_vectors(conn, dim, doc_id=None):
+    q = "SELECT s.rowid, s.title, s.content FROM sections_full s WHERE NOT EXISTS (SELECT 1 FROM section_vectors v WHERE v.section_rowid = s.rowid)"
+    params = ()
+    if doc_id is not None:
+        q += " AND s.doc_id=?"
+        params = (doc_id,)
+    rows = [
+        (r["rowid"], section_vector(f"{r['title'] or ''}\n{r['content'] or ''}", dim).tobytes())
+        for r in conn.execute(q, params).fetchall()
+    ]
+    conn.executemany("INSERT INTO section_vectors(section_rowid, vec) VALUES(?, ?)", rows)
+    return len(rows)
+
+
+def ingest_doc(conn, doc_root, force=False):
+    chunk_tokens = chunk_tokens_setting(conn)
+    state = _doc_state(doc_root)
+    doc_id = state["doc_id"]
+    row = _manifest_rows(conn, doc_id).get(doc_id)
+    now = _utc()
+    if not force and _stat_unchanged(state, row):
+        sections = None
     else:
-        conn.execute("DELETE FROM sections WHERE doc_id=?", (doc_id,))
-    return doc_id, len(by_id), inserted, skipped
+        state, sections, _ = _parse_doc(
+            doc_root, state, _known_hash(state, row, force), chunk_tokens
+        )
+        _write_manifest(conn, state, now)
+    if sections is None:
+        n = conn.execute(
+            "SELECT COUNT(*) FROM sections WHERE doc_id=?", (doc_id,)
+        ).fetchone()[0]
+        return doc_id, n, 0, 0, True
+    n, inserted, skipped = _write_sections(conn, doc_id, sections, now)
+    return doc_id, n, inserted, skipped, False
+
+
+def manifest_matches(row):
+    # True while a doc's latest rewritten file is still the one its manifest
+    # `row` was ingested from, so recorded byte_range offsets address it; a
+    # touched-but-identical file costs one read and hash.
+    try:
+        state = _doc_state(os.path.dirname(row["rewritten_path"]))
+    except OSError:
+        return False
+    if _stat_unchanged(state, row):
+        return True
+    if state["rewritten_path"] != row["rewritten_path"] or state["size"] != row["size"]:
+        return False
+    with open(row["rewritten_path"], "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest() == row["file_hash"]
+
+
+def ingest_locked(db_file, doc_root, lock_timeout=DEFAULT_LOCK_TIMEOUT_S):
+    # `--ingest` for other tools: own connection, writer lock and transaction.
+    conn = connect(db_file)
+    try:
+        def run():
+            with conn:
+                return ingest_doc(conn, doc_root)
+        with writer_lock(db_file, lock_timeout):
+            return _retry_busy(run, conn)
+    finally:
+        conn.close()
+
+
+def _parse_job(job):
+    # None when the file vanished after the scan; ingest_all counts it and
+    # moves on rather than aborting the run.
+    try:
+        return _parse_doc(*job)
+    except FileNotFoundError:
+        return None
+
+
+def ingest_all(conn, map_root, jobs=1, batch_docs=INGEST_BATCH_DOCS, force=False):
+    # Workers only read, split and hash; every write goes through this one
+    # connection so SQLite never sees competing writers.
+    started = time.perf_counter()
+    chunk_tokens = chunk_tokens_setting(conn)
+    timings = {
+        "discover": 0.0,
+        "stat": 0.0,
+        "read": 0.0,
+        "hash": 0.0,
+        "split": 0.0,
+        "write": 0.0,
+        "commit": 0.0,
+    }
+    counts = {
+        "docs": 0,
+        "sections": 0,
+        "upserted": 0,
+        "files_skipped": 0,
+        "sections_skipped": 0,
+        "docs_vanished": 0,
+        "bytes_read": 0,
+    }
+    # One scandir pass lists and stats every doc (scan_states).
+    states = scan_states(map_root)
+    timings["discover"] = time.perf_counter() - started
+    t = time.perf_counter()
+    manifest = _manifest_rows(conn)
+    stored = dict(
+        conn.execute("SELECT doc_id, COUNT(*) FROM sections GROUP BY doc_id").fetchall()
+    )
+    todo = []
+    for doc_id in sorted(states):
+        state = states[doc_id]
+        doc_root = os.path.dirname(state["rewritten_path"])
+        row = manifest.get(doc_id)
+        if not force and _stat_unchanged(state, row):
+            counts["docs"] += 1
+            counts["sections"] += stored.get(state["doc_id"], 0)
+            counts["files_skipped"] += 1
+            continue
+        todo.append((doc_root, state, _known_hash(state, row, force), chunk_tokens))
+    timings["stat"] = time.perf_counter() - t
+    pending = 0
+    now = _utc()
+    pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and len(todo) > 1 else None
+    try:
+        if pool:
+            chunksize = max(1, len(todo) // (jobs * 8))
+            parsed = pool.map(_parse_job, todo, chunksize=chunksize)
+        else:
+            parsed = map(_parse_job, todo)
+        for result in parsed:
+            if result is None:
+                counts["docs_vanished"] += 1
+                continue
+            state, sections, phases = result
+            # With --jobs these are summed worker times, not wall time.
+            for k, v in phases.items():
+                timings[k] += v
+            counts["bytes_read"] += state["size"]
+            t = time.perf_counter()
+            _write_manifest(conn, state, now)
+            counts["docs"] += 1
+            if sections is None:
+                counts["sections"] += stored.get(state["doc_id"], 0)
+                counts["files_skipped"] += 1
+            else:
+                n, inserted, skipped = _write_sections(conn, state["doc_id"], sections, now)
+                counts["sections"] += n
+                counts["upserted"] += inserted
+                counts["sections_skipped"] += skipped
+            timings["write"] += time.perf_counter() - t
+            pending += 1
+            if pending >= batch_docs:
+                t = time.perf_counter()
+                conn.commit()
+                timings["commit"] += time.perf_counter() - t
+                pending = 0
+        t = time.perf_counter()
+        conn.commit()
+        timings["commit"] += time.perf_counter() - t
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    timings["total"] = time.perf_counter() - started
+    return counts, timings
 
 
 def discover_docs(map_root):
@@ -303,7 +1399,266 @@ def discover_docs(map_root):
     return docs
 
 
-def print_status(conn):
+def scan_states(map_root):
+    # One stat per doc; dirs without a rewritten file (or vanishing mid-scan)
+    # are left out, so they read as deleted to the caller.
+    states = {}
+    with os.scandir(os.path.abspath(map_root)) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            try:
+                state = _doc_state(entry.path)
+            except FileNotFoundError:
+                continue
+            states[state["doc_id"]] = state
+    return states
+
+
+def _stat_key(state):
+    return state and (state["rewritten_path"], state["size"], state["mtime_ns"])
+
+
+def _watch_batch(conn, map_root, ready, states, pending, totals, write):
+    def batch():
+        with conn:
+            out = []
+            for doc_id in ready:
+                if doc_id in states:
+                    out.append(ingest_doc(conn, os.path.join(map_root, doc_id)))
+                else:
+                    out.append((doc_id, drop_doc(conn, doc_id)))
+            return out
+
+    try:
+        results = write(batch)
+    except (OSError, UnicodeDecodeError, sqlite3.Error) as exc:
+        # Keep watching; the docs are retried when their files change again.
+        print(f"Re-ingest failed for {', '.join(ready)}: {exc}", flush=True)
+        for doc_id in ready:
+            pending.pop(doc_id, None)
+        return
+    done = time.time()
+    for result in results:
+        doc_id = result[0]
+        latency = done - pending.pop(doc_id)[1]
+        if len(result) == 2:
+            totals["dropped"] += 1
+            print(f"Dropped {doc_id}: {result[1]} sections (latency={latency:.3f}s)", flush=True)
+        elif result[4]:
+            print(f"Unchanged {doc_id}: {result[1]} sections", flush=True)
+        else:
+            totals["ingested"] += 1
+            print(
+                f"Ingested {doc_id}: {result[1]} sections (upserted={result[2]}, "
+                f"skipped={result[3]}, latency={latency:.3f}s)",
+                flush=True,
+            )
+
+
+def watch(conn, map_root, interval=1.0, debounce=0.5, write=None, cycles=None):
+    # Polls stat instead of inotify so it behaves the same on every platform
+    # and network mount. A doc is re-ingested once its file has been stable
+    # for `debounce` seconds; `write` wraps each batch (writer lock + retries).
+    write = write or (lambda fn: fn())
+    map_root = os.path.abspath(map_root)
+    manifest = _manifest_rows(conn)
+    states = scan_states(map_root)
+    # doc_id -> [last change seen (monotonic), saved at (epoch seconds)]
+    pending = {}
+    now_m, now_w = time.monotonic(), time.time()
+    for doc_id, state in states.items():
+        if not _stat_unchanged(state, manifest.get(doc_id)):
+            pending[doc_id] = [now_m - debounce, state["mtime_ns"] / 1e9]
+    for doc_id in manifest:
+        if doc_id not in states:
+            pending[doc_id] = [now_m - debounce, now_w]
+    totals = {"cycles": 0, "ingested": 0, "dropped": 0}
+    print(f"Watching {map_root} ({len(states)} docs, {len(pending)} to catch up)", flush=True)
+    try:
+        while cycles is None or totals["cycles"] < cycles:
+            totals["cycles"] += 1
+            now_m = time.monotonic()
+            ready = sorted(d for d, (seen, _) in pending.items() if now_m - seen >= debounce)
+            if ready:
+                _watch_batch(conn, map_root, ready, states, pending, totals, write)
+            time.sleep(max(0.05, min(interval, debounce)) if pending else interval)
+            fresh = scan_states(map_root)
+            now_m, now_w = time.monotonic(), time.time()
+            for doc_id in fresh.keys() | states.keys():
+                new = fresh.get(doc_id)
+                if _stat_key(new) != _stat_key(states.get(doc_id)):
+                    saved = new["mtime_ns"] / 1e9 if new else now_w
+                    pending[doc_id] = [now_m, saved]
+            states = fresh
+    except KeyboardInterrupt:
+        print("Stopped watching", flush=True)
+    return totals
+
+
+def audit(conn, map_root):
+    # Stat-only comparison against doc_manifest: no file reads, no hashing, so
+    # a touched-but-identical file still reads as stale until re-ingested.
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    manifest = _manifest_rows(conn) if "doc_manifest" in tables else {}
+    indexed = set()
+    if "sections" in tables:
+        indexed = {r[0] for r in conn.execute("SELECT DISTINCT doc_id FROM sections")}
+    states = scan_states(map_root)
+    report = {"fresh": [], "stale": [], "missing": [], "orphaned": []}
+    for doc_id, state in sorted(states.items()):
+        row = manifest.get(doc_id)
+        if _stat_unchanged(state, row):
+            report["fresh"].append((doc_id, ""))
+        elif row and row["version"] != state["version"]:
+            report["stale"].append((doc_id, f"v{row['version']} ingested, v{state['version']} on disk"))
+        elif row and row["rewritten_path"] != state["rewritten_path"]:
+            report["stale"].append((doc_id, f"ingested from {row['rewritten_path']}"))
+        elif row:
+            report["stale"].append((doc_id, "modified since last ingest"))
+        elif doc_id in indexed:
+            report["stale"].append((doc_id, "no manifest entry"))
+        else:
+            report["missing"].append((doc_id, "never ingested"))
+    for doc_id in sorted((manifest.keys() | indexed) - states.keys()):
+        report["orphaned"].append((doc_id, "no rewritten file on disk"))
+    return report
+
+
+def print_audit(report):
+    problems = [(d, k, detail) for k in ("stale", "missing", "orphaned") for d, detail in report[k]]
+    if problems:
+        print("| DocId | State | Detail |")
+        print("| --- | --- | --- |")
+        for doc_id, kind, detail in sorted(problems):
+            print(f"| {doc_id} | {kind} | {detail} |")
+    print(
+        f"Audit: {len(report['fresh'])} fresh, {len(report['stale'])} stale, "
+        f"{len(report['missing'])} missing, {len(report['orphaned'])} orphaned"
+    )
+    return 1 if problems else 0
+
+
+FTS_TABLES = ("sections_fts", "blobs_trigram")
+
+
+def _db_report(conn, db_file):
+    report = {
+        "bytes": sum(
+            os.path.getsize(db_file + suffix)
+            for suffix in ("", "-wal")
+            if os.path.exists(db_file + suffix)
+        ),
+        "pages": conn.execute("PRAGMA page_count").fetchone()[0],
+        "free_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+    for t in FTS_TABLES:
+        report[f"{t}_segments"] = conn.execute(
+            f"SELECT COUNT(DISTINCT segid) FROM {t}_idx"
+        ).fetchone()[0]
+    stats = blob_stats(conn)
+    report["blobs"] = stats["blobs"]
+    report["content_bytes_saved"] = stats["content_bytes_saved"]
+    return report
+
+
+def _check_integrity(conn):
+    for t in FTS_TABLES:
+        # Raises sqlite3.DatabaseError if the index disagrees with sections.
+        conn.execute(f"INSERT INTO {t}({t}, rank) VALUES('integrity-check', 1)")
+    orphans = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM section_keywords k LEFT JOIN sections s ON s.rowid = k.section_rowid WHERE s.rowid IS NULL)"
+        " + (SELECT COUNT(*) FROM section_vectors v LEFT JOIN sections s ON s.rowid = v.section_rowid WHERE s.rowid IS NULL)"
+    ).fetchone()[0]
+    # Every section needs its blob, and every refcount must match its sections.
+    bad_blobs = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM sections s WHERE NOT EXISTS (SELECT 1 FROM blobs b WHERE b.id = s.blob_id AND b.hash = s.content_hash))"
+        " + (SELECT COUNT(*) FROM blobs b WHERE b.refs != (SELECT COUNT(*) FROM sections s WHERE s.blob_id = b.id))"
+    ).fetchone()[0]
+    quick = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if orphans or bad_blobs or quick != "ok":
+        raise RuntimeError(
+            f"Integrity check failed: quick_check={quick}, orphan keyword/vector rows={orphans}, "
+            f"missing/miscounted blobs={bad_blobs}"
+        )
+
+
+def _vacuum_swap(conn, db_file):
+    # VACUUM INTO writes a compacted copy; the backup API then copies it back
+    # over the live DB in one write transaction, so readers see either the old
+    # or the new pages and never a half-swapped file (a rename would leave
+    # open readers sharing a -shm that no longer matches their file).
+    tmp = db_file + ".vacuum"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        conn.execute("VACUUM INTO ?", (tmp,))
+        src = sqlite3.connect(tmp)
+        src.row_factory = sqlite3.Row
+        register_codec(src)
+        try:
+            # Tables without an INTEGER PRIMARY KEY may be renumbered by
+            # VACUUM; the FTS and keyword tables key on sections.rowid.
+            with src:
+                _check_integrity(src)
+            src.backup(conn)
+        finally:
+            src.close()
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    with conn:
+        bump_generation(conn)
+
+
+def maintain(conn, db_file, automerge=None, crisismerge=None, merge_pages=None, vacuum=False):
+    timings = {}
+    before = _db_report(conn, db_file)
+    t = time.perf_counter()
+    with conn:
+        for fts in FTS_TABLES:
+            if automerge is not None:
+                conn.execute(f"INSERT INTO {fts}({fts}, rank) VALUES('automerge', ?)", (automerge,))
+            if crisismerge is not None:
+                conn.execute(f"INSERT INTO {fts}({fts}, rank) VALUES('crisismerge', ?)", (crisismerge,))
+            if merge_pages:
+                # Incremental: stop once a merge step writes (almost) nothing.
+                while True:
+                    changes = conn.total_changes
+                    conn.execute(f"INSERT INTO {fts}({fts}, rank) VALUES('merge', ?)", (merge_pages,))
+                    if conn.total_changes - changes < 2:
+                        break
+            else:
+                conn.execute(f"INSERT INTO {fts}({fts}) VALUES('optimize')")
+    timings["merge"] = time.perf_counter() - t
+    t = time.perf_counter()
+    with conn:
+        _check_integrity(conn)
+    timings["integrity"] = time.perf_counter() - t
+    t = time.perf_counter()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+    timings["analyze"] = time.perf_counter() - t
+    t = time.perf_counter()
+    if vacuum:
+        _vacuum_swap(conn, db_file)
+        timings["vacuum"] = time.perf_counter() - t
+        t = time.perf_counter()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    timings["checkpoint"] = time.perf_counter() - t
+    return before, _db_report(conn, db_file), timings
+
+
+def print_maintain(before, after, timings):
+    print("| Metric | Before | After |")
+    print("| --- | ---: | ---: |")
+    for k in before:
+        print(f"| {k} | {before[k]} | {after[k]} |")
+    print("Timings: " + " ".join(f"{k}={v:.3f}s" for k, v in timings.items()))
+
+
+def print_status(conn, top_keywords=20):
     q = "SELECT doc_id, COUNT(*) AS sections, COALESCE(SUM(token_count), 0) AS tokens, COALESCE(MAX(updated_at), '') AS last_updated FROM sections GROUP BY doc_id ORDER BY doc_id"
     rows = conn.execute(q).fetchall()
     print("| DocId | Sections | Tokens | Last Updated |")
@@ -312,6 +1667,39 @@ def print_status(conn):
         print(
             f"| {r['doc_id']} | {r['sections']} | {r['tokens']} | {r['last_updated']} |"
         )
+    b = blob_stats(conn)
+    saved = b["content_bytes_saved"]
+    pct = 100.0 * saved / b["content_bytes_referenced"] if b["content_bytes_referenced"] else 0.0
+    print()
+    print(
+        f"Content: {b['blobs']} unique blobs for {b['section_refs']} sections; "
+        f"{b['content_bytes_stored']} of {b['content_bytes_referenced']} bytes stored "
+        f"({saved} bytes, {pct:.1f}% saved)"
+    )
+    codec = content_codec_setting(conn)
+    if codec:
+        dict_id = int(codec.partition(":")[2])
+        size = conn.execute("SELECT length(dict) FROM content_dicts WHERE id=?", (dict_id,)).fetchone()
+        print(
+            f"Compression: zlib, {f'{size[0]}-byte dictionary' if size else 'no dictionary'}; "
+            f"{b['content_bytes_unique']} bytes of unique text"
+        )
+    edges = dict(conn.execute("SELECT kind, COUNT(*) FROM section_edges GROUP BY kind").fetchall())
+    print(
+        f"Edges: {edges.get('parent', 0)} parent, {edges.get('sibling', 0)} sibling, "
+        f"{edges.get('link', 0)} link"
+    )
+    if top_keywords <= 0:
+        return
+    q = "SELECT k.keyword, COUNT(*) AS sections, COUNT(DISTINCT s.doc_id) AS docs FROM section_keywords k JOIN sections s ON s.rowid = k.section_rowid GROUP BY k.keyword ORDER BY sections DESC, k.keyword LIMIT ?"
+    rows = conn.execute(q, (top_keywords,)).fetchall()
+    if not rows:
+        return
+    print()
+    print("| Keyword | Sections | Docs |")
+    print("| --- | ---: | ---: |")
+    for r in rows:
+        print(f"| {r['keyword']} | {r['sections']} | {r['docs']} |")
 
 
 def main(argv=None):
@@ -325,39 +1713,257 @@ def main(argv=None):
     g.add_argument("--ingest-all", action="store_true")
     g.add_argument("--status", action="store_true")
     g.add_argument("--drop-doc", metavar="DOC_ID")
+    g.add_argument(
+        "--audit",
+        action="store_true",
+        help="Compare docs on disk with the last ingest (stat only); exit 1 if any are stale, missing or orphaned.",
+    )
+    g.add_argument(
+        "--maintain",
+        action="store_true",
+        help="Merge/optimize the FTS indexes, check integrity, ANALYZE, and report size and segment counts.",
+    )
+    g.add_argument(
+        "--watch",
+        action="store_true",
+        help="Poll the map root and re-ingest docs whose rewritten file changes (Ctrl-C to stop).",
+    )
+    p.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-parse docs even when the manifest says the file is unchanged.",
+    )
+    p.add_argument(
+        "--chunk-tokens",
+        type=int,
+        metavar="N",
+        help="Split sections over N tokens into child chunks (0 = off). Saved in the DB; changing it re-parses every doc.",
+    )
+    p.add_argument(
+        "--vectors",
+        type=int,
+        metavar="DIM",
+        help="Store DIM-wide hashed n-gram vectors per section for shards_search.py --hybrid (0 = off). Saved in the DB.",
+    )
+    p.add_argument(
+        "--compress",
+        choices=("none", "zlib"),
+        help="Store section content zlib-compressed with a dictionary trained on the corpus, or back as plain text. Saved in the DB; re-running retrains the dictionary.",
+    )
+    p.add_argument(
+        "--dict-bytes",
+        type=int,
+        default=DEFAULT_DICT_BYTES,
+        metavar="N",
+        help="--compress zlib dictionary size (0 = no dictionary).",
+    )
+    p.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Parse workers for --ingest-all (0 = one per CPU).",
+    )
+    p.add_argument(
+        "--busy-timeout",
+        type=int,
+        default=DEFAULT_BUSY_TIMEOUT_MS,
+        metavar="MS",
+        help="SQLite busy_timeout for this connection.",
+    )
+    p.add_argument(
+        "--lock-timeout",
+        type=float,
+        default=DEFAULT_LOCK_TIMEOUT_S,
+        metavar="SECONDS",
+        help="Max wait for the advisory writer lock held by other ingests.",
+    )
+    p.add_argument(
+        "--top-keywords",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Keyword frequency rows shown by --status (0 to hide).",
+    )
+    p.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="--watch polling interval.",
+    )
+    p.add_argument(
+        "--debounce",
+        type=float,
+        default=0.5,
+        metavar="SECONDS",
+        help="--watch waits until a doc has been quiet this long before re-ingesting it.",
+    )
+    p.add_argument(
+        "--automerge",
+        type=int,
+        metavar="N",
+        help="With --maintain, store this FTS5 automerge setting (0 disables background merging).",
+    )
+    p.add_argument(
+        "--crisismerge",
+        type=int,
+        metavar="N",
+        help="With --maintain, store this FTS5 crisismerge setting.",
+    )
+    p.add_argument(
+        "--merge-pages",
+        type=int,
+        metavar="N",
+        help="With --maintain, merge incrementally N pages at a time instead of a full optimize.",
+    )
+    p.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="With --maintain, also compact the file (VACUUM INTO a copy, then swap it in).",
+    )
+    p.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print per-phase timings, row/byte counts and SQLite statement counts as JSON on stderr.",
+    )
+    p.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write a cProfile dump of this run to FILE (--jobs parse workers are not profiled).",
+    )
     a = p.parse_args(argv)
+    jobs = a.jobs if a.jobs > 0 else (os.cpu_count() or 1)
     db_file = db_path(a.map_root)
-    os.makedirs(os.path.dirname(db_file), exist_ok=True)
-    conn = connect(db_file)
-    try:
-        with conn:
-            init_schema(conn)
+    if a.audit:
+        # Read-only and lock-free so it can run before every query batch.
+        if not os.path.exists(db_file):
+            print(f"Error: no shards DB at {db_file}; run --init first.", file=sys.stderr)
+            return 1
+        conn = connect_ro(db_file, busy_timeout_ms=a.busy_timeout)
+    else:
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        conn = connect(db_file, busy_timeout_ms=a.busy_timeout)
+
+    def locked(fn):
+        with writer_lock(db_file, a.lock_timeout):
+            return _retry_busy(fn, conn)
+
+    def in_txn(fn):
+        def run():
+            with conn:
+                return fn()
+        return run
+
+    def setup():
+        init_schema(conn)
+        if a.chunk_tokens is not None and max(0, a.chunk_tokens) != chunk_tokens_setting(conn):
+            # Manifest entries describe the old chunking, so every doc must be
+            # re-parsed the next time it is ingested.
+            _meta_set(conn, "chunk_tokens", max(0, a.chunk_tokens))
+            conn.execute("DELETE FROM doc_manifest")
+        if a.vectors is not None and max(0, a.vectors) != vector_dim_setting(conn):
+            # Vectors come from stored rows, so no re-parse is needed.
+            _meta_set(conn, "vector_dim", max(0, a.vectors))
+            conn.execute("DELETE FROM section_vectors")
+            if a.vectors > 0:
+                fill_vectors(conn, a.vectors)
+            bump_generation(conn)
+        if a.compress == "zlib" or (a.compress == "none" and content_codec_setting(conn)):
+            # Blobs are rewritten in place; nothing needs a re-parse.
+            n = set_content_codec(conn, a.compress, a.dict_bytes)
+            print(f"Content storage: {a.compress} ({n} blobs rewritten)")
+
+    stats = {"phases": {}, "counts": {}}
+
+    def timed(phase, fn):
+        t = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            stats["phases"][phase] = time.perf_counter() - t
+
+    def dispatch():
+        if a.audit:
+            report = timed("audit", lambda: audit(conn, a.map_root))
+            stats["counts"].update({k: len(v) for k, v in report.items()})
+            return print_audit(report)
+        timed("setup", lambda: locked(in_txn(setup)))
         if a.init:
             print(f"Initialized DB: {db_file}")
             return 0
         if a.drop_doc:
-            with conn:
-                conn.execute("DELETE FROM sections WHERE doc_id=?", (a.drop_doc,))
+            n = timed("drop", lambda: locked(in_txn(lambda: drop_doc(conn, a.drop_doc))))
+            stats["counts"]["sections_deleted"] = n
             print(f"Dropped doc: {a.drop_doc}")
             return 0
         if a.status:
-            print_status(conn)
+            timed("status", lambda: print_status(conn, top_keywords=a.top_keywords))
             return 0
         if a.ingest:
-            with conn:
-                doc_id, n, ins, skip = ingest_doc(conn, a.ingest)
-            print(f"Ingested {doc_id}: {n} sections (upserted={ins}, skipped={skip})")
+            doc_id, n, ins, skip, unchanged = timed(
+                "ingest", lambda: locked(in_txn(lambda: ingest_doc(conn, a.ingest, force=a.force)))
+            )
+            stats["counts"].update(
+                {"sections": n, "upserted": ins, "sections_skipped": skip, "unchanged": unchanged}
+            )
+            if unchanged:
+                print(f"Unchanged {doc_id}: {n} sections (file matches manifest; use --force to re-ingest)")
+            else:
+                print(f"Ingested {doc_id}: {n} sections (upserted={ins}, skipped={skip})")
+            return 0
+        if a.maintain:
+            before, after, timings = locked(
+                lambda: maintain(
+                    conn,
+                    db_file,
+                    automerge=a.automerge,
+                    crisismerge=a.crisismerge,
+                    merge_pages=a.merge_pages,
+                    vacuum=a.vacuum,
+                )
+            )
+            stats["phases"].update(timings)
+            stats["counts"].update({"before": before, "after": after})
+            print_maintain(before, after, timings)
+            return 0
+        if a.watch:
+            stats["counts"].update(
+                watch(conn, a.map_root, interval=a.interval, debounce=a.debounce, write=locked)
+            )
             return 0
         if a.ingest_all:
-            total_docs = total_sections = 0
-            for doc_root in discover_docs(a.map_root):
-                with conn:
-                    _, n, _, _ = ingest_doc(conn, doc_root)
-                total_docs += 1
-                total_sections += n
-            print(f"Ingested all docs: {total_docs} docs, {total_sections} sections")
+            counts, timings = locked(
+                lambda: ingest_all(conn, a.map_root, jobs=jobs, force=a.force)
+            )
+            stats["phases"].update(timings)
+            stats["counts"].update(counts)
+            print(f"Ingested all docs: {counts['docs']} docs, {counts['sections']} sections")
+            print(
+                f"Upserted {counts['upserted']} sections; skipped {counts['files_skipped']} docs "
+                f"(file level) and {counts['sections_skipped']} sections (section level)"
+            )
+            if counts["docs_vanished"]:
+                print(f"Skipped {counts['docs_vanished']} docs whose file vanished mid-ingest")
+            print(
+                "Timings: "
+                + " ".join(f"{k}={v:.3f}s" for k, v in timings.items())
+                + f" (jobs={jobs})"
+            )
             return 0
         return 2
+
+    started = time.perf_counter()
+    tracer = trace_statements(conn) if a.stats else contextlib.nullcontext({})
+    try:
+        with profiled(a.profile), tracer as trace:
+            rc = dispatch()
+        if a.stats:
+            stats["phases"]["wall"] = time.perf_counter() - started
+            stats["phases"] = {k: round(v, 6) for k, v in stats["phases"].items()}
+            stats.update(trace)
+            stats["jobs"] = jobs
+            print(json.dumps(stats), file=sys.stderr)
+        return rc
     finally:
         conn.close()
 
@@ -1,159 +1,2097 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
+import hashlib
+import json
+import mmap
+import os
 import re
+import socket
+import socketserver
 import sqlite3
 import sys
+import time
+from array import array
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    import numpy as np
+except ImportError:  # pure-Python dot products instead
+    np = None
+
+import shards_db
+from shards_db import SECTION_COLUMNS, profiled, section_vector, trace_statements
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+
+
+DEFAULT_BUSY_TIMEOUT_S = 5.0
+STATEMENT_CACHE_SIZE = 256
+ROLLUP_SELECT = ", s.id AS _hit_id, COALESCE(s.parent_id, s.id) AS _group"
+# Plain hits carry their rowid so callers can page with --after.
+CURSOR_SELECT = ", s.rowid AS _rowid"
+SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_ELLIPSIS = "**", "**", "…"
+# FTS5 snippet() caps excerpts at 64 tokens; ~6 chars per token sizes the request.
+SNIPPET_MAX_TOKENS = 64
+SNIPPET_CHARS_PER_TOKEN = 6
+# Request keys that change a search's results; everything else (e.g. "id") is ignored.
+CACHE_KEY_FIELDS = (
+    "keyword",
+    "keyword_match",
+    "regex",
+    "query",
+    "doc",
+    "top",
+    "full",
+    "snippet",
+    "max_tokens",
+    "rollup",
+    "fuzzy",
+    "hybrid",
+    "alpha",
+    "pool",
+    "fusion",
+    "brute_force",
+    "after",
+    "expand",
+    "hops",
+    "expand_tokens",
+    "by_doc",
+    "per_doc",
+)
+DEFAULT_HYBRID_ALPHA = 0.5
+DEFAULT_HYBRID_POOL = 50
+RRF_K = 60
+# --fuzzy bounds: vocab rows scanned and OR-alternatives added per unknown term.
+FUZZY_SCAN_LIMIT = 500
+FUZZY_MAX_EXPANSIONS = 4
+FUZZY_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789"
+FUZZY_PLAIN_QUERY_RE = re.compile(r"^[\w\s]+$")
+FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+# --expand names -> section_edges kinds (see shards_db._section_edges).
+EXPAND_KINDS = {"parent": "parent", "siblings": "sibling", "links": "link"}
+DEFAULT_EXPAND_HOPS = 1
+DEFAULT_EXPAND_TOKENS = 2000
+# --by-doc: best sections reported per doc.
+DEFAULT_PER_DOC = 3
+DEFAULT_CACHE_ENTRIES = 512
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def _connect_ro(db_path, timeout=DEFAULT_BUSY_TIMEOUT_S, check_same_thread=True):
+    """Read-only connection that waits out WAL checkpoints instead of failing."""
+    conn = sqlite3.connect(
+        f"file:{db_path}?mode=ro",
+        uri=True,
+        timeout=timeout,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=check_same_thread,
+    )
+    conn.row_factory = sqlite3.Row
+    _register_functions(conn)
+    return conn
 
-def _warn(message):
-    print(f"Warning: {message}", file=sys.stderr)
 
+def _register_functions(conn):
+    """SQL functions searches use: inflate() for compressed content."""
+    shards_db.register_codec(conn)
 
-def _check_db_schema(db_path, expected_version="2"):
-    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+@contextlib.contextmanager
+def _reader(db):
+    """Yield a connection for `db`, which is either a DB path or an open connection."""
+    if isinstance(db, sqlite3.Connection):
+        _register_functions(db)
+        yield db
+        return
+    conn = _connect_ro(db)
     try:
-        row = conn.execute(
-            "SELECT value FROM meta WHERE key='schema_version'"
-        ).fetchone()
-        version = row[0] if row else None
-    except sqlite3.OperationalError:
-        version = None
+        yield conn
     finally:
         conn.close()
 
+
+def _select_list(columns, alias="s"):
+    """SQL select list for `columns` (None = every column)."""
+    if columns is None:
+        columns = SECTION_COLUMNS
+    unknown = [c for c in columns if c not in SECTION_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown section columns: {', '.join(unknown)}")
+    return ", ".join(f"{alias}.{c}" for c in columns)
+
+
+def _projection(show_content=False):
+    """Columns the CLI/JSON output actually prints."""
+    if show_content:
+        return ("id", "title", "parent_id", "content")
+    return ("id", "title", "parent_id")
+
+
+def _clip(text, max_chars):
+    text = " ".join((text or "").split())
+    if len(text) <= max_chars:
+        return text
+    return text[: max(0, max_chars - len(SNIPPET_ELLIPSIS))] + SNIPPET_ELLIPSIS
+
+
+def _regex_excerpt(content, match, max_chars):
+    """Window of about `max_chars` around a regex match, with the match highlighted."""
+    start, end = match.span()
+    room = max(0, max_chars - (end - start))
+    lo = max(0, start - room // 2)
+    hi = min(len(content), end + room - (start - lo))
+    text = (
+        content[lo:start]
+        + SNIPPET_OPEN
+        + content[start:end]
+        + SNIPPET_CLOSE
+        + content[end:hi]
+    )
+    text = " ".join(text.split())
+    if lo > 0:
+        text = SNIPPET_ELLIPSIS + text
+    if hi < len(content):
+        text += SNIPPET_ELLIPSIS
+    return text
+
+
+def _warn(message):
+    print(f"Warning: {message}", file=sys.stderr)
+
+
+def _explain(conn, sql):
+    """EXPLAIN QUERY PLAN rows for an expanded (parameter-inlined) statement, indented by depth."""
+    depth = {0: -1}
+    lines = []
+    for r in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        depth[r["id"]] = depth.get(r["parent"], -1) + 1
+        lines.append("  " * depth[r["id"]] + r["detail"])
+    return lines
+
+
+def _check_db_schema(db_path, expected_version=str(shards_db.SCHEMA_VERSION)):
+    with _reader(db_path) as conn:
+        try:
+            row = conn.execute(
+                "SELECT value FROM meta WHERE key='schema_version'"
+            ).fetchone()
+            version = row[0] if row else None
+        except sqlite3.OperationalError:
+            version = None
+
     if version != expected_version:
         _warn(
             f"DB schema_version={version} (expected {expected_version}); results may be unreliable"
         )
 
 
-def search_db_keyword(db_path, keyword, doc_filter=None, limit=5):
-    """Search by exact keyword match in the keywords JSON array stored in sections table."""
-    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
-    conn.row_factory = sqlite3.Row
-    query = "SELECT * FROM sections WHERE EXISTS (SELECT 1 FROM json_each(keywords) WHERE json_each.value = ?)"
-    params = [keyword]
+def _parse_cursor(after):
+    """(rank, rowid) from a page cursor: "rank,rowid", "rowid" (unranked modes) or a list."""
+    if after is None or after == "":
+        return None
+    parts = after.split(",") if isinstance(after, str) else list(after)
+    try:
+        if len(parts) == 1:
+            return None, int(parts[0])
+        if len(parts) == 2:
+            rank = float(parts[0]) if parts[0] not in ("", None) else None
+            return rank, int(parts[1])
+    except (TypeError, ValueError):
+        pass
+    raise ValueError(f"bad cursor {after!r}; expected 'rank,rowid' or 'rowid'")
+
+
+def _cursor(r):
+    """Page cursor for a hit that carries its rowid, for --after."""
+    if r.get("rank") is not None:
+        return f"{r['rank']!r},{r['_rowid']}"
+    return str(r["_rowid"])
+
+
+def _check_after(after, rollup, max_tokens):
+    if after is not None and (rollup or max_tokens is not None):
+        raise ValueError("after cannot be combined with rollup or max_tokens")
+
+
+def _keyword_sql(keyword, doc_filter, limit, match, select, snippet=None, after=None):
+    keywords = [keyword] if isinstance(keyword, str) else list(dict.fromkeys(keyword))
+    if match not in ("all", "any"):
+        raise ValueError(f"match must be 'all' or 'any', got {match!r}")
+    ph = ",".join(["?"] * len(keywords))
+    subquery = f"SELECT section_rowid FROM section_keywords WHERE keyword IN ({ph})"
+    params = list(keywords)
+    if match == "all" and len(keywords) > 1:
+        subquery += " GROUP BY section_rowid HAVING COUNT(*) = ?"
+        params.append(len(keywords))
+    if snippet:
+        # Over-fetch a little so whitespace collapsing still fills the excerpt.
+        select += ", substr(s.content, 1, ?) AS snippet"
+        params.insert(0, snippet * 2)
+    query = f"SELECT {select} FROM sections_full s WHERE s.rowid IN ({subquery})"
     if doc_filter:
-        query += " AND doc_id = ?"
+        query += " AND s.doc_id = ?"
         params.append(doc_filter)
-    query += " LIMIT ?"
-    params.append(limit)
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    if after is not None:
+        query += " AND s.rowid > ?"
+        params.append(after[1])
+    query += " ORDER BY s.rowid"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
 
 
-def search_db_bm25(db_path, query_text, doc_filter=None, limit=5):
-    """FTS5 full-text search with BM25 ranking. bm25() returns NEGATIVE scores (lower=better)."""
-    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
-    conn.row_factory = sqlite3.Row
-    fts_query = """
-        SELECT s.*, bm25(sections_fts, 10.0, 1.0, 5.0) AS rank
-        FROM sections_fts
-        JOIN sections s ON s.rowid = sections_fts.rowid
-        WHERE sections_fts MATCH ?
+# Every section matching a BM25 query as (section_rowid, rank); binds the query
+# once. Title, content and keywords weigh 10:1:5.
+BM25_MATCHES_SQL = """
+    SELECT rowid AS section_rowid, bm25(sections_fts, 10.0, 1.0, 5.0) AS rank
+    FROM sections_fts WHERE sections_fts MATCH ?
+"""
+
+
+def _bm25_snippet_sql(query_text, snippet):
+    """Select-list snippet for BM25 hits of sections_full `s`, and its parameters."""
+    # A correlated lookup, so snippet() runs only for the returned rows.
+    tokens = max(1, min(SNIPPET_MAX_TOKENS, snippet // SNIPPET_CHARS_PER_TOKEN))
+    sql = (
+        ", (SELECT snippet(sections_fts, 1, ?, ?, ?, ?) FROM sections_fts"
+        " WHERE sections_fts MATCH ? AND rowid = s.rowid) AS snippet"
+    )
+    return sql, [SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_ELLIPSIS, tokens, query_text]
+
+
+def _bm25_sql(query_text, doc_filter, limit, select, snippet=None, after=None):
+    # Ranking runs on rowids alone (BM25_MATCHES_SQL); sections_full columns
+    # (content, which may need inflating) are read only for the rows that
+    # survive the LIMIT.
+    params = []
+    if snippet:
+        snippet_sql, params = _bm25_snippet_sql(query_text, snippet)
+        select += snippet_sql
+    ranked = f"SELECT m.section_rowid AS section_rowid, m.rank AS rank FROM ({BM25_MATCHES_SQL}) m"
+    params.append(query_text)
+    if doc_filter:
+        ranked += " JOIN sections d ON d.rowid = m.section_rowid AND d.doc_id = ?"
+        params.append(doc_filter)
+    if after is not None:
+        if after[0] is None:
+            raise ValueError("a BM25 cursor needs 'rank,rowid'")
+        # Keyset paging: resume strictly after the last (rank, rowid) seen.
+        ranked += " WHERE (m.rank, m.section_rowid) > (?, ?)"
+        params += list(after)
+    ranked += " ORDER BY m.rank, m.section_rowid"
+    if limit is not None:
+        ranked += " LIMIT ?"
+        params.append(limit)
+    query = f"""
+        SELECT {select}, r.rank AS rank
+        FROM ({ranked}) r
+        JOIN sections_full s ON s.rowid = r.section_rowid
+        ORDER BY r.rank, r.section_rowid
     """
+    return query, params
+
+
+def _edit_distance(a, b, cap):
+    """Levenshtein distance, or cap + 1 as soon as it must exceed cap."""
+    if abs(len(a) - len(b)) > cap:
+        return cap + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > cap:
+            return cap + 1
+        prev = cur
+    return prev[-1]
+
+
+def _one_edit_variants(term):
+    splits = [(term[:i], term[i:]) for i in range(len(term) + 1)]
+    variants = {a + b[1:] for a, b in splits if b}
+    variants |= {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    variants |= {a + c + b[1:] for a, b in splits if b for c in FUZZY_ALPHABET}
+    variants |= {a + c + b for a, b in splits for c in FUZZY_ALPHABET}
+    variants.discard(term)
+    return variants
+
+
+def _fuzzy_alternatives(conn, term, max_expansions=FUZZY_MAX_EXPANSIONS, scan_limit=FUZZY_SCAN_LIMIT):
+    """MATCH alternatives for an unindexed term: a prefix, then stems within edit distance 1-2."""
+    alternatives = []
+    if conn.execute(
+        "SELECT 1 FROM sections_fts_vocab WHERE term > ? AND term < ? LIMIT 1",
+        (term, term + "\U0010ffff"),
+    ).fetchone():
+        alternatives.append(_fts_phrase(term) + "*")
+    cap = 1 if len(term) <= 4 else 2
+    head = term[:2]
+    found = {}
+    for r in conn.execute(
+        "SELECT term, doc FROM sections_fts_vocab WHERE term >= ? AND term < ? LIMIT ?",
+        (head, head + "\U0010ffff", scan_limit),
+    ):
+        d = _edit_distance(term, r["term"], cap)
+        if d <= cap:
+            found[r["term"]] = (d, -r["doc"])
+    variants = sorted(v for v in _one_edit_variants(term) if v[:2] != head)
+    if variants:
+        ph = ",".join(["?"] * len(variants))
+        for r in conn.execute(
+            f"SELECT term, doc FROM sections_fts_vocab WHERE term IN ({ph})", variants
+        ):
+            found[r["term"]] = (1, -r["doc"])
+    ranked = sorted(found, key=lambda t: (found[t], t))
+    alternatives += [_fts_phrase(t) for t in ranked[: max(0, max_expansions - len(alternatives))]]
+    return alternatives
+
+
+def _expand_query(conn, query_text, **bounds):
+    """Rewrite unknown terms of a plain-word query into OR groups; returns (query, {term: [alternatives]})."""
+    if not FUZZY_PLAIN_QUERY_RE.match(query_text or ""):
+        return query_text, {}
+    parts, expanded = [], {}
+    for word in query_text.split():
+        if word in FTS_OPERATORS:
+            parts.append(word)
+            continue
+        term = word.lower()
+        if conn.execute(
+            "SELECT 1 FROM sections_fts WHERE sections_fts MATCH ? LIMIT 1", (_fts_phrase(term),)
+        ).fetchone():
+            parts.append(_fts_phrase(term))
+            continue
+        alternatives = _fuzzy_alternatives(conn, term, **bounds)
+        if not alternatives:
+            parts.append(_fts_phrase(term))
+            continue
+        expanded[word] = alternatives
+        parts.append(alternatives[0] if len(alternatives) == 1 else "(" + " OR ".join(alternatives) + ")")
+    # FTS5 only ANDs adjacent phrases implicitly, not parenthesized groups.
+    out = []
+    for part in parts:
+        if out and out[-1] not in FTS_OPERATORS and part not in FTS_OPERATORS:
+            out.append("AND")
+        out.append(part)
+    return " ".join(out), expanded
+
+
+def _stream(conn, query, params, snippet=None):
+    """Yield result dicts straight off the cursor, clipping snippets as they go."""
+    for r in conn.execute(query, params):
+        row = dict(r)
+        if snippet:
+            row["snippet"] = _clip(row["snippet"], snippet)
+        yield row
+
+
+def _clip_snippets(results, snippet):
+    if snippet:
+        for r in results:
+            r["snippet"] = _clip(r["snippet"], snippet)
+    return results
+
+
+def _check_rollup(rollup, max_tokens):
+    if rollup and max_tokens is not None:
+        raise ValueError("rollup cannot be combined with max_tokens")
+
+
+def _first_per_group(rows, limit):
+    seen = set()
+    results = []
+    for r in rows:
+        if r["_group"] in seen:
+            continue
+        seen.add(r["_group"])
+        results.append(dict(r))
+        if limit is not None and len(results) >= limit:
+            break
+    return results
+
+
+def _roll_up(conn, results):
+    """Report chunk hits as their parent section; content/token_count/line_range cover all chunks."""
+    parents = [r["_group"] for r in results if r["_group"] != r["_hit_id"]]
+    chunks = {}
+    for i in range(0, len(parents), 500):
+        batch = parents[i : i + 500]
+        ph = ",".join(["?"] * len(batch))
+        for c in conn.execute(
+            f"SELECT parent_id, content, token_count, line_range, byte_range FROM sections_full WHERE parent_id IN ({ph}) ORDER BY parent_id, chunk_no",
+            batch,
+        ):
+            chunks.setdefault(c["parent_id"], []).append(c)
+    for r in results:
+        group, hit_id = r.pop("_group"), r.pop("_hit_id")
+        if group == hit_id:
+            continue
+        parts = chunks.get(group, [])
+        if "id" in r:
+            r["id"] = group
+        r["best_chunk"] = hit_id
+        r["parent_id"] = None
+        if "chunk_no" in r:
+            r["chunk_no"] = None
+        if "content" in r:
+            r["content"] = "\n\n".join(c["content"] or "" for c in parts)
+        if "token_count" in r:
+            r["token_count"] = sum(c["token_count"] or 0 for c in parts)
+        if "line_range" in r and parts:
+            first, last = json.loads(parts[0]["line_range"]), json.loads(parts[-1]["line_range"])
+            r["line_range"] = json.dumps([first[0], last[-1]], separators=(",", ":"))
+        if "byte_range" in r and parts:
+            first, last = json.loads(parts[0]["byte_range"] or "[]"), json.loads(parts[-1]["byte_range"] or "[]")
+            r["byte_range"] = json.dumps([first[0], last[-1]] if first and last else [], separators=(",", ":"))
+    return results
+
+
+def _hit_cost(token_count, snippet_text, columns):
+    """Tokens a hit adds to the caller's context: the snippet alone unless content is returned."""
+    if snippet_text is not None and columns is not None and "content" not in columns:
+        return shards_db._tok_count(snippet_text)
+    return int(token_count or 0)
+
+
+def _pack_budget(conn, build_sql, columns, limit, max_tokens, snippet=None):
+    """Greedily pack ranked hits into `max_tokens`, then fetch only the chosen rows."""
+    query, params = build_sql("s.rowid AS _rowid, s.token_count", snippet)
+    picked = []
+    remaining = max_tokens
+    for r in conn.execute(query, params):
+        snippet_text = _clip(r["snippet"], snippet) if snippet else None
+        cost = _hit_cost(r["token_count"], snippet_text, columns)
+        if cost > remaining:
+            continue
+        hit = {"tokens": cost}
+        if snippet:
+            hit["snippet"] = snippet_text
+        if "rank" in r.keys():
+            hit["rank"] = r["rank"]
+        picked.append((r["_rowid"], hit))
+        remaining -= cost
+        if remaining <= 0 or (limit is not None and len(picked) >= limit):
+            break
+    if not picked:
+        return []
+    select = _select_list(columns)
+    fetched = {}
+    rowids = [rowid for rowid, _ in picked]
+    for i in range(0, len(rowids), 500):
+        chunk = rowids[i : i + 500]
+        ph = ",".join(["?"] * len(chunk))
+        for r in conn.execute(
+            f"SELECT s.rowid AS _rowid, {select} FROM sections_full s WHERE s.rowid IN ({ph})",
+            chunk,
+        ):
+            row = dict(r)
+            fetched[row.pop("_rowid")] = row
+    results = []
+    for rowid, hit in picked:
+        if rowid in fetched:
+            fetched[rowid].update(hit)
+            results.append(fetched[rowid])
+    return results
+
+
+def search_db_keyword(
+    db_path,
+    keyword,
+    doc_filter=None,
+    limit=5,
+    match="all",
+    columns=None,
+    snippet=None,
+    max_tokens=None,
+    rollup=False,
+    after=None,
+    stream=False,
+):
+    """Exact keyword search via the section_keywords index; lists are ANDed or ORed per `match`."""
+    if isinstance(keyword, str):
+        keyword = [keyword]
+    if not keyword:
+        return []
+    _check_rollup(rollup, max_tokens)
+    after = _parse_cursor(after)
+    _check_after(after, rollup, max_tokens)
+    with _reader(db_path) as conn:
+        if rollup:
+            query, params = _keyword_sql(
+                keyword, doc_filter, None, match, _select_list(columns) + ROLLUP_SELECT, snippet
+            )
+            results = _roll_up(conn, _first_per_group(conn.execute(query, params), limit))
+            return _clip_snippets(results, snippet)
+        if max_tokens is not None:
+            return _pack_budget(
+                conn,
+                lambda select, snip: _keyword_sql(keyword, doc_filter, None, match, select, snip),
+                columns,
+                limit,
+                max_tokens,
+                snippet,
+            )
+        query, params = _keyword_sql(
+            keyword, doc_filter, limit, match, _select_list(columns) + CURSOR_SELECT, snippet, after
+        )
+        hits = _stream(conn, query, params, snippet)
+        return hits if stream else list(hits)
+
+
+def search_db_bm25(
+    db_path,
+    query_text,
+    doc_filter=None,
+    limit=5,
+    columns=None,
+    snippet=None,
+    max_tokens=None,
+    rollup=False,
+    fuzzy=False,
+    after=None,
+    stream=False,
+):
+    """FTS5 full-text search with BM25 ranking. bm25() returns NEGATIVE scores (lower=better)."""
+    _check_rollup(rollup, max_tokens)
+    after = _parse_cursor(after)
+    _check_after(after, rollup, max_tokens)
+    with _reader(db_path) as conn:
+        if fuzzy:
+            query_text = _expand_query(conn, query_text)[0]
+        if rollup:
+            query, params = _bm25_sql(
+                query_text, doc_filter, None, _select_list(columns) + ROLLUP_SELECT, snippet
+            )
+            results = _roll_up(conn, _first_per_group(conn.execute(query, params), limit))
+            return _clip_snippets(results, snippet)
+        if max_tokens is not None:
+            return _pack_budget(
+                conn,
+                lambda select, snip: _bm25_sql(query_text, doc_filter, None, select, snip),
+                columns,
+                limit,
+                max_tokens,
+                snippet,
+            )
+        query, params = _bm25_sql(
+            query_text, doc_filter, limit, _select_list(columns) + CURSOR_SELECT, snippet, after
+        )
+        hits = _stream(conn, query, params, snippet)
+        return hits if stream else list(hits)
+
+
+def _bm25_docs_sql(query_text, doc_filter, docs, per_doc, select, snippet=None):
+    # One statement over the ranked matches: GROUP BY gives every doc its hit
+    # count and best/summed bm25, a window over that ranks the docs, and
+    # ROW_NUMBER() over the hits of the top `docs` docs keeps each one's best
+    # `per_doc`, so only those rows reach sections_full.
     params = [query_text]
+    doc_where = ""
     if doc_filter:
-        fts_query += " AND s.doc_id = ?"
+        doc_where = "WHERE d.doc_id = ?"
         params.append(doc_filter)
-    fts_query += " ORDER BY rank LIMIT ?"
-    params.append(limit)
-    rows = conn.execute(fts_query, params).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    top_docs = ""
+    if docs is not None:
+        top_docs = "WHERE g.doc_rank <= ?"
+        params.append(docs)
+    if snippet:
+        # The select list follows the CTEs, so its parameters do too.
+        snippet_sql, snippet_params = _bm25_snippet_sql(query_text, snippet)
+        select += snippet_sql
+        params += snippet_params
+    params.append(per_doc)
+    query = f"""
+        WITH h AS MATERIALIZED (
+            SELECT m.section_rowid, m.rank, d.doc_id
+            FROM ({BM25_MATCHES_SQL}) m
+            JOIN sections d ON d.rowid = m.section_rowid
+            {doc_where}
+        ),
+        g AS (
+            SELECT doc_id, COUNT(*) AS doc_hits, MIN(rank) AS doc_best, SUM(rank) AS doc_total,
+                ROW_NUMBER() OVER (ORDER BY MIN(rank), SUM(rank), doc_id) AS doc_rank
+            FROM h GROUP BY doc_id
+        ),
+        r AS (
+            SELECT h.section_rowid, h.rank, g.*,
+                ROW_NUMBER() OVER (PARTITION BY h.doc_id ORDER BY h.rank, h.section_rowid) AS doc_pos
+            FROM g JOIN h ON h.doc_id = g.doc_id
+            {top_docs}
+        )
+        SELECT {select}, r.rank AS rank, r.doc_rank, r.doc_hits, r.doc_best, r.doc_total
+        FROM r JOIN sections_full s ON s.rowid = r.section_rowid
+        WHERE r.doc_pos <= ?
+        ORDER BY r.doc_rank, r.doc_pos
+    """
+    return query, params
 
 
-def search_db_regex(db_path, pattern, doc_filter=None, limit=5, flags=0):
-    """Regex search across section content in DB."""
-    import re as re_mod
+def search_db_docs(
+    db_path,
+    query_text,
+    doc_filter=None,
+    limit=5,
+    per_doc=DEFAULT_PER_DOC,
+    columns=None,
+    snippet=None,
+    fuzzy=False,
+):
+    """BM25 search grouped by doc: the `limit` best docs, each with its `per_doc` best hits."""
+    if per_doc < 1:
+        raise ValueError("per_doc must be at least 1")
+    if columns is not None and "doc_id" not in columns:
+        columns = (*columns, "doc_id")
+    with _reader(db_path) as conn:
+        if fuzzy:
+            query_text = _expand_query(conn, query_text)[0]
+        query, params = _bm25_docs_sql(
+            query_text, doc_filter, limit, per_doc, _select_list(columns), snippet
+        )
+        return list(_stream(conn, query, params, snippet))
 
-    regex = re_mod.compile(pattern, flags)
-    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
-    conn.row_factory = sqlite3.Row
-    query = "SELECT * FROM sections"
+
+def search_facets(db_path, query_text, doc_filter=None, fuzzy=False):
+    """Counts of the sections matching a BM25 query, by doc_id and by ai_hints type."""
+    with _reader(db_path) as conn:
+        if fuzzy:
+            query_text = _expand_query(conn, query_text)[0]
+        params = [query_text]
+        doc_where = ""
+        if doc_filter:
+            doc_where = "WHERE d.doc_id = ?"
+            params.append(doc_filter)
+        rows = conn.execute(
+            f"""
+            WITH h AS MATERIALIZED (
+                SELECT d.rowid AS section_rowid, d.doc_id, d.ai_hints
+                FROM ({BM25_MATCHES_SQL}) m
+                JOIN sections d ON d.rowid = m.section_rowid
+                {doc_where}
+            )
+            SELECT 'doc_id' AS facet, doc_id AS value, COUNT(*) AS n FROM h GROUP BY doc_id
+            UNION ALL
+            SELECT 'ai_hint', j.value, COUNT(DISTINCT h.section_rowid)
+            FROM h, json_each(h.ai_hints) j GROUP BY j.value
+            ORDER BY facet, n DESC, value
+            """,
+            params,
+        ).fetchall()
+    facets = {"sections": 0, "doc_id": {}, "ai_hint": {}}
+    for facet, value, n in rows:
+        facets[facet][value] = n
+    facets["sections"] = sum(facets["doc_id"].values())
+    return facets
+
+
+def _expand_kinds(expand):
+    """section_edges kinds for an --expand value ("parent,siblings,links" or a list)."""
+    names = expand.split(",") if isinstance(expand, str) else list(expand)
+    names = [n.strip() for n in names if n.strip()]
+    unknown = [n for n in names if n not in EXPAND_KINDS]
+    if unknown:
+        raise ValueError(f"Unknown --expand kinds: {', '.join(unknown)} (use {', '.join(EXPAND_KINDS)})")
+    return [EXPAND_KINDS[n] for n in names]
+
+
+def _neighborhood_sql(select, seeds, kinds, hops):
+    """Sections within `hops` edges of the seed sections, nearest first, each once, in one statement."""
+    near = f"""
+        SELECT {select}, s.token_count AS _tokens, s.chunk_no AS _chunk,
+            b.pos AS _pos, b.hop AS _hop, b.via AS _via
+        FROM best b JOIN sections_full s ON s.{{key}} = b.node WHERE b.rn = 1
+    """
+    query = f"""
+        WITH RECURSIVE
+        seed(pos, node) AS (SELECT key, value FROM json_each(?)),
+        hood(node, pos, hop, via) AS (
+            SELECT node, pos, 0, NULL FROM seed
+            UNION
+            SELECT e.dst, h.pos, h.hop + 1, e.kind
+            FROM hood h JOIN section_edges e ON e.src = h.node
+            WHERE h.hop < ? AND e.kind IN (SELECT value FROM json_each(?))
+        ),
+        near(node, pos, hop, via) AS (
+            SELECT COALESCE(d.dst, h.node), h.pos, h.hop, h.via
+            FROM hood h LEFT JOIN section_edges d ON d.src = h.node AND d.kind = 'head'
+            WHERE h.hop > 0
+        ),
+        best AS (
+            SELECT node, pos, hop, via, ROW_NUMBER() OVER (PARTITION BY node ORDER BY hop, pos, via) AS rn
+            FROM near WHERE node NOT IN (SELECT node FROM seed)
+        )
+        {near.format(key="id")}
+        UNION ALL
+        {near.format(key="parent_id")}
+        ORDER BY _hop, _pos, _chunk
+    """
+    return query, [json.dumps(seeds), hops, json.dumps(kinds)]
+
+
+def _expand(conn, results, expand, hops=DEFAULT_EXPAND_HOPS, max_tokens=DEFAULT_EXPAND_TOKENS, columns=None):
+    """Follow each hit with its neighbourhood (headings, siblings, link targets) within `max_tokens`."""
+    kinds = _expand_kinds(expand)
+    if not results or not kinds or hops < 1:
+        return results
+    seeds = [r.get("parent_id") or r["id"] for r in results]
+    query, params = _neighborhood_sql(_select_list(columns), seeds, kinds, hops)
+    around = [[] for _ in results]
+    remaining = max_tokens
+    for r in conn.execute(query, params):
+        row = dict(r)
+        cost = _hit_cost(row.pop("_tokens"), None, columns)
+        if cost > remaining:
+            continue
+        pos = row.pop("_pos")
+        row.pop("_chunk")
+        row.update(via=row.pop("_via"), hop=row.pop("_hop"), of=results[pos]["id"], tokens=cost)
+        around[pos].append(row)
+        remaining -= cost
+        if remaining <= 0:
+            break
+    expanded = []
+    for hit, neighbours in zip(results, around):
+        expanded.append(hit)
+        expanded.extend(neighbours)
+    return expanded
+
+
+def _ranked_sql(ranked, limit, select, snippet=None):
+    """Rows for already-ranked (rowid, score) pairs, in that order; rank = -score."""
     params = []
+    if snippet:
+        select += ", substr(s.content, 1, ?) AS snippet"
+        params.append(snippet * 2)
+    query = f"""
+        SELECT {select}, -json_extract(j.value, '$[1]') AS rank
+        FROM json_each(?) j
+        JOIN sections_full s ON s.rowid = json_extract(j.value, '$[0]')
+        ORDER BY CAST(j.key AS INTEGER)
+    """
+    params.append(json.dumps(ranked))
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
+def _cosines(query_vec, blobs):
+    """Dot products of a normalized query vector with stored float32 vectors."""
+    if not blobs:
+        return []
+    if np is not None:
+        matrix = np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+        return (matrix @ np.frombuffer(query_vec.tobytes(), dtype=np.float32)).tolist()
+    nonzero = [(i, q) for i, q in enumerate(query_vec) if q]
+    scores = []
+    for blob in blobs:
+        v = array("f")
+        v.frombytes(blob)
+        scores.append(sum(v[i] * q for i, q in nonzero))
+    return scores
+
+
+def _any_terms_query(query_text):
+    """OR of the words of a plain query, so the BM25 pool isn't limited to all-terms hits."""
+    if not FUZZY_PLAIN_QUERY_RE.match(query_text or ""):
+        return query_text
+    words = [w.lower() for w in query_text.split() if w not in FTS_OPERATORS]
+    return " OR ".join(_fts_phrase(w) for w in dict.fromkeys(words)) or query_text
+
+
+def _hybrid_ranking(conn, query_text, doc_filter, alpha, pool, fusion, brute_force):
+    row = conn.execute("SELECT value FROM meta WHERE key='vector_dim'").fetchone()
+    dim = int(row[0]) if row else 0
+    if not dim:
+        raise ValueError("No section vectors; enable them with shards_db.py --vectors DIM")
+    query_vec = section_vector(query_text, dim)
+    query, params = _bm25_sql(_any_terms_query(query_text), doc_filter, pool, "s.rowid AS _rowid")
+    lexical = {r["_rowid"]: -r["rank"] for r in conn.execute(query, params)}
+    semantic = {}
+    if brute_force:
+        q = "SELECT v.section_rowid, v.vec FROM section_vectors v"
+        params = ()
+        if doc_filter:
+            q += " JOIN sections s ON s.rowid = v.section_rowid WHERE s.doc_id = ?"
+            params = (doc_filter,)
+        rows = conn.execute(q, params).fetchall()
+        scores = _cosines(query_vec, [r[1] for r in rows])
+        semantic = dict(sorted(zip((r[0] for r in rows), scores), key=lambda x: -x[1])[:pool])
+    missing = [rowid for rowid in lexical if rowid not in semantic]
+    for i in range(0, len(missing), 500):
+        chunk = missing[i : i + 500]
+        ph = ",".join(["?"] * len(chunk))
+        rows = conn.execute(
+            f"SELECT section_rowid, vec FROM section_vectors WHERE section_rowid IN ({ph})", chunk
+        ).fetchall()
+        semantic.update(zip((r[0] for r in rows), _cosines(query_vec, [r[1] for r in rows])))
+    candidates = lexical.keys() | semantic.keys()
+    if fusion == "rrf":
+        lex_pos = {rowid: i for i, rowid in enumerate(sorted(lexical, key=lambda r: -lexical[r]))}
+        sem_pos = {rowid: i for i, rowid in enumerate(sorted(semantic, key=lambda r: -semantic[r]))}
+        fused = {
+            rowid: alpha / (RRF_K + lex_pos.get(rowid, len(lex_pos)) + 1)
+            + (1 - alpha) / (RRF_K + sem_pos.get(rowid, len(sem_pos)) + 1)
+            for rowid in candidates
+        }
+    elif fusion == "linear":
+        top = max(lexical.values(), default=0.0) or 1.0
+        fused = {
+            rowid: alpha * lexical.get(rowid, 0.0) / top + (1 - alpha) * semantic.get(rowid, 0.0)
+            for rowid in candidates
+        }
+    else:
+        raise ValueError(f"fusion must be 'linear' or 'rrf', got {fusion!r}")
+    return sorted(fused.items(), key=lambda x: (-x[1], x[0]))
+
+
+def search_db_hybrid(
+    db_path,
+    query_text,
+    doc_filter=None,
+    limit=5,
+    columns=None,
+    snippet=None,
+    max_tokens=None,
+    rollup=False,
+    alpha=DEFAULT_HYBRID_ALPHA,
+    pool=DEFAULT_HYBRID_POOL,
+    fusion="linear",
+    brute_force=False,
+):
+    """BM25 candidates re-ranked by cosine similarity of hashed n-gram vectors (shards_db.py --vectors)."""
+    _check_rollup(rollup, max_tokens)
+    with _reader(db_path) as conn:
+        ranked = _hybrid_ranking(conn, query_text, doc_filter, alpha, pool, fusion, brute_force)
+        if rollup:
+            query, params = _ranked_sql(ranked, None, _select_list(columns) + ROLLUP_SELECT, snippet)
+            results = _roll_up(conn, _first_per_group(conn.execute(query, params), limit))
+            return _clip_snippets(results, snippet)
+        if max_tokens is not None:
+            return _pack_budget(
+                conn,
+                lambda select, snip: _ranked_sql(ranked, None, select, snip),
+                columns,
+                limit,
+                max_tokens,
+                snippet,
+            )
+        query, params = _ranked_sql(ranked, limit, _select_list(columns), snippet)
+        rows = conn.execute(query, params).fetchall()
+    return _clip_snippets([dict(r) for r in rows], snippet)
+
+
+_REPEAT_OPS = {
+    _sre_parse.MAX_REPEAT,
+    _sre_parse.MIN_REPEAT,
+    getattr(_sre_parse, "POSSESSIVE_REPEAT", _sre_parse.MAX_REPEAT),
+}
+
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _required_literals(items):
+    """FTS5 trigram expression that every match of the parsed regex `items` must satisfy, or None."""
+    parts = []
+    run = []
+
+    def flush():
+        # The trigram tokenizer cannot match substrings shorter than 3 chars.
+        if len(run) >= 3:
+            parts.append(_fts_phrase("".join(run)))
+        run.clear()
+
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is _sre_parse.AT:
+            continue  # zero-width anchors do not split a literal run
+        flush()
+        sub = None
+        if op is _sre_parse.SUBPATTERN:
+            sub = _required_literals(av[-1])
+        elif op in _REPEAT_OPS:
+            low, _, body = av
+            if low >= 1:
+                sub = _required_literals(body)
+        elif op is getattr(_sre_parse, "ATOMIC_GROUP", None):
+            sub = _required_literals(av)
+        elif op is _sre_parse.BRANCH:
+            alts = [_required_literals(branch) for branch in av[1]]
+            if all(alts):
+                sub = "(" + " OR ".join(alts) + ")"
+        if sub:
+            parts.append(sub)
+    flush()
+    return " AND ".join(parts) if parts else None
+
+
+def _regex_trigram_query(pattern, flags=0):
+    try:
+        return _required_literals(_sre_parse.parse(pattern, flags))
+    except (re.error, RecursionError):
+        return None
+
+
+def search_db_regex(
+    db_path,
+    pattern,
+    doc_filter=None,
+    limit=5,
+    flags=0,
+    columns=None,
+    snippet=None,
+    max_tokens=None,
+    rollup=False,
+    after=None,
+):
+    """Regex search across section content in DB, narrowed by the blobs_trigram index."""
+    _check_rollup(rollup, max_tokens)
+    after = _parse_cursor(after)
+    _check_after(after, rollup, max_tokens)
+    regex = re.compile(pattern, flags)
+    match_expr = _regex_trigram_query(pattern, flags)
+    select = _select_list(columns)
+    if columns is not None and "content" not in columns:
+        select += ", s.content AS _content"
+        content_key = "_content"
+    else:
+        content_key = "content"
+    if max_tokens is not None:
+        select += ", s.token_count AS _token_count"
+    if rollup:
+        select += ROLLUP_SELECT
+    elif max_tokens is None:
+        select += CURSOR_SELECT
+    select += ", s.blob_id AS _blob_id"
+    remaining = max_tokens
+    seen_groups = set()
+    # Sections sharing a blob share its match; misses are kept as None only.
+    blob_matches = {}
+    filters, filter_params = [], []
     if doc_filter:
-        query += " WHERE doc_id = ?"
-        params.append(doc_filter)
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
-    results = [dict(r) for r in rows if regex.search(r["content"] or "")]
-    return results[:limit]
+        filters.append("s.doc_id = ?")
+        filter_params.append(doc_filter)
+    if after is not None:
+        filters.append("s.rowid > ?")
+        filter_params.append(after[1])
+    scan_query = f"SELECT {select} FROM sections_full s"
+    if filters:
+        scan_query += " WHERE " + " AND ".join(filters)
+    results = []
+    with _reader(db_path) as conn:
+        cursor = None
+        if match_expr:
+            query = f"""
+                SELECT {select}
+                FROM sections_full s
+                WHERE s.blob_id IN (SELECT rowid FROM blobs_trigram WHERE blobs_trigram MATCH ?)
+            """
+            for condition in filters:
+                query += f" AND {condition}"
+            query += " ORDER BY s.rowid"
+            params = [match_expr] + filter_params
+            try:
+                cursor = conn.execute(query, params)
+            except sqlite3.OperationalError as exc:
+                if "blobs_trigram" not in str(exc):
+                    raise
+                _warn("blobs_trigram index missing; run shards_db.py --init to upgrade")
+        if cursor is None:
+            cursor = conn.execute(scan_query, filter_params)
+        for r in cursor:
+            if rollup and r["_group"] in seen_groups:
+                continue
+            content = r[content_key] or ""
+            blob_id = r["_blob_id"]
+            if blob_id in blob_matches:
+                m = blob_matches[blob_id]
+            else:
+                m = blob_matches[blob_id] = regex.search(content)
+            if not m:
+                continue
+            if rollup:
+                seen_groups.add(r["_group"])
+            result = dict(r)
+            result.pop("_content", None)
+            result.pop("_blob_id", None)
+            token_count = result.pop("_token_count", None)
+            if snippet:
+                result["snippet"] = _regex_excerpt(content, m, snippet)
+            if max_tokens is not None:
+                cost = _hit_cost(token_count, result.get("snippet"), columns)
+                if cost > remaining:
+                    continue
+                result["tokens"] = cost
+                remaining -= cost
+            results.append(result)
+            if (limit is not None and len(results) >= limit) or (
+                remaining is not None and remaining <= 0
+            ):
+                break
+        cursor.close()
+        if rollup:
+            _roll_up(conn, results)
+    return results
+
+
+def _data_version(conn):
+    """Cache validity token: DB creation time plus the generation shards_db.py bumps on writes."""
+    rows = dict(
+        conn.execute(
+            "SELECT key, value FROM meta WHERE key IN ('created_at', 'generation')"
+        ).fetchall()
+    )
+    return f"{rows.get('created_at', '')}|{rows.get('generation', '0')}"
+
+
+def _cache_key(request):
+    return json.dumps(
+        {k: request[k] for k in CACHE_KEY_FIELDS if request.get(k) not in (None, False)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+
+
+class QueryCache:
+    """In-process LRU of serialized results, capped by entry count and bytes."""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self.hits = self.misses = self.evictions = 0
+
+    def _sync(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, key, version):
+        self._sync(version)
+        payload = self._entries.get(key)
+        if payload is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return json.loads(payload)
+
+    def put(self, key, version, results):
+        self._sync(version)
+        payload = json.dumps(results, ensure_ascii=False)
+        if len(payload) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = payload
+        self._bytes += len(payload)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+
+class FileQueryCache:
+    """Same contract as QueryCache, persisted in a side SQLite file so separate CLI calls share it."""
+
+    def __init__(self, path, max_entries=DEFAULT_CACHE_ENTRIES, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # A Federation calls each source's cache from its pool threads, one at a time.
+        self._conn = sqlite3.connect(
+            path, timeout=DEFAULT_BUSY_TIMEOUT_S, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+CREATE TABLE IF NOT EXISTS entries(key TEXT PRIMARY KEY, version TEXT NOT NULL, payload TEXT NOT NULL, bytes INTEGER NOT NULL, last_used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used);
+CREATE TABLE IF NOT EXISTS counters(name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+        )
+
+    def _count(self, name, n=1):
+        self._conn.execute(
+            "INSERT INTO counters(name, value) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    def get(self, key, version):
+        with self._conn:
+            row = self._conn.execute(
+                "SELECT payload FROM entries WHERE key=? AND version=?", (key, version)
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_used=? WHERE key=?", (time.time(), key)
+            )
+            self._count("hits")
+        return json.loads(row[0])
+
+    def put(self, key, version, results):
+        payload = json.dumps(results, ensure_ascii=False)
+        if len(payload) > self.max_bytes:
+            return
+        with self._conn:
+            self._conn.execute("DELETE FROM entries WHERE version != ?", (version,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries(key, version, payload, bytes, last_used) VALUES(?, ?, ?, ?, ?)",
+                (key, version, payload, len(payload), time.time()),
+            )
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries"
+            ).fetchone()
+            evicted = 0
+            for old_key, size in self._conn.execute(
+                "SELECT key, bytes FROM entries ORDER BY last_used"
+            ).fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM entries WHERE key=?", (old_key,))
+                count -= 1
+                total -= size
+                evicted += 1
+            if evicted:
+                self._count("evictions", evicted)
+
+    def stats(self):
+        counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries"
+        ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": count,
+            "bytes": total,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def _request_limits(request):
+    """(limit, max_tokens) for a request: top defaults to 5, or unlimited under a budget."""
+    max_tokens = request.get("max_tokens")
+    max_tokens = int(max_tokens) if max_tokens is not None else None
+    top = request.get("top")
+    if top is None:
+        limit = None if max_tokens is not None else 5
+    else:
+        limit = int(top)
+    return limit, max_tokens
+
+
+def run_request(db, request, cache=None):
+    """Run one search described by a dict with the CLI's option names (see SKILL.md for the keys)."""
+    if isinstance(db, Federation):
+        if request.get("expand"):
+            raise ValueError("expand is not supported across several indexes")
+        if request.get("by_doc"):
+            raise ValueError("by_doc is not supported across several indexes")
+        return db.run(request)
+    if cache is not None:
+        with _reader(db) as conn:
+            version = _data_version(conn)
+        key = _cache_key(request)
+        results = cache.get(key, version)
+        if results is None:
+            results = run_request(db, request)
+            cache.put(key, version, results)
+        return results
+    return list(_dispatch(db, request))
+
+
+def _dispatch(db, request, stream=False):
+    """A request's hits; with `stream` (db an open connection), plain keyword/BM25 hits come lazily off the cursor."""
+    limit, max_tokens = _request_limits(request)
+    doc_filter = request.get("doc")
+    snippet = int(request.get("snippet") or 0) or None
+    columns = _projection(bool(request.get("full")))
+    if request.get("by_doc"):
+        if not request.get("query") or request.get("keyword") or request.get("regex"):
+            raise ValueError("by_doc needs a query")
+        if any(request.get(k) for k in ("hybrid", "rollup", "after", "expand")) or max_tokens is not None:
+            raise ValueError("by_doc cannot be combined with hybrid, rollup, after, max_tokens or expand")
+        return search_db_docs(
+            db,
+            request["query"],
+            doc_filter=doc_filter,
+            limit=limit,
+            per_doc=int(request.get("per_doc") or DEFAULT_PER_DOC),
+            columns=columns,
+            snippet=snippet,
+            fuzzy=bool(request.get("fuzzy")),
+        )
+    if request.get("keyword"):
+        results = search_db_keyword(
+            db,
+            request["keyword"],
+            doc_filter=doc_filter,
+            limit=limit,
+            match=request.get("keyword_match", "all"),
+            columns=columns,
+            snippet=snippet,
+            max_tokens=max_tokens,
+            rollup=bool(request.get("rollup")),
+            after=request.get("after"),
+            stream=stream,
+        )
+    elif request.get("regex"):
+        results = search_db_regex(
+            db,
+            request["regex"],
+            doc_filter=doc_filter,
+            limit=limit,
+            flags=re.IGNORECASE,
+            columns=columns,
+            snippet=snippet,
+            max_tokens=max_tokens,
+            rollup=bool(request.get("rollup")),
+            after=request.get("after"),
+        )
+    elif request.get("query") and request.get("hybrid"):
+        if request.get("after"):
+            raise ValueError("after is not supported with hybrid ranking")
+        results = search_db_hybrid(
+            db,
+            request["query"],
+            doc_filter=doc_filter,
+            limit=limit,
+            columns=columns,
+            snippet=snippet,
+            max_tokens=max_tokens,
+            rollup=bool(request.get("rollup")),
+            alpha=float(request.get("alpha", DEFAULT_HYBRID_ALPHA)),
+            pool=int(request.get("pool") or DEFAULT_HYBRID_POOL),
+            fusion=request.get("fusion") or "linear",
+            brute_force=bool(request.get("brute_force")),
+        )
+    elif request.get("query"):
+        results = search_db_bm25(
+            db,
+            request["query"],
+            doc_filter=doc_filter,
+            limit=limit,
+            columns=columns,
+            snippet=snippet,
+            max_tokens=max_tokens,
+            rollup=bool(request.get("rollup")),
+            fuzzy=bool(request.get("fuzzy")),
+            after=request.get("after"),
+            stream=stream,
+        )
+    else:
+        raise ValueError("Provide keyword, regex, or query.")
+    if limit is not None:
+        results = islice(results, limit)
+    if request.get("expand"):
+        with _reader(db) as conn:
+            results = _expand(
+                conn,
+                list(results),
+                request["expand"],
+                int(request.get("hops") or DEFAULT_EXPAND_HOPS),
+                int(request.get("expand_tokens") or DEFAULT_EXPAND_TOKENS),
+                columns,
+            )
+    return results
+
+
+def run_facets(db, request):
+    """search_facets() for a run_request-style dict (query, doc, fuzzy)."""
+    if isinstance(db, Federation):
+        raise ValueError("facets are not supported across several indexes")
+    if not request.get("query"):
+        raise ValueError("facets need a query")
+    return search_facets(db, request["query"], request.get("doc"), bool(request.get("fuzzy")))
+
+
+def iter_request(conn, request, cache=None):
+    """Yield run_request()'s hits one at a time, streaming plain keyword/BM25 pages off the cursor."""
+    if cache is not None or not isinstance(conn, sqlite3.Connection):
+        yield from run_request(conn, request, cache)
+    else:
+        yield from _dispatch(conn, request, stream=True)
+
+
+def _map_file(path):
+    """Read-only mmap of `path`, or None for an empty or unreadable file."""
+    try:
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+def _unix_newlines(data):
+    """File bytes with CRLF and CR line ends read as LF, as ingest indexed them."""
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return data
+
+
+def _db_file(conn):
+    return conn.execute("PRAGMA database_list").fetchone()["file"]
+
+
+def read_sections(db, ids, reingest=False):
+    """Section text served from each doc's rewritten file by the byte_range recorded at ingest."""
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+    ph = ",".join(["?"] * len(ids))
+    with _reader(db) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT s.id, s.parent_id, s.title, s.doc_id, s.content_hash, s.byte_range,
+                m.rewritten_path, m.version, m.size, m.mtime_ns, m.file_hash
+            FROM sections s LEFT JOIN doc_manifest m ON m.doc_id = s.doc_id
+            WHERE s.id IN ({ph}) OR s.parent_id IN ({ph})
+            ORDER BY s.doc_id, s.chunk_no
+            """,
+            ids + ids,
+        ).fetchall()
+        fresh = {}
+        for r in rows:
+            if r["doc_id"] not in fresh:
+                fresh[r["doc_id"]] = r["rewritten_path"] is not None and shards_db.manifest_matches(r)
+        drifted = {r["doc_id"]: r["rewritten_path"] for r in rows if not fresh[r["doc_id"]]}
+        if reingest and any(drifted.values()):
+            db_file = _db_file(conn)
+            for path in filter(None, drifted.values()):
+                with contextlib.suppress(FileNotFoundError):
+                    shards_db.ingest_locked(db_file, os.path.dirname(path))
+            return read_sections(db, ids)
+
+        maps = {}
+        results = []
+        try:
+            for section_id in ids:
+                parts = [r for r in rows if r["id"] == section_id]
+                parts = parts or [r for r in rows if r["parent_id"] == section_id]
+                if not parts:
+                    continue
+                head = parts[0]
+                entry = {
+                    "id": section_id,
+                    "title": head["title"],
+                    "doc_id": head["doc_id"],
+                    "stale": not fresh[head["doc_id"]],
+                }
+                spans = [json.loads(p["byte_range"] or "[]") for p in parts]
+                mm = None
+                if fresh[head["doc_id"]] and all(spans):
+                    path = head["rewritten_path"]
+                    if path not in maps:
+                        maps[path] = _map_file(path)
+                    mm = maps[path]
+                if mm is not None and all(
+                    hashlib.sha256(_unix_newlines(mm[a:b])).hexdigest() == p["content_hash"]
+                    for p, (a, b) in zip(parts, spans)
+                ):
+                    entry["byte_range"] = [spans[0][0], spans[-1][1]]
+                    entry["content"] = _unix_newlines(mm[spans[0][0] : spans[-1][1]]).decode("utf-8")
+                    entry["served_from"] = "file"
+                else:
+                    # No usable offsets, or the bytes changed under the manifest.
+                    entry["stale"] = entry["stale"] or mm is not None
+                    marks = ",".join(["?"] * len(parts))
+                    by_id = dict(
+                        conn.execute(
+                            f"SELECT id, content FROM sections_full WHERE id IN ({marks})",
+                            [p["id"] for p in parts],
+                        ).fetchall()
+                    )
+                    entry["content"] = "\n\n".join(by_id.get(p["id"]) or "" for p in parts)
+                    entry["served_from"] = "index"
+                results.append(entry)
+        finally:
+            for mm in maps.values():
+                if mm is not None:
+                    mm.close()
+    return results
+
+
+def _source_name(db_path, taken):
+    """Short label for a DB: the repo dir for <repo>/docs/MaraudersMap/shards.db, else its dir."""
+    parts = os.path.normpath(os.path.abspath(db_path)).split(os.sep)
+    if parts[-3:-1] == ["docs", "MaraudersMap"] and len(parts) > 3:
+        name = parts[-4]
+    else:
+        name = parts[-2] or parts[-1]
+    base, n = name, 2
+    while name in taken:
+        name = f"{base}#{n}"
+        n += 1
+    return name
+
+
+def load_registry(path):
+    """[(name, db_path)] from a JSON registry: {"name": "path", ...} or ["path", ...]."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    if isinstance(data, dict):
+        entries = list(data.items())
+    elif isinstance(data, list):
+        entries = [(None, p) for p in data]
+    else:
+        raise ValueError(f"{path}: registry must be a JSON object or list")
+    sources = []
+    for name, db_path in entries:
+        if not isinstance(db_path, str):
+            raise ValueError(f"{path}: DB path must be a string, got {db_path!r}")
+        db_path = os.path.join(root, db_path)
+        sources.append((name or _source_name(db_path, {n for n, _ in sources}), db_path))
+    return sources
+
+
+def _merged_rank(r, pos, scored):
+    """A federated hit's rank for the merge, lower is better."""
+    # Scored hits (BM25, hybrid) keep their own rank: every source ranks with
+    # the same weights, so a source with much stronger matches fills the top
+    # instead of taking turns with weaker ones, as per-source normalization
+    # (best = 1 everywhere) would make it. Unranked hits (keyword, regex) only
+    # have their position, so they get RRF over per-source ranks, which
+    # interleaves the sources.
+    return r["rank"] if scored else -1.0 / (RRF_K + pos + 1)
+
+
+class Federation:
+    """Several shards.db indexes searched as one."""
+
+    def __init__(self, sources, cache_factory=None):
+        self.sources = OrderedDict()
+        self.caches = {}
+        try:
+            for name, db_path in sources:
+                if name in self.sources:
+                    raise ValueError(f"duplicate source name {name!r}")
+                if not os.path.exists(db_path):
+                    raise ValueError(f"{name}: DB not found: {db_path}")
+                conn = _connect_ro(db_path, check_same_thread=False)
+                self.sources[name] = conn
+                _check_db_schema(conn)
+                if cache_factory is not None:
+                    self.caches[name] = cache_factory(db_path)
+        except BaseException:
+            self.close()
+            raise
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(self.sources)))
+
+    def run(self, request):
+        """Merged hits for `request` (a run_request dict) across every source."""
+        if request.get("after"):
+            raise ValueError("after is not supported across several indexes")
+        limit, max_tokens = _request_limits(request)
+        futures = [
+            (name, self._pool.submit(run_request, conn, request, self.caches.get(name)))
+            for name, conn in self.sources.items()
+        ]
+        per_source = [(name, future.result()) for name, future in futures]
+        scored = all(r.get("rank") is not None for _, results in per_source for r in results)
+        merged = []
+        for order, (name, results) in enumerate(per_source):
+            for i, r in enumerate(results):
+                rank = _merged_rank(r, i, scored)
+                hit = dict(r, source=name, rank=rank if scored else round(rank, 6))
+                hit.pop("_rowid", None)
+                merged.append((rank, i, order, hit))
+        merged.sort(key=lambda m: m[:3])
+        hits = [m[3] for m in merged]
+        if max_tokens is not None:
+            # Every source packed its own budget; re-pack the union into one.
+            picked, remaining = [], max_tokens
+            for hit in hits:
+                if hit["tokens"] <= remaining:
+                    picked.append(hit)
+                    remaining -= hit["tokens"]
+                    if remaining <= 0:
+                        break
+            hits = picked
+        return hits if limit is None else hits[:limit]
+
+    def cache_stats(self):
+        if not self.caches:
+            return None
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def close(self):
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for cache in self.caches.values():
+            if isinstance(cache, FileQueryCache):
+                cache.close()
+        for conn in self.sources.values():
+            conn.close()
+
+
+def _json_entry(r, show_content=False):
+    entry = {"id": r.get("id"), "title": r.get("title")}
+    if "source" in r:
+        entry["source"] = r["source"]
+    if show_content:
+        entry["content"] = r.get("content", "")
+    if r.get("parent_id"):
+        entry["parent_id"] = r["parent_id"]
+    if r.get("best_chunk"):
+        entry["best_chunk"] = r["best_chunk"]
+    if "snippet" in r:
+        entry["snippet"] = r["snippet"]
+    if "rank" in r:
+        entry["score"] = r["rank"]
+    if "tokens" in r:
+        entry["tokens"] = r["tokens"]
+    if "_rowid" in r:
+        entry["cursor"] = _cursor(r)
+    if "via" in r:
+        entry.update(via=r["via"], hop=r["hop"], of=r["of"])
+    if "doc_rank" in r:
+        entry.update(
+            doc_id=r["doc_id"],
+            doc_rank=r["doc_rank"],
+            doc_hits=r["doc_hits"],
+            doc_best=r["doc_best"],
+            doc_total=r["doc_total"],
+        )
+    return entry
+
+
+def _serve_lines(conn, lines, out, cache=None):
+    """Answer one JSON request per input line with one JSON response line, flushing each."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        request = None
+        try:
+            request = json.loads(line)
+            if request.get("op") == "cache_stats":
+                if isinstance(conn, Federation):
+                    response = {"cache": conn.cache_stats()}
+                else:
+                    response = {"cache": cache.stats() if cache is not None else None}
+                if "id" in request:
+                    response["id"] = request["id"]
+                out.write(json.dumps(response) + "\n")
+                out.flush()
+                continue
+            if request.get("op") == "sections":
+                if isinstance(conn, Federation):
+                    raise ValueError("sections needs a single --db")
+                response = {"sections": read_sections(conn, request.get("ids") or [], bool(request.get("reingest")))}
+                if "id" in request:
+                    response["id"] = request["id"]
+                out.write(json.dumps(response, ensure_ascii=False) + "\n")
+                out.flush()
+                continue
+            if request.get("facets"):
+                response = {"facets": run_facets(conn, request)}
+            else:
+                results = run_request(conn, request, cache)
+                response = {
+                    "results": [_json_entry(r, bool(request.get("full"))) for r in results]
+                }
+                if request.get("max_tokens") is not None:
+                    response["tokens_used"] = sum(r["tokens"] for r in results)
+        except (ValueError, TypeError, AttributeError, re.error, sqlite3.Error, OSError) as exc:
+            response = {"error": f"{type(exc).__name__}: {exc}"}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        out.write(json.dumps(response, ensure_ascii=False) + "\n")
+        out.flush()
+
+
+class _SocketWriter:
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def write(self, text):
+        self._wfile.write(text.encode("utf-8"))
+
+    def flush(self):
+        self._wfile.flush()
+
+
+def _serve_socket(conn, path, cache=None):
+    """Serve JSON-lines requests on a Unix socket, one client at a time on one warm connection."""
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            lines = (raw.decode("utf-8") for raw in self.rfile)
+            out = _SocketWriter(self.wfile)
+            _serve_lines(conn, lines, out, cache)
+
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        print(f"Serving {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
 
 
 def _print_text(results, show_content=False):
+    doc = None
     for r in results:
         section_id = r.get("id", "?")
         title = r.get("title", "")
-        print(f"[{section_id}] {title}")
+        source = f" ({r['source']})" if "source" in r else ""
+        indent = ""
+        if "doc_rank" in r:
+            # --by-doc: a header per doc, its best hits beneath it.
+            if r["doc_id"] != doc:
+                doc = r["doc_id"]
+                print(
+                    f"{doc} ({r['doc_hits']} hits, best {r['doc_best']:.3f}, "
+                    f"total {r['doc_total']:.3f})"
+                )
+            indent = "  "
+        if "via" in r:
+            print(f"  + [{section_id}] {title} ({r['via']} of {r['of']}, hop {r['hop']})")
+        else:
+            print(f"{indent}[{section_id}] {title}{source}")
         if show_content:
             content = r.get("content", "")
             preview = content[:200] + "..." if len(content) > 200 else content
-            print(f"  {preview}")
+            print(f"{indent}  {preview}")
+        if "snippet" in r:
+            print(f"{indent}  {r['snippet']}")
+
+
+def _print_facets(facets, fmt):
+    if fmt != "text":
+        print(json.dumps(facets, ensure_ascii=False, indent=2 if fmt == "json" else None))
+        return
+    print(f"Matches: {facets['sections']} sections in {len(facets['doc_id'])} docs")
+    for facet in ("doc_id", "ai_hint"):
+        if facets[facet]:
+            print(f"{facet}:")
+            for value, n in facets[facet].items():
+                print(f"  {value}  {n}")
+
+
+def _print_sections(sections, fmt):
+    if fmt == "json":
+        print(json.dumps(sections, ensure_ascii=False, indent=2))
+        return
+    for s in sections:
+        if fmt == "ndjson":
+            print(json.dumps(s, ensure_ascii=False))
+            continue
+        stale = ", stale" if s["stale"] else ""
+        print(f"[{s['id']}] {s['title']} ({s['served_from']}{stale})")
+        print(s["content"])
+        print()
+
+
+def _print_budget(used, max_tokens, hits):
+    print(f"Token budget: used {used} of {max_tokens} ({hits} hits)", file=sys.stderr)
 
 
 def _print_json(results, show_content=False):
-    import json
+    output = [_json_entry(r, show_content) for r in results]
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+
 
-    output = []
+def _print_ndjson(results, show_content=False, out=None):
+    """Write one compact JSON hit per line as `results` yields them; return (hits, tokens, last hit)."""
+    out = out or sys.stdout
+    hits = tokens = 0
+    last = None
     for r in results:
-        entry = {"id": r.get("id"), "title": r.get("title")}
-        if show_content:
-            entry["content"] = r.get("content", "")
-        if "rank" in r:
-            entry["score"] = r["rank"]
-        output.append(entry)
-    print(json.dumps(output, ensure_ascii=False, indent=2))
+        out.write(json.dumps(_json_entry(r, show_content), ensure_ascii=False) + "\n")
+        hits += 1
+        tokens += r.get("tokens", 0)
+        last = r
+    out.flush()
+    return hits, tokens, last
 
 
 def main():
     parser = argparse.ArgumentParser(description="Search SQLite/FTS5 shards index.")
-    parser.add_argument("--db", required=True, help="Path to SQLite DB (read-only).")
-    parser.add_argument("--keyword", help="Exact keyword from shards index.")
+    parser.add_argument(
+        "--db",
+        action="append",
+        help="Path to SQLite DB (read-only). Repeat to search several indexes as one.",
+    )
+    parser.add_argument(
+        "--registry",
+        metavar="FILE",
+        help='JSON file naming the indexes to search: {"name": "path/to/shards.db", ...} '
+        "or a list of paths. Combines with --db.",
+    )
+    parser.add_argument(
+        "--keyword",
+        action="append",
+        help="Exact keyword from shards index (repeat for several keywords).",
+    )
+    parser.add_argument(
+        "--keyword-match",
+        choices=["all", "any"],
+        default="all",
+        help="With several --keyword values, require all (AND) or any (OR).",
+    )
     parser.add_argument(
         "--regex", help="Regex pattern to search within section content."
     )
     parser.add_argument("--query", help="Free-text query for BM25 ranking.")
+    parser.add_argument(
+        "--fuzzy",
+        action="store_true",
+        help="With --query, rewrite terms the index lacks to prefix/near-spelling matches.",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="With --query, re-rank BM25 candidates by vector similarity (needs shards_db.py --vectors).",
+    )
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=DEFAULT_HYBRID_ALPHA,
+        help="--hybrid weight of BM25 vs vector similarity (1 = BM25 only).",
+    )
+    parser.add_argument(
+        "--pool", type=int, default=DEFAULT_HYBRID_POOL, help="--hybrid candidates taken from each ranker."
+    )
+    parser.add_argument(
+        "--fusion",
+        choices=["linear", "rrf"],
+        default="linear",
+        help="--hybrid score fusion: weighted scores or reciprocal rank fusion.",
+    )
+    parser.add_argument(
+        "--brute-force",
+        action="store_true",
+        help="--hybrid also scans every vector, catching sections that share no query word.",
+    )
+    parser.add_argument(
+        "--section",
+        action="append",
+        metavar="ID",
+        help="Print this section's text read from the rewritten file by byte offset "
+        "(repeat for several; a chunked section's parent id gives the whole section).",
+    )
+    parser.add_argument(
+        "--reingest",
+        action="store_true",
+        help="With --section, re-ingest docs whose rewritten file changed since the last "
+        "ingest instead of serving their indexed text.",
+    )
     parser.add_argument("--doc", help="Filter results by doc id (DB backend only).")
-    parser.add_argument("--top", type=int, default=5, help="Max results to print.")
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Max results to print (default 5; unlimited with --max-tokens).",
+    )
+    parser.add_argument(
+        "--after",
+        metavar="RANK,ROWID",
+        help="Page cursor: return hits after this one (the 'cursor' of the last hit shown; pass "
+        "it as --after=RANK,ROWID since ranks are negative; "
+        "keyword/regex cursors are just ROWID).",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        metavar="N",
+        help="Pack the highest-ranked hits into a budget of N tokens.",
+    )
+    parser.add_argument(
+        "--expand",
+        metavar="KINDS",
+        help="Follow each hit with its neighbourhood: any of parent,siblings,links "
+        "(enclosing headings, neighbouring sections, markdown link targets).",
+    )
+    parser.add_argument(
+        "--hops",
+        type=int,
+        default=DEFAULT_EXPAND_HOPS,
+        help="--expand edges to follow from each hit.",
+    )
+    parser.add_argument(
+        "--expand-tokens",
+        type=int,
+        default=DEFAULT_EXPAND_TOKENS,
+        metavar="N",
+        help="--expand adds nearest neighbours first while they fit in N tokens.",
+    )
+    parser.add_argument(
+        "--by-doc",
+        action="store_true",
+        help="With --query, rank docs instead of sections: --top docs, each with its hit count, "
+        "best and summed score, and its best --per-doc sections.",
+    )
+    parser.add_argument(
+        "--per-doc",
+        type=int,
+        default=DEFAULT_PER_DOC,
+        metavar="K",
+        help="--by-doc sections shown per doc.",
+    )
+    parser.add_argument(
+        "--facets",
+        action="store_true",
+        help="With --query, print only how many matching sections each doc and AI hint type has.",
+    )
     parser.add_argument(
         "--full", action="store_true", help="Include content in output."
     )
+    parser.add_argument(
+        "--snippet",
+        type=int,
+        metavar="CHARS",
+        help="Add a highlighted excerpt of at most CHARS chars per hit.",
+    )
+    parser.add_argument(
+        "--rollup",
+        action="store_true",
+        help="Report chunk hits once per parent section instead of per chunk.",
+    )
     parser.add_argument(
         "--format",
-        choices=["text", "json"],
+        choices=["text", "json", "ndjson"],
         default="text",
-        help="Output format.",
+        help="Output format. ndjson streams one hit per line as it is read.",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Run JSON-lines requests from FILE ('-' for stdin) and stream JSON-lines results.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep one warm connection and answer JSON-lines requests on stdin (or --socket).",
+    )
+    parser.add_argument(
+        "--socket", metavar="PATH", help="With --serve, listen on this Unix socket."
+    )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const="",
+        metavar="PATH",
+        help="Reuse results from a side cache file (default <db>.qcache) until the DB changes. "
+        "--batch/--serve always keep an in-memory cache.",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Disable result caching entirely."
+    )
+    parser.add_argument(
+        "--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES, help="Result cache entry cap."
+    )
+    parser.add_argument(
+        "--cache-bytes", type=int, default=DEFAULT_CACHE_BYTES, help="Result cache size cap in bytes."
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print result cache hit/miss counters to stderr.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print per-phase timings, row/byte and statement counts and EXPLAIN QUERY PLAN "
+        "output for a one-shot query as JSON on stderr.",
+    )
+    parser.add_argument(
+        "--profile", metavar="FILE", help="Write a cProfile dump of this run to FILE."
     )
     args = parser.parse_args()
+    with profiled(args.profile):
+        _main(args)
 
-    _check_db_schema(args.db)
 
-    if args.keyword:
-        results = search_db_keyword(
-            args.db, args.keyword, doc_filter=args.doc, limit=args.top
-        )
-    elif args.regex:
-        results = search_db_regex(
-            args.db,
-            args.regex,
-            doc_filter=args.doc,
-            limit=args.top,
-            flags=re.IGNORECASE,
-        )
-    elif args.query:
-        results = search_db_bm25(
-            args.db, args.query, doc_filter=args.doc, limit=args.top
-        )
+def _main(args):
+    sources = load_registry(args.registry) if args.registry else []
+    for db_path in args.db or []:
+        sources.append((_source_name(db_path, {n for n, _ in sources}), db_path))
+    if not sources:
+        raise SystemExit("Provide --db or --registry.")
+    federated = len(sources) > 1 or bool(args.registry)
+    if federated and args.cache:
+        raise SystemExit("--cache PATH needs a single --db; use --cache for per-index <db>.qcache files.")
+    if federated and args.stats:
+        raise SystemExit("--stats needs a single --db.")
+    if federated and args.expand:
+        raise SystemExit("--expand needs a single --db.")
+    if federated and (args.by_doc or args.facets):
+        raise SystemExit("--by-doc and --facets need a single --db.")
+
+    cache_factory = None
+    if args.no_cache:
+        pass
+    elif args.cache is not None:
+        def cache_factory(db_path):
+            return FileQueryCache(
+                args.cache or f"{db_path}.qcache", args.cache_entries, args.cache_bytes
+            )
+    elif args.batch or args.serve:
+        def cache_factory(db_path):
+            return QueryCache(args.cache_entries, args.cache_bytes)
+
+    stats = {"phases": {}, "counts": {}}
+    started = time.perf_counter()
+    cache = None
+    if federated:
+        conn = Federation(sources, cache_factory)
     else:
-        raise SystemExit("Provide --keyword, --regex, or --query.")
+        conn = _connect_ro(sources[0][1])
+        if cache_factory is not None:
+            cache = cache_factory(sources[0][1])
+    try:
+        if not federated:
+            _check_db_schema(conn)
+        stats["phases"]["connect"] = time.perf_counter() - started
+
+        if args.batch:
+            if args.batch == "-":
+                _serve_lines(conn, sys.stdin, sys.stdout, cache)
+            else:
+                with open(args.batch, "r", encoding="utf-8") as f:
+                    _serve_lines(conn, f, sys.stdout, cache)
+            return
+        if args.serve:
+            if args.socket:
+                if not hasattr(socket, "AF_UNIX"):
+                    raise SystemExit("--socket requires Unix domain socket support.")
+                _serve_socket(conn, args.socket, cache)
+            else:
+                _serve_lines(conn, sys.stdin, sys.stdout, cache)
+            return
+
+        if args.section:
+            if federated:
+                raise SystemExit("--section needs a single --db.")
+            sections = read_sections(conn, args.section, args.reingest)
+            for s in sections:
+                if s["stale"]:
+                    _warn(f"{s['id']}: rewritten file changed since ingest; served indexed text")
+            _print_sections(sections, args.format)
+            return
+        if not (args.keyword or args.regex or args.query):
+            raise SystemExit("Provide --keyword, --regex, --query, or --section.")
+        request = {
+            "keyword": args.keyword,
+            "keyword_match": args.keyword_match,
+            "regex": args.regex,
+            "query": args.query,
+            "doc": args.doc,
+            "top": args.top,
+            "full": args.full,
+            "snippet": args.snippet,
+            "max_tokens": args.max_tokens,
+            "rollup": args.rollup,
+            "hybrid": args.hybrid,
+            "alpha": args.alpha,
+            "pool": args.pool,
+            "fusion": args.fusion,
+            "brute_force": args.brute_force,
+            "after": args.after,
+            "expand": args.expand,
+            "hops": args.hops,
+            "expand_tokens": args.expand_tokens,
+            "by_doc": args.by_doc,
+            "per_doc": args.per_doc,
+        }
+        if args.fuzzy and args.query and federated:
+            # Each index expands typos against its own vocabulary.
+            request["fuzzy"] = True
+        elif args.fuzzy and args.query:
+            request["query"], expanded = _expand_query(conn, args.query)
+            for word, alternatives in expanded.items():
+                print(f"Fuzzy: {word} -> {' OR '.join(alternatives)}", file=sys.stderr)
+        if args.facets:
+            _print_facets(run_facets(conn, request), args.format)
+            return
+        t = time.perf_counter()
+        if args.stats:
+            with trace_statements(conn, selects=True) as trace:
+                results = run_request(conn, request, cache)
+            stats["phases"]["search"] = time.perf_counter() - t
+            stats.update(trace)
+            stats["query_plans"] = [
+                {"sql": sql, "plan": _explain(conn, sql)} for sql in stats.pop("selects")
+            ]
+        elif args.format == "ndjson":
+            # Stream while the connection is open; no hit outlives its line.
+            hits, used, _ = _print_ndjson(iter_request(conn, request, cache), args.full)
+            if args.max_tokens is not None:
+                _print_budget(used, args.max_tokens, hits)
+            return
+        else:
+            results = run_request(conn, request, cache)
+    finally:
+        if args.cache_stats and cache_factory is not None:
+            cache_stats = conn.cache_stats() if federated else cache.stats()
+            print(json.dumps({"cache": cache_stats}), file=sys.stderr)
+        conn.close()
+        if isinstance(cache, FileQueryCache):
+            cache.close()
 
-    results = results[: args.top]
+    if args.max_tokens is not None:
+        _print_budget(sum(r["tokens"] for r in results), args.max_tokens, len(results))
+    t = time.perf_counter()
     if args.format == "json":
         _print_json(results, show_content=args.full)
+    elif args.format == "ndjson":
+        _print_ndjson(results, show_content=args.full)
     else:
         _print_text(results, show_content=args.full)
+    limit = _request_limits(request)[0]
+    hits = [r for r in results if "via" not in r]
+    next_after = None
+    if hits and "_rowid" in hits[-1] and len(hits) == limit:
+        next_after = _cursor(hits[-1])
+    if next_after and not args.stats:
+        print(f"Next page: --after={next_after}", file=sys.stderr)
+    if args.stats:
+        # stderr stays one JSON document; the cursor goes inside it.
+        stats["next_after"] = next_after
+        stats["phases"]["render"] = time.perf_counter() - t
+        stats["phases"]["wall"] = time.perf_counter() - started
+        stats["phases"] = {k: round(v, 6) for k, v in stats["phases"].items()}
+        stats["counts"] = {
+            "hits": len(results),
+            "bytes_returned": sum(
+                len((r.get("content") or "").encode("utf-8"))
+                + len((r.get("snippet") or "").encode("utf-8"))
+                for r in results
+            ),
+        }
+        sys.stdout.flush()
+        print(json.dumps(stats), file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Concurrency stress check: many ingest writers and search readers on one map root."""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import redirect_stdout
+
+import shards_db
+import shards_search
+
+WORDS = "ingest shard section index query token budget render rewrite marauders map lookup cache sqlite".split()
+
+
+def _write_doc(map_root, doc_id, revision):
+    doc_root = os.path.join(map_root, doc_id)
+    os.makedirs(doc_root, exist_ok=True)
+    rng = random.Random(f"{doc_id}:{revision}")
+    lines = ["---", f"tags: [{doc_id}, stress]", "---", f"# {doc_id}", ""]
+    for i in range(rng.randint(3, 8)):
+        lines.append(f"## Part {i} {rng.choice(WORDS)}")
+        lines.append(" ".join(rng.choices(WORDS, k=40)))
+        lines.append(f"revision {revision}")
+        lines.append("")
+    path = os.path.join(doc_root, f"{doc_id}.rewritten_v1.md")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return doc_root
+
+
+def _writer(map_root, doc_id, rounds):
+    try:
+        for revision in range(1, rounds + 1):
+            doc_root = _write_doc(map_root, doc_id, revision)
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                rc = shards_db.main(["--map-root", map_root, "--ingest", doc_root])
+            if rc != 0:
+                return f"{doc_id}: ingest exited {rc}"
+        return None
+    except Exception:
+        return f"{doc_id}: {traceback.format_exc()}"
+
+
+def _reader(db_file, deadline):
+    queries = 0
+    try:
+        rng = random.Random(os.getpid())
+        while time.monotonic() < deadline:
+            shards_search.search_db_bm25(db_file, rng.choice(WORDS), limit=5)
+            shards_search.search_db_keyword(db_file, "stress", limit=5)
+            queries += 2
+        return queries, None
+    except Exception:
+        return queries, traceback.format_exc()
+
+
+def _verify(map_root):
+    conn = shards_db.connect(shards_db.db_path(map_root))
+    try:
+        stale = []
+        for doc_root in shards_db.discover_docs(map_root):
+            expected = {s["id"]: s["content_hash"] for s in shards_db.load_sections(doc_root)}
+            actual = {
+                r["id"]: r["content_hash"]
+                for r in conn.execute(
+                    "SELECT id, content_hash FROM sections WHERE doc_id=?",
+                    (os.path.basename(doc_root),),
+                )
+            }
+            if expected != actual:
+                stale.append(os.path.basename(doc_root))
+        return stale
+    finally:
+        conn.close()
+
+
+def run(map_root, writers, readers, rounds, read_seconds):
+    shards_db.main(["--map-root", map_root, "--init"])
+    db_file = shards_db.db_path(map_root)
+    started = time.monotonic()
+    with multiprocessing.Pool(writers + readers) as pool:
+        deadline = time.monotonic() + read_seconds
+        read_jobs = [pool.apply_async(_reader, (db_file, deadline)) for _ in range(readers)]
+        write_jobs = [
+            pool.apply_async(_writer, (map_root, f"doc{i:03d}", rounds))
+            for i in range(writers)
+        ]
+        errors = [e for e in (j.get() for j in write_jobs) if e]
+        queries = 0
+        for j in read_jobs:
+            n, err = j.get()
+            queries += n
+            if err:
+                errors.append(err)
+    elapsed = time.monotonic() - started
+    stale = _verify(map_root)
+    print(
+        f"writers={writers} readers={readers} rounds={rounds} ingests={writers * rounds} "
+        f"queries={queries} elapsed={elapsed:.2f}s errors={len(errors)} stale_docs={len(stale)}"
+    )
+    for err in errors:
+        print(err, file=sys.stderr)
+    for doc_id in stale:
+        print(f"Stale after stress run: {doc_id}", file=sys.stderr)
+    return 1 if errors or stale else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--map-root", help="Map root to use (default: a temp dir).")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=10, help="Ingests per writer.")
+    parser.add_argument("--read-seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+    if args.map_root:
+        return run(args.map_root, args.writers, args.readers, args.rounds, args.read_seconds)
+    with tempfile.TemporaryDirectory(prefix="mm-stress-") as map_root:
+        return run(map_root, args.writers, args.readers, args.rounds, args.read_seconds)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
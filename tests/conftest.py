@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import shards_db
+
+DOCS = {
+    "alpha": "---\ntags: [alphakey, setup]\n---\n# Alpha\n\n## Install\nRun the bootstrap script.\n\n## Usage\nCall the usage helpers.\n",
+    "beta": "# Beta\n\n## Notes\nSee the install notes before the bootstrap.\n",
+}
+
+
+def _write_doc(map_root, doc_id, text, version=1):
+    doc_root = os.path.join(map_root, doc_id)
+    os.makedirs(doc_root, exist_ok=True)
+    path = os.path.join(doc_root, f"{doc_id}.rewritten_v{version}.md")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return doc_root
+
+
+@pytest.fixture
+def write_doc():
+    return _write_doc
+
+
+@pytest.fixture
+def map_root(tmp_path):
+    root = str(tmp_path / "MaraudersMap")
+    for doc_id, text in DOCS.items():
+        _write_doc(root, doc_id, text)
+    return root
+
+
+@pytest.fixture(params=["none", "zlib"])
+def db_file(request, map_root):
+    """An ingested map, with plain and with compressed content storage."""
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    if request.param == "zlib":
+        assert shards_db.main(["--map-root", map_root, "--init", "--compress", "zlib"]) == 0
+    return shards_db.db_path(map_root)
@@ -0,0 +1,37 @@
+import os
+import sqlite3
+
+import shards_db
+
+
+def test_audit_without_db_is_an_error(tmp_path, capsys):
+    map_root = str(tmp_path / "MaraudersMap")
+    os.makedirs(map_root)
+    assert shards_db.main(["--map-root", map_root, "--audit"]) == 1
+    assert "no shards DB" in capsys.readouterr().err
+    assert os.listdir(map_root) == []
+
+
+def test_audit_leaves_db_untouched(map_root, write_doc, capsys):
+    db_file = shards_db.db_path(map_root)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+    before = os.stat(db_file).st_mtime_ns
+    assert shards_db.main(["--map-root", map_root, "--audit"]) == 0
+
+    write_doc(map_root, "beta", "# Beta\n\nchanged\n", version=2)
+    write_doc(map_root, "gamma", "# Gamma\n")
+    capsys.readouterr()
+    assert shards_db.main(["--map-root", map_root, "--audit"]) == 1
+    out = capsys.readouterr().out
+    assert "| beta | stale | v1 ingested, v2 on disk |" in out
+    assert "| gamma | missing | never ingested |" in out
+    assert "Audit: 1 fresh, 1 stale, 1 missing, 0 orphaned" in out
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    conn.close()
+    assert os.stat(db_file).st_mtime_ns == before
+    assert not os.path.exists(db_file + "-wal")
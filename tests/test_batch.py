@@ -0,0 +1,46 @@
+import io
+import json
+import sys
+
+import shards_search
+
+REQUESTS = [
+    {"id": 1, "query": "bootstrap", "top": 1},
+    {"id": 2, "keyword": "alphakey", "doc": "alpha", "full": True},
+    {"id": 3, "regex": "usage\\s+helpers"},
+    {"id": 4, "doc": "alpha"},
+    {"id": 5, "query": "nosuchcolumn:install"},
+]
+
+
+def _cli(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, "argv", ["shards_search.py", *args])
+    shards_search.main()
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def _check(responses):
+    by_id = {r.get("id"): r for r in responses}
+    assert [r["id"] for r in by_id[1]["results"]] == ["alpha:install"]
+    assert {r["id"] for r in by_id[2]["results"]} == {"alpha:alpha", "alpha:install", "alpha:usage"}
+    assert all("content" in r for r in by_id[2]["results"])
+    assert [r["id"] for r in by_id[3]["results"]] == ["alpha:usage"]
+    assert "content" not in by_id[3]["results"][0]
+    assert by_id[4]["error"].startswith("ValueError")
+    assert by_id[5]["error"].startswith("OperationalError")
+
+
+def test_batch_file(db_file, tmp_path, monkeypatch, capsys):
+    path = tmp_path / "requests.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in REQUESTS) + "\n\nnot json\n")
+    responses = _cli(monkeypatch, capsys, "--db", db_file, "--batch", str(path))
+    assert len(responses) == len(REQUESTS) + 1
+    _check(responses)
+    assert responses[-1]["error"].startswith("JSONDecodeError") and "id" not in responses[-1]
+
+
+def test_serve_answers_in_order(db_file, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "stdin", io.StringIO("".join(json.dumps(r) + "\n" for r in REQUESTS)))
+    responses = _cli(monkeypatch, capsys, "--db", db_file, "--serve")
+    assert [r["id"] for r in responses] == [1, 2, 3, 4, 5]
+    _check(responses)
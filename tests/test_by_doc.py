@@ -0,0 +1,38 @@
+import shards_db
+import shards_search
+
+GAMMA = (
+    "# Gamma\n\n## Bootstrap\n> [AI RULE] Bootstrap first.\nThe bootstrap bootstrap step.\n\n"
+    "## Bootstrap again\nMore bootstrap here.\n"
+)
+
+
+def _ingest_gamma(map_root, write_doc):
+    write_doc(map_root, "gamma", GAMMA)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+
+
+def test_by_doc_ranks_docs_and_caps_hits_per_doc(db_file, map_root, write_doc):
+    _ingest_gamma(map_root, write_doc)
+    results = shards_search.search_db_docs(db_file, "bootstrap", limit=2, per_doc=1)
+    assert [(r["doc_id"], r["doc_rank"], r["doc_hits"]) for r in results] == [("gamma", 1, 2), ("alpha", 2, 1)]
+    best = shards_search.search_db_bm25(db_file, "bootstrap", doc_filter="gamma", limit=1)
+    assert results[0]["id"] == best[0]["id"]
+    assert results[0]["doc_best"] == results[0]["rank"]
+
+
+def test_by_doc_request_matches_plain_search(db_file, map_root, write_doc):
+    _ingest_gamma(map_root, write_doc)
+    hits = shards_search.run_request(db_file, {"query": "bootstrap", "by_doc": True, "top": 1, "per_doc": 5})
+    plain = shards_search.search_db_bm25(db_file, "bootstrap", doc_filter="gamma", limit=None)
+    assert [h["id"] for h in hits] == [p["id"] for p in plain]
+
+
+def test_facets_count_sections_per_doc_and_hint(db_file, map_root, write_doc):
+    _ingest_gamma(map_root, write_doc)
+    assert shards_search.search_facets(db_file, "bootstrap") == {
+        "sections": 4,
+        "doc_id": {"gamma": 2, "alpha": 1, "beta": 1},
+        "ai_hint": {"AI RULE": 1},
+    }
+    assert shards_search.search_facets(db_file, "bootstrap", doc_filter="beta")["doc_id"] == {"beta": 1}
@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+import shards_db
+import shards_search
+
+
+@pytest.fixture(params=["memory", "file"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        yield shards_search.QueryCache()
+        return
+    cache = shards_search.FileQueryCache(str(tmp_path / "shards.db.qcache"))
+    yield cache
+    cache.close()
+
+
+def _ids(results):
+    return [r["id"] for r in results]
+
+
+def test_repeat_request_is_served_from_cache(db_file, cache):
+    request = {"query": "bootstrap", "top": 5}
+    first = shards_search.run_request(db_file, request, cache=cache)
+    again = shards_search.run_request(db_file, dict(request, id="ignored"), cache=cache)
+    assert again == first and _ids(first) == ["alpha:install", "beta:notes"]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+    shards_search.run_request(db_file, dict(request, top=1), cache=cache)
+    assert cache.stats()["misses"] == 2
+
+
+def test_ingest_invalidates_cached_results(db_file, map_root, write_doc, cache):
+    request = {"query": "bootstrap"}
+    assert _ids(shards_search.run_request(db_file, request, cache=cache)) == ["alpha:install", "beta:notes"]
+    write_doc(map_root, "beta", "# Beta\n\n## Notes\nNothing to see.\n")
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    assert _ids(shards_search.run_request(db_file, request, cache=cache)) == ["alpha:install"]
+    assert shards_db.main(["--map-root", map_root, "--drop-doc", "alpha"]) == 0
+    assert shards_search.run_request(db_file, request, cache=cache) == []
+    assert cache.stats()["hits"] == 0
+
+
+def test_unchanged_reingest_keeps_the_cache(db_file, map_root, cache):
+    request = {"keyword": "alphakey"}
+    shards_search.run_request(db_file, request, cache=cache)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    shards_search.run_request(db_file, request, cache=cache)
+    assert cache.stats()["hits"] == 1
+
+
+def test_lru_evicts_oldest_entry(db_file):
+    cache = shards_search.QueryCache(max_entries=2)
+    for query in ("bootstrap", "install", "usage", "bootstrap"):
+        shards_search.run_request(db_file, {"query": query}, cache=cache)
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"], stats["hits"]) == (2, 2, 0)
+
+
+def test_cache_stats_request(db_file):
+    cache = shards_search.QueryCache()
+    lines = ['{"query": "bootstrap"}', '{"query": "bootstrap"}', '{"op": "cache_stats", "id": 7}']
+    out = io.StringIO()
+    shards_search._serve_lines(db_file, lines, out, cache=cache)
+    response = json.loads(out.getvalue().splitlines()[-1])
+    assert response["id"] == 7
+    assert (response["cache"]["hits"], response["cache"]["misses"]) == (1, 1)
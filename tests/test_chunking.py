@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import shards_db
+import shards_search
+
+LONG_DOC = (
+    "# Gamma\n\n## Long\n"
+    "Opening paragraph about rollup behaviour and other words.\n\n"
+    "```\ncode line one two three four five six seven eight nine ten\n```\n\n"
+    "- first rollup item\n- second item\n\n"
+    "Closing paragraph that mentions rollup once more.\n\n"
+    "## Short\nA short section.\n"
+)
+
+
+@pytest.fixture
+def chunked_db(map_root, write_doc):
+    write_doc(map_root, "gamma", LONG_DOC)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all", "--chunk-tokens", "8"]) == 0
+    return shards_db.db_path(map_root)
+
+
+def _rows(db_file, doc_id):
+    conn = shards_db.connect(db_file)
+    try:
+        return [dict(r) for r in conn.execute("SELECT * FROM sections_full WHERE doc_id=? ORDER BY rowid", (doc_id,))]
+    finally:
+        conn.close()
+
+
+def test_oversized_section_is_stored_as_chunks(chunked_db):
+    rows = {r["id"]: r for r in _rows(chunked_db, "gamma")}
+    assert "gamma:long" not in rows and "gamma:short" in rows
+    chunks = sorted((r for r in rows.values() if r["parent_id"] == "gamma:long"), key=lambda r: r["chunk_no"])
+    assert [c["id"] for c in chunks] == [f"gamma:long#{n}" for n in range(1, len(chunks) + 1)]
+    assert len(chunks) >= 4
+    # The fenced block is never cut; everything else fits the cap.
+    fence = [c for c in chunks if "```" in c["content"]]
+    assert len(fence) == 1 and fence[0]["content"].count("```") == 2
+    assert all(c["token_count"] <= 8 for c in chunks if c is not fence[0])
+    ranges = [json.loads(c["line_range"]) for c in chunks]
+    assert all(a[1] < b[0] for a, b in zip(ranges, ranges[1:]))
+    assert len({c["content_hash"] for c in chunks}) == len(chunks)
+
+
+def test_rollup_reports_each_parent_once(chunked_db):
+    hits = shards_search.search_db_bm25(chunked_db, "rollup", doc_filter="gamma", limit=None)
+    assert len(hits) >= 3 and all(h["parent_id"] == "gamma:long" for h in hits)
+    (hit,) = shards_search.search_db_bm25(chunked_db, "rollup", doc_filter="gamma", limit=None, rollup=True)
+    assert hit["id"] == "gamma:long" and hit["best_chunk"] == hits[0]["id"]
+    assert hit["rank"] == hits[0]["rank"]
+    assert hit["content"].startswith("## Long\n\nOpening paragraph") and hit["content"].endswith("once more.")
+
+
+def test_changing_the_cap_rechunks(chunked_db, map_root):
+    assert shards_db.main(["--map-root", map_root, "--ingest-all", "--chunk-tokens", "0"]) == 0
+    rows = {r["id"]: r for r in _rows(chunked_db, "gamma")}
+    assert set(rows) == {"gamma:gamma", "gamma:long", "gamma:short"}
+    assert rows["gamma:long"]["parent_id"] is None
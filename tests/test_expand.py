@@ -0,0 +1,98 @@
+import pytest
+
+import shards_db
+import shards_search
+
+GUIDE = (
+    "# Guide\n\n## Setup\nSetup intro.\n\n"
+    "### Install\nInstall steps, see [usage](#usage) and [beta](../beta/beta.rewritten_v1.md).\n\n"
+    "### Configure\nConfigure steps.\n\n## Usage\nUsage text.\n"
+)
+
+
+@pytest.fixture
+def graph_db(map_root, write_doc):
+    write_doc(map_root, "guide", GUIDE)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    return shards_db.db_path(map_root)
+
+
+def _expanded(db_file, **request):
+    request = {"query": "install steps", "top": 1, **request}
+    return [
+        (r["id"], r.get("via"), r.get("hop"), r.get("of"))
+        for r in shards_search.run_request(db_file, request)
+    ]
+
+
+def _edges(db_file, doc_id):
+    conn = shards_db.connect(db_file)
+    try:
+        return {tuple(r) for r in conn.execute("SELECT src, kind, dst FROM section_edges WHERE doc_id=?", (doc_id,))}
+    finally:
+        conn.close()
+
+
+def test_edges_follow_headings_and_links(graph_db):
+    assert _edges(graph_db, "guide") == {
+        ("guide", "head", "guide:guide"),
+        ("guide:setup", "parent", "guide:guide"),
+        ("guide:usage", "parent", "guide:guide"),
+        ("guide:setup", "sibling", "guide:usage"),
+        ("guide:usage", "sibling", "guide:setup"),
+        ("guide:install", "parent", "guide:setup"),
+        ("guide:configure", "parent", "guide:setup"),
+        ("guide:install", "sibling", "guide:configure"),
+        ("guide:configure", "sibling", "guide:install"),
+        ("guide:install", "link", "guide:usage"),
+        ("guide:install", "link", "beta"),
+    }
+
+
+def test_one_hop_neighbourhood(graph_db):
+    assert _expanded(graph_db, expand="parent,siblings,links") == [
+        ("guide:install", None, None, None),
+        ("beta:beta", "link", 1, "guide:install"),
+        ("guide:configure", "sibling", 1, "guide:install"),
+        ("guide:setup", "parent", 1, "guide:install"),
+        ("guide:usage", "link", 1, "guide:install"),
+    ]
+    assert _expanded(graph_db, expand="parent") == [
+        ("guide:install", None, None, None),
+        ("guide:setup", "parent", 1, "guide:install"),
+    ]
+
+
+def test_hops_reach_further_and_report_each_section_once(graph_db):
+    ids = [row[0] for row in _expanded(graph_db, expand="parent,siblings", hops=2)]
+    assert ids[0] == "guide:install"
+    assert sorted(ids[1:]) == ["guide:configure", "guide:guide", "guide:setup", "guide:usage"]
+    hops = {row[0]: row[2] for row in _expanded(graph_db, expand="parent,siblings", hops=2)}
+    assert (hops["guide:setup"], hops["guide:guide"], hops["guide:usage"]) == (1, 2, 2)
+
+
+def test_neighbours_fit_the_token_budget(graph_db):
+    rows = shards_search.run_request(
+        graph_db, {"query": "install steps", "top": 1, "expand": "parent,siblings,links", "expand_tokens": 6}
+    )
+    neighbours = rows[1:]
+    assert [r["id"] for r in neighbours] == ["beta:beta", "guide:configure"]
+    assert sum(r["tokens"] for r in neighbours) <= 6
+
+
+def test_reingest_updates_edges(graph_db, map_root, write_doc):
+    write_doc(map_root, "guide", GUIDE.replace(" and [beta](../beta/beta.rewritten_v1.md)", ""), version=2)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    assert ("guide:install", "link", "beta") not in _edges(graph_db, "guide")
+    assert "beta:beta" not in [row[0] for row in _expanded(graph_db, expand="links")]
+
+
+def test_bad_requests(graph_db):
+    with pytest.raises(ValueError, match="Unknown --expand kinds"):
+        _expanded(graph_db, expand="cousins")
+    fed = shards_search.Federation([("a", graph_db)])
+    try:
+        with pytest.raises(ValueError, match="several indexes"):
+            shards_search.run_request(fed, {"query": "install", "expand": "parent"})
+    finally:
+        fed.close()
@@ -0,0 +1,91 @@
+import json
+import sys
+
+import pytest
+
+import shards_db
+import shards_search
+
+
+@pytest.fixture
+def other_db(tmp_path, write_doc):
+    root = str(tmp_path / "other" / "docs" / "MaraudersMap")
+    write_doc(root, "gamma", "# Gamma\n\n## Bootstrap\nThe bootstrap script, then the bootstrap check.\n")
+    assert shards_db.main(["--map-root", root, "--ingest-all"]) == 0
+    return shards_db.db_path(root)
+
+
+@pytest.fixture
+def federation(db_file, other_db):
+    fed = shards_search.Federation([("main", db_file), ("other", other_db)])
+    yield fed
+    fed.close()
+
+
+def test_hits_from_every_source_are_merged_and_tagged(federation):
+    results = shards_search.run_request(federation, {"query": "bootstrap", "top": 10})
+    assert sorted((r["source"], r["id"]) for r in results) == [
+        ("main", "alpha:install"),
+        ("main", "beta:notes"),
+        ("other", "gamma:bootstrap"),
+    ]
+    ranks = [r["rank"] for r in results]
+    assert ranks == sorted(ranks)
+    assert len(shards_search.run_request(federation, {"query": "bootstrap", "top": 2})) == 2
+
+
+def test_stronger_source_fills_the_top(db_file, tmp_path, write_doc):
+    # Two strong title hits in "strong"; main only mentions bootstrap once in
+    # content. A per-source normalized merge would alternate the sources.
+    root = str(tmp_path / "strong" / "MaraudersMap")
+    filler = "".join(f"## Topic {i}\nUnrelated text {i}.\n\n" for i in range(6))
+    write_doc(root, "gamma", "# Gamma\n\n## Bootstrap\nBootstrap bootstrap.\n\n## Bootstrap check\nBootstrap again.\n\n" + filler)
+    assert shards_db.main(["--map-root", root, "--ingest-all"]) == 0
+    fed = shards_search.Federation([("main", db_file), ("strong", shards_db.db_path(root))])
+    try:
+        results = shards_search.run_request(fed, {"query": "bootstrap", "top": 10})
+    finally:
+        fed.close()
+    assert [r["source"] for r in results] == ["strong", "strong", "main", "main"]
+    assert [r["rank"] for r in results] == sorted(r["rank"] for r in results)
+
+
+def test_keyword_hits_without_scores_are_merged(federation):
+    results = shards_search.run_request(federation, {"keyword": "alphakey", "top": 10})
+    assert {r["source"] for r in results} == {"main"}
+    assert len(results) == 3
+
+
+def test_budget_covers_the_merged_hits(federation):
+    results = shards_search.run_request(federation, {"query": "bootstrap", "max_tokens": 20})
+    assert results and sum(r["tokens"] for r in results) <= 20
+
+
+def test_sources_are_validated(db_file, tmp_path):
+    with pytest.raises(ValueError, match="duplicate"):
+        shards_search.Federation([("a", db_file), ("a", db_file)])
+    with pytest.raises(ValueError, match="not found"):
+        shards_search.Federation([("a", db_file), ("b", str(tmp_path / "missing.db"))])
+
+
+def test_registry_paths_resolve_against_its_directory(tmp_path, db_file, other_db):
+    (tmp_path / "named.json").write_text(json.dumps({"main": "MaraudersMap/shards.db"}))
+    assert shards_search.load_registry(str(tmp_path / "named.json")) == [("main", db_file)]
+    (tmp_path / "list.json").write_text(json.dumps([other_db, "MaraudersMap/shards.db"]))
+    assert shards_search.load_registry(str(tmp_path / "list.json")) == [
+        ("other", other_db),
+        ("MaraudersMap", db_file),
+    ]
+    (tmp_path / "bad.json").write_text('"shards.db"')
+    with pytest.raises(ValueError):
+        shards_search.load_registry(str(tmp_path / "bad.json"))
+
+
+def test_cli_repeated_db_serves_federated_requests(db_file, other_db, monkeypatch, capsys):
+    lines = [json.dumps({"id": 1, "query": "bootstrap", "top": 10}), json.dumps({"op": "cache_stats"})]
+    monkeypatch.setattr(sys, "stdin", iter(lines))
+    monkeypatch.setattr(sys, "argv", ["shards_search.py", "--db", db_file, "--db", other_db, "--serve"])
+    shards_search.main()
+    first, stats = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {r["source"] for r in first["results"]} == {"MaraudersMap", "other"}
+    assert set(stats["cache"]) == {"MaraudersMap", "other"}
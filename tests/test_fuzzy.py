@@ -0,0 +1,46 @@
+import pytest
+
+import shards_db
+import shards_search
+
+
+def _ids(results):
+    return sorted(r["id"] for r in results)
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = shards_search._connect_ro(db_file)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("query", ["bootstrp", "vootstrap", "bootst"])
+def test_misspelled_or_partial_terms_match(conn, query):
+    assert shards_search.search_db_bm25(conn, query) == []
+    assert _ids(shards_search.search_db_bm25(conn, query, fuzzy=True)) == ["alpha:install", "beta:notes"]
+
+
+def test_prefix_comes_first(conn):
+    query, expanded = shards_search._expand_query(conn, "scrip helpers")
+    assert expanded == {"scrip": ['"scrip"*', '"script"']}
+    assert query == '("scrip"* OR "script") AND "helpers"'
+
+
+@pytest.mark.parametrize("query", ["bootstrap", "title:install", '"usage helpers"', "boot*", "zzzzqqq"])
+def test_known_terms_and_fts_syntax_are_left_alone(conn, query):
+    assert shards_search._expand_query(conn, query)[1] == {}
+
+
+def test_fuzzy_batch_request(db_file):
+    results = shards_search.run_request(db_file, {"query": "alphakee", "fuzzy": True, "top": 10})
+    assert _ids(results) == ["alpha:alpha", "alpha:install", "alpha:usage"]
+
+
+def test_prefix_queries_use_the_prefix_index(db_file):
+    conn = shards_db.connect(db_file)
+    try:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name='sections_fts'").fetchone()[0]
+    finally:
+        conn.close()
+    assert "prefix='2 3 4'" in sql
@@ -0,0 +1,99 @@
+import pytest
+
+import shards_db
+import shards_search
+
+DIM = 256
+
+
+@pytest.fixture
+def vec_db(map_root):
+    assert shards_db.main(["--map-root", map_root, "--ingest-all", "--vectors", str(DIM)]) == 0
+    return shards_db.db_path(map_root)
+
+
+def _cosines(db, query_text):
+    conn = shards_db.connect(db)
+    try:
+        rows = conn.execute("SELECT id, title, content FROM sections_full").fetchall()
+    finally:
+        conn.close()
+    q = shards_db.section_vector(query_text, DIM)
+    return {
+        r["id"]: sum(a * b for a, b in zip(q, shards_db.section_vector(f"{r['title']}\n{r['content']}", DIM)))
+        for r in rows
+    }
+
+
+def _expected(db, query_text, alpha, fusion, brute_force, pool=shards_search.DEFAULT_HYBRID_POOL):
+    # Reference fusion from independently computed BM25 scores and cosines.
+    or_query = " OR ".join(query_text.split())
+    lexical = {r["id"]: -r["rank"] for r in shards_search.search_db_bm25(db, or_query, limit=pool)}
+    cosines = _cosines(db, query_text)
+    semantic = dict(sorted(cosines.items(), key=lambda x: -x[1])[:pool]) if brute_force else {}
+    semantic.update({i: cosines[i] for i in lexical})
+    if fusion == "linear":
+        top = max(lexical.values(), default=0.0) or 1.0
+        return {i: alpha * lexical.get(i, 0.0) / top + (1 - alpha) * semantic[i] for i in semantic}
+    lex_pos = {i: n for n, i in enumerate(sorted(lexical, key=lambda i: -lexical[i]))}
+    sem_pos = {i: n for n, i in enumerate(sorted(semantic, key=lambda i: -semantic[i]))}
+    k = shards_search.RRF_K
+    return {
+        i: alpha / (k + lex_pos.get(i, len(lex_pos)) + 1) + (1 - alpha) / (k + sem_pos[i] + 1) for i in semantic
+    }
+
+
+@pytest.mark.parametrize("fusion", ["linear", "rrf"])
+@pytest.mark.parametrize("brute_force", [False, True])
+@pytest.mark.parametrize("alpha", [0.0, 0.5, 1.0])
+def test_fused_scores_match_reference(vec_db, fusion, brute_force, alpha):
+    query = "bootstrap install"
+    results = shards_search.search_db_hybrid(
+        vec_db, query, limit=10, alpha=alpha, fusion=fusion, brute_force=brute_force
+    )
+    expected = _expected(vec_db, query, alpha, fusion, brute_force)
+    assert {r["id"]: -r["rank"] for r in results} == pytest.approx(expected, abs=1e-5)
+    scores = [-r["rank"] for r in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_brute_force_finds_sections_without_shared_words(vec_db):
+    assert shards_search.search_db_hybrid(vec_db, "helperz usagez") == []
+    results = shards_search.search_db_hybrid(vec_db, "helperz usagez", brute_force=True)
+    assert results[0]["id"] == "alpha:usage"
+
+
+def test_doc_filter_applies_to_both_pools(vec_db):
+    results = shards_search.search_db_hybrid(vec_db, "install notes", doc_filter="alpha", brute_force=True)
+    assert {r["doc_id"] for r in results} == {"alpha"}
+
+
+def test_requires_vectors(db_file):
+    with pytest.raises(ValueError, match="--vectors"):
+        shards_search.search_db_hybrid(db_file, "bootstrap")
+
+
+def test_unknown_fusion_is_rejected(vec_db):
+    with pytest.raises(ValueError, match="fusion"):
+        shards_search.search_db_hybrid(vec_db, "bootstrap", fusion="max")
+
+
+def test_vectors_follow_edits(vec_db, map_root, write_doc):
+    doc_root = write_doc(map_root, "alpha", "# Alpha\n\n## Install\nRun the setup wizard.\n", version=2)
+    assert shards_db.main(["--map-root", map_root, "--ingest", doc_root]) == 0
+    conn = shards_db.connect(vec_db)
+    try:
+        rows = conn.execute(
+            "SELECT s.title, s.content, v.vec FROM sections_full s LEFT JOIN section_vectors v ON v.section_rowid = s.rowid"
+        ).fetchall()
+        assert conn.execute("SELECT COUNT(*) FROM section_vectors").fetchone()[0] == len(rows) == 4
+    finally:
+        conn.close()
+    for r in rows:
+        assert r["vec"] == shards_db.section_vector(f"{r['title']}\n{r['content']}", DIM).tobytes()
+    assert shards_search.search_db_hybrid(vec_db, "setup wizard", alpha=0.0)[0]["id"] == "alpha:install"
+
+
+def test_hybrid_request(vec_db):
+    request = {"query": "install notes", "hybrid": True, "alpha": 1.0, "fusion": "rrf", "top": 1}
+    assert [r["id"] for r in shards_search.run_request(vec_db, request)] == ["beta:notes"]
@@ -0,0 +1,175 @@
+import os
+
+import pytest
+
+import shards_db
+
+
+def _dump(conn):
+    rows = [dict(r) for r in conn.execute("SELECT * FROM sections_full ORDER BY rowid")]
+    for r in rows:
+        del r["updated_at"]
+    return rows
+
+
+def test_parallel_ingest_matches_serial(tmp_path, map_root, write_doc):
+    for i in range(8):
+        write_doc(map_root, f"doc{i}", f"# Doc {i}\n\n## Part\nShared words and token{i}.\n")
+    dumps = []
+    for jobs in (1, 3):
+        conn = shards_db.connect(str(tmp_path / f"jobs{jobs}.db"))
+        with conn:
+            shards_db.init_schema(conn)
+        counts, timings = shards_db.ingest_all(conn, map_root, jobs=jobs, batch_docs=4)
+        assert (counts["docs"], counts["sections"]) == (10, 21)
+        assert set(timings) >= {"discover", "write", "commit", "total"}
+        hits = conn.execute("SELECT rowid FROM sections_fts WHERE sections_fts MATCH 'token5'").fetchall()
+        assert len(hits) == 1
+        dumps.append(_dump(conn))
+        conn.close()
+    assert dumps[0] == dumps[1]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_doc_vanishing_mid_ingest_is_counted_not_fatal(tmp_path, map_root, write_doc, monkeypatch, jobs):
+    write_doc(map_root, "gamma", "# Gamma\n\n## Part\nGone soon.\n")
+    scan = shards_db.scan_states
+
+    def scan_then_delete(root):
+        states = scan(root)
+        os.remove(states["gamma"]["rewritten_path"])
+        return states
+
+    monkeypatch.setattr(shards_db, "scan_states", scan_then_delete)
+    conn = shards_db.connect(str(tmp_path / "vanish.db"))
+    with conn:
+        shards_db.init_schema(conn)
+    counts, _ = shards_db.ingest_all(conn, map_root, jobs=jobs)
+    assert (counts["docs"], counts["docs_vanished"]) == (2, 1)
+    assert {r[0] for r in conn.execute("SELECT doc_id FROM doc_manifest")} == {"alpha", "beta"}
+    conn.close()
+
+
+@pytest.fixture
+def conn(map_root):
+    conn = shards_db.connect(shards_db.db_path(map_root))
+    with conn:
+        shards_db.init_schema(conn)
+    yield conn
+    conn.close()
+
+
+def _ingest(conn, map_root, **kwargs):
+    return shards_db.ingest_all(conn, map_root, **kwargs)[0]
+
+
+def _no_parsing(monkeypatch):
+    def fail(*args):
+        raise AssertionError("doc was parsed")
+
+    monkeypatch.setattr(shards_db, "_sections_from_markdown", fail)
+
+
+def test_unchanged_docs_are_skipped_by_stat(conn, map_root, monkeypatch):
+    first = _ingest(conn, map_root)
+    assert (first["docs"], first["sections"], first["upserted"]) == (2, 5, 5)
+    _no_parsing(monkeypatch)
+    again = _ingest(conn, map_root)
+    assert (again["files_skipped"], again["upserted"]) == (2, 0)
+    assert again["sections"] == 5
+
+
+def test_touched_identical_file_is_skipped_by_hash(conn, map_root, monkeypatch):
+    _ingest(conn, map_root)
+    path = os.path.join(map_root, "beta", "beta.rewritten_v1.md")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    _no_parsing(monkeypatch)
+    assert _ingest(conn, map_root)["files_skipped"] == 2
+    # The manifest now has the new mtime, so the next run skips by stat.
+    row = conn.execute("SELECT mtime_ns FROM doc_manifest WHERE doc_id='beta'").fetchone()
+    assert row["mtime_ns"] == st.st_mtime_ns + 10**9
+
+
+def test_force_reparses_every_doc(conn, map_root):
+    _ingest(conn, map_root)
+    counts = _ingest(conn, map_root, force=True)
+    assert (counts["files_skipped"], counts["upserted"], counts["sections_skipped"]) == (0, 0, 5)
+
+
+def _rowids(conn):
+    return {r["id"]: r["rowid"] for r in conn.execute("SELECT rowid, id FROM sections")}
+
+
+def test_edit_rewrites_only_changed_sections(conn, map_root, write_doc):
+    _ingest(conn, map_root)
+    before = _rowids(conn)
+    # Last section, so no other section's line_range moves.
+    write_doc(map_root, "alpha", "---\ntags: [alphakey, setup]\n---\n# Alpha\n\n## Install\nRun the bootstrap script.\n\n## Usage\nCall the new helpers.\n")
+    counts = _ingest(conn, map_root)
+    assert (counts["upserted"], counts["sections_skipped"], counts["files_skipped"]) == (1, 2, 1)
+    assert _rowids(conn) == before
+    content = conn.execute("SELECT content FROM sections_full WHERE id='alpha:usage'").fetchone()[0]
+    assert content == "## Usage\nCall the new helpers."
+    assert conn.execute("SELECT COUNT(*) FROM sections_fts WHERE sections_fts MATCH ?", ('"usage helpers"',)).fetchone()[0] == 0
+    # The old text left the blob store.
+    assert conn.execute("SELECT COUNT(*) FROM blobs WHERE content LIKE '%usage helpers%'").fetchone()[0] == 0
+
+
+def test_metadata_only_change_keeps_rows_and_index(conn, map_root, write_doc):
+    _ingest(conn, map_root)
+    before = _rowids(conn)
+    write_doc(map_root, "beta", "\n\n# Beta\n\n## Notes\nSee the install notes before the bootstrap.\n")
+    with shards_db.trace_statements(conn) as trace:
+        counts = _ingest(conn, map_root)
+    assert counts["upserted"] == 2
+    assert _rowids(conn) == before
+    line_range = conn.execute("SELECT line_range FROM sections WHERE id='beta:notes'").fetchone()[0]
+    assert line_range == "[5,6]"
+    # Only line_range moved: no FTS 'delete'/insert went through the triggers.
+    assert "INSERT" not in trace["nested_statements"]
+
+
+def test_removed_section_is_deleted_and_unindexed(conn, map_root, write_doc):
+    _ingest(conn, map_root)
+    write_doc(map_root, "alpha", "---\ntags: [alphakey, setup]\n---\n# Alpha\n\n## Install\nRun the bootstrap script.\n")
+    _ingest(conn, map_root)
+    ids = {r["id"] for r in conn.execute("SELECT id FROM sections WHERE doc_id='alpha'")}
+    assert ids == {"alpha:alpha", "alpha:install"}
+    assert conn.execute("SELECT COUNT(*) FROM sections_fts WHERE sections_fts MATCH 'helpers'").fetchone()[0] == 0
+    conn.execute("INSERT INTO sections_fts(sections_fts) VALUES('integrity-check')")
+    shards_db._check_integrity(conn)
+
+
+def test_shared_content_is_stored_once(conn, map_root, write_doc):
+    write_doc(map_root, "gamma", "# Gamma\n\n## Install\nRun the bootstrap script.\n")
+    _ingest(conn, map_root)
+    row = conn.execute(
+        "SELECT COUNT(DISTINCT blob_id) AS blobs, COUNT(*) AS sections FROM sections WHERE id IN ('alpha:install', 'gamma:install')"
+    ).fetchone()
+    assert (row["blobs"], row["sections"]) == (1, 2)
+    assert shards_db.blob_stats(conn)["content_bytes_saved"] == len("## Install\nRun the bootstrap script.")
+    # Both sections stay searchable on their own.
+    hits = conn.execute("SELECT rowid FROM sections_fts WHERE sections_fts MATCH 'script'").fetchall()
+    assert len(hits) == 2
+    assert shards_db.main(["--map-root", map_root, "--drop-doc", "gamma"]) == 0
+    refs = conn.execute(
+        "SELECT refs FROM blobs JOIN sections s ON s.blob_id = blobs.id WHERE s.id='alpha:install'"
+    ).fetchone()[0]
+    assert refs == 1
+    shards_db._check_integrity(conn)
+
+
+def test_blob_stats_read_recorded_sizes(conn, map_root, write_doc):
+    write_doc(map_root, "gamma", "# Gamma\n\n## Café\nRun the bootstrap script, naïvely.\n")
+    _ingest(conn, map_root)
+    with conn:
+        shards_db.set_content_codec(conn, "zlib", dict_bytes=0)
+    texts = [r[0] for r in conn.execute("SELECT content FROM sections_full")]
+    expected = sum(len(t.encode("utf-8")) for t in texts)
+
+    def no_inflate(value):
+        raise AssertionError("blob_stats inflated a blob")
+
+    conn.create_function("inflate", 1, no_inflate)
+    assert shards_db.blob_stats(conn)["content_bytes_referenced"] == expected
@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+
+import shards_db
+import shards_search
+
+
+@pytest.fixture
+def fragmented(map_root, write_doc):
+    # One commit per doc, so each FTS index starts with several segments.
+    for i in range(6):
+        write_doc(map_root, f"doc{i}", f"# Doc {i}\n\n## Body\n" + " ".join(["filler words"] * 2000) + f" marker{i}\n")
+    db_file = shards_db.db_path(map_root)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    for i in range(6):
+        write_doc(map_root, f"doc{i}", f"# Doc {i}\n\n## Body\nShort now, marker{i}.\n", version=2)
+        assert shards_db.main(["--map-root", map_root, "--ingest", f"{map_root}/doc{i}"]) == 0
+    conn = shards_db.connect(db_file)
+    yield conn, db_file
+    conn.close()
+
+
+def _search(db_file):
+    return [r["id"] for r in shards_search.search_db_bm25(db_file, "marker3 OR bootstrap", limit=None)]
+
+
+def test_optimize_leaves_one_segment_per_index(fragmented):
+    conn, db_file = fragmented
+    expected = _search(db_file)
+    before, after, timings = shards_db.maintain(conn, db_file, automerge=0)
+    for t in shards_db.FTS_TABLES:
+        assert before[f"{t}_segments"] > 1 and after[f"{t}_segments"] == 1
+        assert conn.execute(f"SELECT v FROM {t}_config WHERE k='automerge'").fetchone()[0] == 0
+    assert {"merge", "integrity", "analyze", "checkpoint"} <= set(timings)
+    assert _search(db_file) == expected
+
+
+def test_incremental_merge(fragmented):
+    conn, db_file = fragmented
+    before, after, _ = shards_db.maintain(conn, db_file, merge_pages=4)
+    assert after["sections_fts_segments"] < before["sections_fts_segments"]
+
+
+def test_vacuum_compacts_under_an_open_reader(fragmented):
+    conn, db_file = fragmented
+    reader = shards_search._connect_ro(db_file)
+    try:
+        expected = _search(reader)
+        generation = conn.execute("SELECT value FROM meta WHERE key='generation'").fetchone()[0]
+        before, after, _ = shards_db.maintain(conn, db_file, vacuum=True)
+        assert before["free_pages"] > 0 and after["free_pages"] == 0
+        assert after["bytes"] < before["bytes"]
+        assert conn.execute("SELECT value FROM meta WHERE key='generation'").fetchone()[0] != generation
+        assert _search(reader) == expected
+    finally:
+        reader.close()
+
+
+def test_integrity_check_reports_a_stale_index(fragmented):
+    conn, db_file = fragmented
+    with conn:
+        conn.execute("DROP TRIGGER sections_ad")
+        conn.execute("DELETE FROM sections WHERE doc_id='doc0'")
+    with pytest.raises(sqlite3.DatabaseError):
+        shards_db.maintain(conn, db_file)
+
+
+def test_maintain_cli(fragmented, map_root, capsys):
+    assert shards_db.main(["--map-root", map_root, "--maintain", "--vacuum"]) == 0
+    out = capsys.readouterr().out
+    assert "| sections_fts_segments |" in out and "vacuum=" in out
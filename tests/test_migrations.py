@@ -0,0 +1,120 @@
+import sqlite3
+
+import pytest
+
+import shards_db
+import shards_search
+
+# Schema written by the original shards_db.py (schema_version 2).
+V2_SCHEMA_SQL = """
+CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE sections(id TEXT PRIMARY KEY, doc_id TEXT NOT NULL, legacy_id TEXT NOT NULL, title TEXT, content TEXT, content_hash TEXT, token_count INTEGER, keywords TEXT, links TEXT, ai_hints TEXT, summary TEXT, line_range TEXT, file_path TEXT, updated_at TEXT);
+CREATE INDEX idx_sections_doc_id ON sections(doc_id);
+CREATE INDEX idx_sections_content_hash ON sections(content_hash);
+CREATE VIRTUAL TABLE sections_fts USING fts5(title, content, keywords, tokenize='porter unicode61', content='sections', content_rowid='rowid');
+CREATE TRIGGER sections_ai AFTER INSERT ON sections BEGIN INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
+CREATE TRIGGER sections_ad AFTER DELETE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); END;
+CREATE TRIGGER sections_au AFTER UPDATE ON sections BEGIN INSERT INTO sections_fts(sections_fts, rowid, title, content, keywords) VALUES('delete', old.rowid, old.title, old.content, old.keywords); INSERT INTO sections_fts(rowid, title, content, keywords) VALUES (new.rowid, new.title, new.content, new.keywords); END;
+INSERT INTO meta(key, value) VALUES('schema_version', '2');
+INSERT INTO meta(key, value) VALUES('created_at', '2025-01-01T00:00:00+00:00');
+"""
+
+
+def _v2_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(V2_SCHEMA_SQL)
+    rows = [
+        ("alpha:install", "alpha", "install", "Install", "## Install\nRun the bootstrap script.", '["alphakey"]'),
+        ("alpha:usage", "alpha", "usage", "Usage", "## Usage\nCall the helpers.", '["alphakey"]'),
+        ("beta:notes", "beta", "notes", "Notes", "## Notes\nRun the bootstrap script.", "[]"),
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT INTO sections(id, doc_id, legacy_id, title, content, content_hash, token_count, keywords, links, ai_hints, summary, line_range, file_path, updated_at) VALUES(?, ?, ?, ?, ?, NULL, 1, ?, '[]', '[]', '', '[1,2]', '', '')",
+            rows,
+        )
+    conn.close()
+    return path
+
+
+def _meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+    return row["value"] if row else None
+
+
+def _tables(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def test_failed_step_rolls_back_whole_upgrade(tmp_path, monkeypatch):
+    db_file = _v2_db(str(tmp_path / "shards.db"))
+    last = max(shards_db.MIGRATIONS)
+    step = shards_db.MIGRATIONS[last]
+
+    def broken(conn):
+        step(conn)
+        conn.execute("CREATE TABLE half_done(x)")
+        raise sqlite3.OperationalError("boom")
+
+    monkeypatch.setitem(shards_db.MIGRATIONS, last, broken)
+    conn = shards_db.connect(db_file)
+    with pytest.raises(sqlite3.OperationalError, match="boom"):
+        with conn:
+            shards_db.init_schema(conn)
+    conn.close()
+
+    conn = shards_db.connect(db_file)
+    assert _meta(conn, "schema_version") == "2"
+    assert _meta(conn, "generation") is None
+    assert not {"half_done", "sections_trigram", "section_keywords"} & _tables(conn)
+    assert conn.execute("SELECT COUNT(*) FROM sections").fetchone()[0] == 3
+    conn.close()
+
+
+def _schema(conn):
+    objects = {
+        (r["type"], r["name"])
+        for r in conn.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'")
+    }
+    columns = [r["name"] for r in conn.execute("PRAGMA table_info(sections)")]
+    return objects, sorted(columns)
+
+
+def test_v2_db_upgrades_to_current_schema(tmp_path):
+    db_file = _v2_db(str(tmp_path / "shards.db"))
+    conn = shards_db.connect(db_file)
+    with conn:
+        shards_db.init_schema(conn)
+    assert _meta(conn, "schema_version") == str(shards_db.SCHEMA_VERSION)
+    fresh = shards_db.connect(str(tmp_path / "fresh.db"))
+    with fresh:
+        shards_db.init_schema(fresh)
+    assert _schema(conn) == _schema(fresh)
+    fresh.close()
+
+    hits = shards_search.search_db_bm25(conn, "bootstrap", limit=10)
+    assert sorted(r["id"] for r in hits) == ["alpha:install", "beta:notes"]
+    hits = shards_search.search_db_regex(conn, "bootstrap script", limit=10)
+    assert sorted(r["id"] for r in hits) == ["alpha:install", "beta:notes"]
+    assert hits[0]["content"] == "## Install\nRun the bootstrap script."
+    hits = shards_search.search_db_keyword(conn, "alphakey", limit=10)
+    assert sorted(r["id"] for r in hits) == ["alpha:install", "alpha:usage"]
+    texts = [r[0] for r in conn.execute("SELECT content FROM sections_full")]
+    assert shards_db.blob_stats(conn)["content_bytes_unique"] == sum(len(t.encode("utf-8")) for t in texts)
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    conn.close()
+
+
+def test_upgraded_map_reingests(tmp_path):
+    map_root = tmp_path / "MaraudersMap"
+    doc_root = map_root / "alpha"
+    doc_root.mkdir(parents=True)
+    (doc_root / "alpha.rewritten_v1.md").write_text("# Alpha\n\n## Install\nRun the bootstrap script.\n")
+    _v2_db(shards_db.db_path(str(map_root)))
+    assert shards_db.main(["--map-root", str(map_root), "--ingest-all"]) == 0
+    conn = shards_db.connect(shards_db.db_path(str(map_root)))
+    assert _meta(conn, "schema_version") == str(shards_db.SCHEMA_VERSION)
+    ids = {r["id"] for r in conn.execute("SELECT id FROM sections WHERE doc_id='alpha'")}
+    assert ids == {"alpha:alpha", "alpha:install"}
+    assert conn.execute("SELECT COUNT(*) FROM doc_manifest").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,108 @@
+import json
+import sys
+
+import pytest
+
+import shards_db
+import shards_search
+
+
+@pytest.fixture
+def paged_db(tmp_path, write_doc):
+    # Six docs of six sections; "paging" repeats so many ranks tie.
+    root = str(tmp_path / "MaraudersMap")
+    for i in range(6):
+        parts = [
+            f"## Part {j}\n" + " ".join(["paging"] * (1 + (i + j) % 3) + ["filler"] * j)
+            for j in range(5)
+        ]
+        write_doc(root, f"doc{i}", f"---\ntags: [shared]\n---\n# Doc {i}\n\n" + "\n\n".join(parts) + "\n")
+    assert shards_db.main(["--map-root", root, "--ingest-all"]) == 0
+    return shards_db.db_path(root)
+
+
+def _pages(search, page_size):
+    hits, after = [], None
+    while True:
+        page = search(limit=page_size, after=after)
+        hits += page
+        if len(page) < page_size:
+            return hits
+        after = shards_search._cursor(page[-1])
+
+
+@pytest.mark.parametrize("page_size", [1, 4, 7])
+def test_bm25_pages_cover_the_full_ranking(paged_db, page_size):
+    full = shards_search.search_db_bm25(paged_db, "paging", limit=None)
+    assert len(full) == 30
+    pages = _pages(lambda **kw: shards_search.search_db_bm25(paged_db, "paging", **kw), page_size)
+    assert [r["id"] for r in pages] == [r["id"] for r in full]
+
+
+@pytest.mark.parametrize("page_size", [1, 5])
+def test_keyword_pages_cover_every_section(paged_db, page_size):
+    full = shards_search.search_db_keyword(paged_db, "shared", limit=None)
+    assert len(full) == 36
+    pages = _pages(lambda **kw: shards_search.search_db_keyword(paged_db, "shared", **kw), page_size)
+    assert [r["id"] for r in pages] == [r["id"] for r in full]
+
+
+def test_bm25_rejects_rowid_only_cursor(paged_db):
+    with pytest.raises(ValueError):
+        shards_search.search_db_bm25(paged_db, "paging", after="12")
+
+
+def _cli(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, "argv", ["shards_search.py", *args])
+    shards_search.main()
+    return capsys.readouterr()
+
+
+def test_next_page_hint(paged_db, monkeypatch, capsys):
+    page = shards_search.search_db_bm25(paged_db, "paging", limit=3)
+    out = _cli(monkeypatch, capsys, "--db", paged_db, "--no-cache", "--query", "paging", "--top", "3")
+    assert out.err.strip() == f"Next page: --after={shards_search._cursor(page[-1])}"
+
+
+def test_stats_keep_stderr_json(paged_db, monkeypatch, capsys):
+    page = shards_search.search_db_bm25(paged_db, "paging", limit=3)
+    out = _cli(monkeypatch, capsys, "--db", paged_db, "--no-cache", "--query", "paging", "--top", "3", "--stats")
+    stats = json.loads(out.err)
+    assert stats["next_after"] == shards_search._cursor(page[-1])
+    assert stats["counts"]["hits"] == 3
+
+
+@pytest.mark.parametrize(
+    "request_",
+    [
+        {"query": "paging", "top": 7, "after": None},
+        {"keyword": "shared", "top": 4, "full": True},
+        {"query": "paging", "max_tokens": 50},
+        {"regex": "paging filler", "top": 3},
+    ],
+)
+def test_iter_request_yields_run_request_hits(paged_db, request_):
+    conn = shards_db.connect(paged_db)
+    try:
+        assert list(shards_search.iter_request(conn, request_)) == shards_search.run_request(conn, request_)
+    finally:
+        conn.close()
+
+
+def test_iter_request_streams_plain_hits(paged_db, monkeypatch):
+    pulled = []
+    stream = shards_search._stream
+
+    def counting(*args):
+        for row in stream(*args):
+            pulled.append(row["id"])
+            yield row
+
+    monkeypatch.setattr(shards_search, "_stream", counting)
+    conn = shards_db.connect(paged_db)
+    try:
+        hits = shards_search.iter_request(conn, {"query": "paging", "top": 20})
+        assert next(hits)["id"] == pulled[0]
+        assert len(pulled) == 1
+    finally:
+        conn.close()
@@ -0,0 +1,105 @@
+import json
+import os
+import sys
+
+import pytest
+
+import shards_db
+import shards_search
+
+UNICODE_DOC = "# Délta\n\n## Café\nNaïve résumé — ünïcödé 🚀 text.\n\n## Plain\nAfter the emoji.\n"
+
+
+def _indexed(db_file):
+    conn = shards_db.connect(db_file)
+    try:
+        return {r["id"]: r["content"] for r in conn.execute("SELECT id, content FROM sections_full")}
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def read_db(map_root, write_doc):
+    write_doc(map_root, "delta", UNICODE_DOC)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    return shards_db.db_path(map_root)
+
+
+def test_sections_are_served_from_the_file(read_db):
+    indexed = _indexed(read_db)
+    entries = shards_search.read_sections(read_db, sorted(indexed))
+    assert [e["id"] for e in entries] == sorted(indexed)
+    for e in entries:
+        assert (e["served_from"], e["stale"]) == ("file", False)
+        assert e["content"] == indexed[e["id"]]
+        path = os.path.join(os.path.dirname(read_db), e["doc_id"], f"{e['doc_id']}.rewritten_v1.md")
+        with open(path, "rb") as f:
+            a, b = e["byte_range"]
+            assert f.read()[a:b].decode("utf-8") == e["content"]
+
+
+def test_crlf_file_is_served_by_raw_offsets(map_root):
+    path = os.path.join(map_root, "eps", "eps.rewritten_v1.md")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(UNICODE_DOC.replace("\n", "\r\n").encode("utf-8") + b"## Old Mac\rLone CR line.\r")
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    db_file = shards_db.db_path(map_root)
+    indexed = {k: v for k, v in _indexed(db_file).items() if k.startswith("eps:")}
+    entries = shards_search.read_sections(db_file, sorted(indexed))
+    with open(path, "rb") as f:
+        raw = f.read()
+    for e in entries:
+        assert e["served_from"] == "file"
+        assert e["content"] == indexed[e["id"]]
+        a, b = e["byte_range"]
+        assert raw[a:b].replace(b"\r\n", b"\n").replace(b"\r", b"\n").decode("utf-8") == e["content"]
+
+
+def test_unknown_and_repeated_ids(read_db):
+    entries = shards_search.read_sections(read_db, ["delta:caf", "nope", "delta:caf"])
+    assert [e["id"] for e in entries] == ["delta:caf"]
+    assert shards_search.read_sections(read_db, []) == []
+
+
+def test_parent_id_returns_the_whole_span(map_root, write_doc):
+    write_doc(map_root, "gamma", "# Gamma\n\n## Long\nFirst paragraph of words.\n\nSecond paragraph of words.\n")
+    assert shards_db.main(["--map-root", map_root, "--ingest-all", "--chunk-tokens", "4"]) == 0
+    db_file = shards_db.db_path(map_root)
+    (entry,) = shards_search.read_sections(db_file, ["gamma:long"])
+    assert entry["served_from"] == "file"
+    assert entry["content"] == "## Long\nFirst paragraph of words.\n\nSecond paragraph of words."
+
+
+def test_new_version_is_stale_until_reingested(read_db, map_root, write_doc):
+    write_doc(map_root, "beta", "# Beta\n\n## Notes\nRewritten notes.\n", version=2)
+    (entry,) = shards_search.read_sections(read_db, ["beta:notes"])
+    assert (entry["served_from"], entry["stale"]) == ("index", True)
+    assert entry["content"] == "## Notes\nSee the install notes before the bootstrap."
+    (entry,) = shards_search.read_sections(read_db, ["beta:notes"], reingest=True)
+    assert (entry["served_from"], entry["stale"]) == ("file", False)
+    assert entry["content"] == "## Notes\nRewritten notes."
+
+
+def test_bytes_changed_under_the_manifest_fall_back_to_the_index(read_db, map_root):
+    # Same size and mtime, so the manifest still matches; the slice hash does not.
+    path = os.path.join(map_root, "alpha", "alpha.rewritten_v1.md")
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        raw = f.read()
+    with open(path, "wb") as f:
+        f.write(raw.replace(b"bootstrap", b"BOOTSTRAP"))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    install, usage = shards_search.read_sections(read_db, ["alpha:install", "alpha:usage"])
+    assert (install["served_from"], install["stale"]) == ("index", True)
+    assert install["content"] == "## Install\nRun the bootstrap script."
+    assert (usage["served_from"], usage["stale"]) == ("file", False)
+
+
+def test_sections_op_and_cli(read_db, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "stdin", iter([json.dumps({"id": 7, "op": "sections", "ids": ["delta:plain"]})]))
+    monkeypatch.setattr(sys, "argv", ["shards_search.py", "--db", read_db, "--serve"])
+    shards_search.main()
+    (response,) = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert response["id"] == 7
+    assert [s["content"] for s in response["sections"]] == ["## Plain\nAfter the emoji."]
@@ -0,0 +1,59 @@
+import re
+
+import pytest
+
+import shards_db
+import shards_search
+
+EXTRA = {
+    "gamma": "# Gamma\n\n## Loader\nThe bootloader runs before the Bootstrap step.\n\n## Cafe\nCafé notes: 42 items, aaa.\n",
+    "delta": "# Delta\n\n## Setup\nInstallation notes for the setup helpers.\n",
+}
+
+PATTERNS = [
+    "bootstrap",
+    "Bootstrap",
+    "boot(strap|loader)",
+    "run\\s+the",
+    "install(ation)? notes",
+    "(?:pre)?set(up)?",
+    "[Uu]sage h.lpers",
+    "h.lpers",
+    "^## ",
+    "\\d+ items",
+    "a{3}",
+    "CAFÉ",
+    "notes?:",
+    "x*",
+]
+
+
+@pytest.fixture
+def regex_db(map_root, write_doc):
+    for doc_id, text in EXTRA.items():
+        write_doc(map_root, doc_id, text)
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    return shards_db.db_path(map_root)
+
+
+def _brute_force(db_file, pattern, flags):
+    regex = re.compile(pattern, flags)
+    conn = shards_db.connect(db_file)
+    try:
+        rows = conn.execute("SELECT id, content FROM sections_full").fetchall()
+    finally:
+        conn.close()
+    return sorted(r["id"] for r in rows if regex.search(r["content"] or ""))
+
+
+@pytest.mark.parametrize("flags", [0, re.IGNORECASE, re.MULTILINE])
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_trigram_narrowing_matches_brute_force(regex_db, pattern, flags):
+    results = shards_search.search_db_regex(regex_db, pattern, limit=1000, flags=flags)
+    assert sorted(r["id"] for r in results) == _brute_force(regex_db, pattern, flags)
+
+
+def test_literal_patterns_use_the_trigram_index():
+    assert shards_search._regex_trigram_query("boot(strap|loader)") == '"boot" AND ("strap" OR "loader")'
+    assert shards_search._regex_trigram_query("h.lpers") == '"lpers"'
+    assert shards_search._regex_trigram_query("x*") is None
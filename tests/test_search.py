@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+import shards_db
+import shards_search
+
+
+def _ids(results):
+    return [r["id"] for r in results]
+
+
+def test_query_spans_title_content_and_keywords(db_file):
+    # "alphakey" is only a frontmatter keyword, "bootstrap" only content.
+    assert _ids(shards_search.search_db_bm25(db_file, "alphakey bootstrap")) == ["alpha:install"]
+    assert _ids(shards_search.search_db_bm25(db_file, "alphakey usage")) == ["alpha:usage"]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("title:install", ["alpha:install"]),
+        ("content:bootstrap", ["alpha:install", "beta:notes"]),
+        ("{title content}: usage", ["alpha:usage"]),
+        ("keywords:setup", ["alpha:alpha", "alpha:install", "alpha:usage"]),
+        ("title:alpha AND content:bootstrap", []),
+    ],
+)
+def test_column_filters(db_file, query, expected):
+    assert sorted(_ids(shards_search.search_db_bm25(db_file, query, limit=None))) == expected
+
+
+def test_title_hits_outrank_content_hits(db_file):
+    results = shards_search.search_db_bm25(db_file, "install")
+    assert _ids(results) == ["alpha:install", "beta:notes"]
+    assert results[0]["rank"] < results[1]["rank"] < 0
+
+
+def test_snippet_highlights_content(db_file):
+    (hit,) = shards_search.search_db_bm25(db_file, "content:bootstrap", doc_filter="beta", snippet=80)
+    assert "**bootstrap**" in hit["snippet"]
+
+
+def test_reingest_replaces_indexed_text(db_file, map_root, write_doc):
+    write_doc(map_root, "beta", "# Beta\n\n## Notes\nSee the upgrade notes.\n")
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    assert _ids(shards_search.search_db_bm25(db_file, "upgrade")) == ["beta:notes"]
+    assert _ids(shards_search.search_db_bm25(db_file, "bootstrap")) == ["alpha:install"]
+    conn = shards_db.connect(db_file)
+    try:
+        shards_db._check_integrity(conn)
+    finally:
+        conn.close()
+
+
+def test_shared_blob_matches_every_section(db_file, map_root, write_doc):
+    write_doc(map_root, "gamma", "# Gamma\n\n## Install\nRun the bootstrap script.\n")
+    assert shards_db.main(["--map-root", map_root, "--ingest-all"]) == 0
+    assert sorted(_ids(shards_search.search_db_regex(db_file, r"bootstrap\s+script", limit=None))) == [
+        "alpha:install",
+        "gamma:install",
+    ]
+    assert sorted(_ids(shards_search.search_db_bm25(db_file, "script", limit=None))) == [
+        "alpha:install",
+        "gamma:install",
+    ]
+
+
+def test_bad_fts_syntax_raises(db_file):
+    with pytest.raises(sqlite3.OperationalError):
+        shards_search.search_db_bm25(db_file, "nosuchcolumn:install")
@@ -0,0 +1,11 @@
+import shards_stress
+
+
+def test_parallel_ingest_and_search(tmp_path, capsys):
+    # Scaled-down `shards_stress.py` run: every ingest and query must succeed
+    # and the DB must end up matching every doc's last revision.
+    rc = shards_stress.run(str(tmp_path / "MaraudersMap"), writers=4, readers=2, rounds=3, read_seconds=1.0)
+    out, err = capsys.readouterr()
+    assert rc == 0, err
+    assert "ingests=12 " in out and "queries=0 " not in out
+    assert "errors=0 stale_docs=0" in out
@@ -0,0 +1,52 @@
+import os
+import shutil
+
+import pytest
+
+import shards_db
+
+
+def _sections(conn, doc_id):
+    return {r["id"] for r in conn.execute("SELECT id FROM sections WHERE doc_id=?", (doc_id,))}
+
+
+def _conn(db_file):
+    conn = shards_db.connect(db_file)
+    with conn:
+        shards_db.init_schema(conn)
+    return conn
+
+
+def test_watch_catches_up_on_start(db_file, map_root, write_doc):
+    write_doc(map_root, "beta", "# Beta\n\n## Changes\nNew text.\n", version=2)
+    write_doc(map_root, "gamma", "# Gamma\n\n## Intro\nHello.\n")
+    shutil.rmtree(os.path.join(map_root, "alpha"))
+    conn = _conn(db_file)
+    try:
+        totals = shards_db.watch(conn, map_root, interval=0.01, debounce=0, cycles=1)
+        assert (totals["ingested"], totals["dropped"]) == (2, 1)
+        assert _sections(conn, "alpha") == set()
+        assert _sections(conn, "beta") == {"beta:beta", "beta:changes"}
+        assert _sections(conn, "gamma") == {"gamma:gamma", "gamma:intro"}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("debounce, ingested", [(0, 1), (60, 0)])
+def test_watch_reingests_a_saved_file_once_quiet(db_file, map_root, write_doc, monkeypatch, debounce, ingested):
+    saves = [lambda: write_doc(map_root, "beta", "# Beta\n\n## Notes\nEdited while watching.\n")]
+
+    def sleep(seconds):
+        if saves:
+            saves.pop()()
+
+    monkeypatch.setattr(shards_db.time, "sleep", sleep)
+    conn = _conn(db_file)
+    try:
+        totals = shards_db.watch(conn, map_root, interval=0.01, debounce=debounce, cycles=3)
+        assert (totals["cycles"], totals["ingested"], totals["dropped"]) == (3, ingested, 0)
+        content = conn.execute("SELECT content FROM sections_full WHERE id='beta:notes'").fetchone()[0]
+        expected = "Edited while watching." if ingested else "See the install notes before the bootstrap."
+        assert content == "## Notes\n" + expected
+    finally:
+        conn.close()